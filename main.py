@@ -1,7 +1,6 @@
 """
 Main entry point for the application.
 """
-from viztracer import log_sparse
 import traceback
 import pygame
 # Allow development on non-Raspberry Pi devices
@@ -13,9 +12,12 @@ except ImportError:
     RESIZEFLAG = True
 from src.pi4.lcd_ui import LCD_UI
 from src.pi4.fail_screen import FailScreen_UI
-from src.common.helper_functions import start_ui
+from src.common.helper_functions import start_ui, log_sparse
+from src.common.metrics import METRICS, MetricsSnapshotWriter
+from src.common.constants import METRICS_SERVER_ENABLED, CAPTURE_SERVER_ENABLED
 from src.pi4.mechanics_controller import System_Controller
 from src.pi4.vision_handler import Vision_Handler
+from src.pi4.supervisor import Subsystem_Supervisor
 class Component_Sorter:
     """
     Component Sorter class
@@ -38,13 +40,23 @@ class Component_Sorter:
         self.clk = pygame.time.Clock()
         self.lcdUI = LCD_UI(self.clk, self.visionHandler, callbacks, trainingMode, RESIZEFLAG, forceImage=forceImage)
         self.systemController.set_lcd_handle(self.lcdUI)
+        # Supervisor so failures only restart the affected subsystem
+        self.supervisor = Subsystem_Supervisor()
+        self.supervisor.register("camera", self.visionHandler.cameraFeed, restart=self.visionHandler.cameraFeed.restart)
+        self.supervisor.register("inference", isHealthy=self.visionHandler.inference_healthy, restart=self.visionHandler.restart_inference, \
+                                 process=lambda: getattr(self.visionHandler, "inferenceProcess", None))
+        self.supervisor.register("leds", self.systemController.leds, self.systemController.leds.is_healthy, self.systemController.leds.reset, \
+                                 lambda: self.systemController.leds.rainbowProcess)
+        self.supervisor.register("sweeper", self.systemController.sweeper, self.systemController.sweeper.is_healthy, self.systemController.sweeper.restart, \
+                                 lambda: self.systemController.sweeper.sort)
+        self.supervisor.register("conveyor", self.systemController.conveyor, restart=self.systemController.conveyor.restart)
 
     def close(self) -> None:
         """
         Close all the resources
         """
-        self.conveyorMotor.stop()
-        self.lcdUI.cameraFeed.vision.destroy()
+        self.systemController.conveyor.stop()
+        self.visionHandler.destroy()
         GPIO.cleanup()
 
 @log_sparse
@@ -53,13 +65,25 @@ def run(trainingMode:bool=False, enableInference:bool=True, forceImage:bool=Fals
     Run the main application
     """
     keepRunning = True
+    systemObj = None
     pygame.init()
+    metricsWriter = MetricsSnapshotWriter(METRICS).start()
+    metricsServer = None
+    if METRICS_SERVER_ENABLED:
+        from src.common.metrics_server import MetricsServer
+        metricsServer = MetricsServer(METRICS).start()
+    captureServer = None
+    if CAPTURE_SERVER_ENABLED:
+        from src.common.capture_server import CaptureServer
+        captureServer = CaptureServer().start()
     while keepRunning:
         try:
-            systemObj = Component_Sorter(trainingMode, enableInference, forceImage)
+            if systemObj is None:
+                systemObj = Component_Sorter(trainingMode, enableInference, forceImage)
+                systemObj.visionHandler.set_capture_server(captureServer)
             start_ui(
                 loopConditionFunc=systemObj.lcdUI.is_running,
-                loopFunction=[systemObj.lcdUI.draw],
+                loopFunction=[systemObj.lcdUI.draw, systemObj.supervisor.poll],
                 eventFunction=[systemObj.lcdUI.handle_events, systemObj.lcdUI.visionHandler.event_handler],
                 exitFunction=[systemObj.close],
                 clock=systemObj.clk,
@@ -68,13 +92,18 @@ def run(trainingMode:bool=False, enableInference:bool=True, forceImage:bool=Fals
                 resolution=systemObj.lcdUI.resolution
                 )
             keepRunning = systemObj.lcdUI.is_running()
+            systemObj = None
         except Exception as e:
+            traceback.print_exc()
+            # Restart only the failed subsystems and resume with everything else intact
+            if systemObj is not None and systemObj.supervisor.recover(e):
+                continue
             # Try call close function
             try:
                 systemObj.close()
             except:
                 pass
-            traceback.print_exc()
+            systemObj = None
             clk = pygame.time.Clock()
             failScreen = FailScreen_UI(clk, str(e))
             start_ui(
@@ -87,6 +116,11 @@ def run(trainingMode:bool=False, enableInference:bool=True, forceImage:bool=Fals
                     screen=failScreen.display,
                 )
             keepRunning = failScreen.keepRunning
+    metricsWriter.stop()
+    if metricsServer is not None:
+        metricsServer.stop()
+    if captureServer is not None:
+        captureServer.stop()
     pygame.quit()
 
 if __name__ == "__main__":
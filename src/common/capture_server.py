@@ -0,0 +1,138 @@
+"""
+Serves raw camera frames from the sorter over HTTP.
+The dataset builder pulls full resolution frames with CaptureClient instead of
+screenshotting the VNC window. Requests are answered from the pygame loop, which
+owns the camera surface, so the server thread only waits for the next frame.
+"""
+import threading
+import urllib.request
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy
+from src.common.constants import CAPTURE_SERVER_HOST, CAPTURE_SERVER_PORT, CAPTURE_TIMEOUT
+CONTENT_TYPE = "application/octet-stream"
+
+class CaptureRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /frame with the next camera frame as raw (height, width, BGR) bytes
+    """
+    def do_GET(self) -> None: # pylint: disable=invalid-name
+        """
+        Handle a frame request
+        """
+        if self.path.split("?")[0] != "/frame":
+            self.send_error(404)
+            return
+        frame = self.server.owner.wait_for_frame()
+        if frame is None:
+            self.send_error(503, "No camera frame available")
+            return
+        body = numpy.ascontiguousarray(frame, dtype=numpy.uint8).tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Frame-Shape", ",".join(str(size) for size in frame.shape))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_) -> None:
+        """
+        Keep requests out of the console
+        """
+
+class CaptureServer:
+    """
+    HTTP frame server running on a daemon thread, fed by fulfil from the pygame loop
+    """
+    def __init__(self, host:str=CAPTURE_SERVER_HOST, port:int=CAPTURE_SERVER_PORT, timeout:float=CAPTURE_TIMEOUT) -> None:
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = None
+        self.httpServer = ThreadingHTTPServer((host, port), CaptureRequestHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.owner = self
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> tuple:
+        """
+        Host and port the server is bound to, useful when binding to port 0
+        """
+        return self.httpServer.server_address
+
+    def start(self) -> "CaptureServer":
+        """
+        Start serving in the background
+        """
+        self.thread.start()
+        print(f"Serving camera frames on http://{self.address[0]}:{self.address[1]}/frame")
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the server
+        """
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def wait_for_frame(self) -> numpy.ndarray:
+        """
+        Wait for the pygame loop to provide the next frame, None if it does not in time.
+        Concurrent requests share the same frame.
+        """
+        with self.lock:
+            if self.pending is None:
+                self.pending = Future()
+            future = self.pending
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            return None
+
+    def fulfil(self, capture:callable) -> None:
+        """
+        Answer waiting requests with capture(), called every frame so it returns straight away when nothing is waiting
+        """
+        if self.pending is None:
+            return
+        with self.lock:
+            future, self.pending = self.pending, None
+        try:
+            future.set_result(capture())
+        except Exception as e: # pylint: disable=broad-except
+            future.set_exception(e)
+
+class CaptureClient:
+    """
+    Pulls frames from a CaptureServer
+    """
+    def __init__(self, url:str, timeout:float=CAPTURE_TIMEOUT) -> None:
+        self.url = url.rstrip("/") + "/frame"
+        self.timeout = timeout
+
+    def fetch(self) -> numpy.ndarray:
+        """
+        Get the next (height, width, BGR) frame, None if the server cannot be reached
+        """
+        try:
+            with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                shape = tuple(int(size) for size in response.headers["X-Frame-Shape"].split(","))
+                return numpy.frombuffer(response.read(), dtype=numpy.uint8).reshape(shape)
+        except (OSError, ValueError) as e:
+            print(f"Could not fetch a frame from {self.url}: {e}")
+            return None
+
+if __name__ == "__main__":
+    import time
+    # Serve a test pattern to a local client
+    server = CaptureServer(port=0).start()
+    pattern = numpy.random.randint(0, 255, (480, 640, 3), dtype=numpy.uint8)
+    client = CaptureClient(f"http://127.0.0.1:{server.address[1]}")
+    result = []
+    fetcher = threading.Thread(target=lambda: result.append(client.fetch()))
+    fetcher.start()
+    while fetcher.is_alive():
+        server.fulfil(lambda: pattern)
+        time.sleep(0.01)
+    print(f"Received {result[0].shape}, identical: {numpy.array_equal(result[0], pattern)}")
+    server.stop()
@@ -14,6 +14,7 @@ THEMEPARAMS = {
     "labelTextColour" : "#FFFFFF"
 }
 SHOW_CURSOR = True
+VIZTRACER_ENABLED = False
 COLOURS = {
     "red" : "#FF0000",
     "yellow" : "#FFA500",
@@ -56,3 +57,76 @@ MAX_POSITION = 100
 MOVE_INCREMENT = 5
 # Vision
 CLASSIFIER_PATH = "./src/vision/models/final/classifier.pt"
+ONNX_CLASSIFIER_PATH = "./src/vision/models/final/classifier.onnx"
+# One of ultralytics, onnx, openvino or two_stage
+INFERENCE_BACKEND = "ultralytics"
+# Two stage inference, a contour locator finds the part and only its crop is classified
+TWO_STAGE_CLASSIFIER = "ultralytics"
+LOCATOR_IMGSZ = 320
+LOCATOR_SCALE = 0.25
+LOCATOR_THRESHOLD = 60
+LOCATOR_MIN_AREA = 400
+LOCATOR_MARGIN = 0.2
+# Input resolution and region of interest picked by the inference tuner
+INFERENCE_TUNING_PATH = "./src/vision/models/final/inference_tuning.json"
+# Reuse results for frames that have not changed, the threshold is in bits of the hash
+INFERENCE_CACHE_ENABLED = True
+INFERENCE_CACHE_SIZE = 8
+INFERENCE_CACHE_THRESHOLD = 8
+INFERENCE_CACHE_TTL = 2.0
+INFERENCE_CACHE_HASH_SIZE = 16
+# Only display requests may be answered from the cache, sorting votes need fresh frames
+INFERENCE_CACHE_CONSUMERS = ["ui"]
+# Multi frame voting, confidences are 0-1 and times in seconds
+TRACK_IOU = 0.3
+VOTE_CONFIDENCE = 0.8
+VOTE_MIN_FRAMES = 2
+VOTE_MAJORITY = 0.6
+VOTE_FLOOR = 0.5
+VOTE_DEADLINE = 3.0
+# Wait before submitting another frame after a failed request
+VOTE_RETRY_DELAY = 0.1
+INFERENCE_CONFIDENCE = 0.25
+INFERENCE_IOU = 0.7
+INFERENCE_TIMEOUT = 5
+# Resistor value decoding, needs a band detector trained on the ResistorTrainer labels at BAND_DETECTOR_PATH
+RESISTOR_DECODING = False
+BAND_DETECTOR_PATH = "./src/vision/models/final/bands.pt"
+BAND_IMGSZ = 320
+BAND_CONFIDENCE = 0.4
+INFERENCE_QUEUE_SIZE = 4
+# Metrics
+METRICS_SNAPSHOT_INTERVAL = 60
+METRICS_LOG_PATH = "./logs/metrics.jsonl"
+METRICS_LOG_MAX_BYTES = 1000000
+METRICS_LOG_BACKUPS = 5
+HISTOGRAM_LOWEST = 0.0001
+HISTOGRAM_HIGHEST = 100
+HISTOGRAM_SUB_BUCKETS = 8
+METRICS_SERVER_ENABLED = False
+METRICS_SERVER_HOST = "127.0.0.1"
+METRICS_SERVER_PORT = 8000
+METRICS_PREFIX = "sorter_"
+# Camera frames served to the dataset builder, bound to every interface so it can be reached over the network
+CAPTURE_SERVER_ENABLED = False
+CAPTURE_SERVER_HOST = "0.0.0.0"
+CAPTURE_SERVER_PORT = 8001
+CAPTURE_TIMEOUT = 2.0
+# Frames the model is unsure about are kept for labelling, confidence is 0 to 1
+UNCERTAINTY_QUEUE_ENABLED = False
+UNCERTAINTY_QUEUE_PATH = "./datasets/uncertain"
+UNCERTAINTY_BAND = (0.3, 0.7)
+UNCERTAINTY_QUEUE_SIZE = 500
+UNCERTAINTY_INTERVAL = 2.0
+# Import time budgets in seconds for each entry point, measured with -X importtime
+IMPORT_TIME_BUDGETS = {
+    "main" : 4.0,
+    "src.pi4.lcd_ui" : 3.0,
+    "src.pi4.vision_handler" : 2.0,
+}
+# Modules that must only ever be imported on demand
+LAZY_IMPORTS = ["ultralytics", "torch", "onnxruntime", "openvino", "viztracer", "pyautogui", "pygetwindow", "customtkinter"]
+# Supervisor Parameters
+SUPERVISOR_POLL_INTERVAL = 1000
+SUPERVISOR_MAX_RECOVERIES = 5
+SUPERVISOR_RECOVERY_WINDOW = 300
@@ -4,7 +4,7 @@ Contains helper functions for the project.
 import subprocess
 import time
 import pygame
-from src.common.constants import UI_FRAMERATE
+from src.common.constants import UI_FRAMERATE, VIZTRACER_ENABLED
 
 def start_ui(loopConditionFunc:callable, loopFunction:list, eventFunction:list=None, exitFunction:list=None, manager:callable=None, screen:pygame.display=None, clock:pygame.time.Clock=None, resolution:tuple=(0, 1), framerate:int=UI_FRAMERATE) -> None:
     """
@@ -48,6 +48,15 @@ def start_ui(loopConditionFunc:callable, loopFunction:list, eventFunction:list=N
         pygame.display.flip()
     pygame.quit()
 
+def log_sparse(func:callable) -> callable:
+    """
+    Mark a function for viztracer, only importing viztracer when tracing is enabled
+    """
+    if not VIZTRACER_ENABLED:
+        return func
+    from viztracer import log_sparse as vizLogSparse # pylint: disable=import-outside-toplevel
+    return vizLogSparse(func)
+
 def wifi_restart() -> None:
     """
     Restart the WiFi connection
@@ -0,0 +1,23 @@
+"""
+Perceptual image hashing.
+A difference hash compares the brightness of neighbouring cells of a downscaled
+greyscale image, so near identical images have hashes a few bits apart.
+"""
+import numpy
+import cv2
+
+def dhash(image:numpy.ndarray, hashSize:int=8) -> int:
+    """
+    Difference hash of a (height, width, 3) or greyscale image, hashSize**2 bits long
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hashSize + 1, hashSize), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+def hamming(hash1:int, hash2:int) -> int:
+    """
+    Number of bits that differ between two hashes
+    """
+    return bin(hash1 ^ hash2).count("1")
@@ -0,0 +1,97 @@
+"""
+Import time profiler.
+Runs a fresh interpreter with -X importtime for an entry point and parses the
+report into per-module costs, so slow or unexpected imports can be found.
+Usage: python -m src.common.import_profiler main src.pi4.lcd_ui --top 15
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+from src.common.constants import IMPORT_TIME_BUDGETS, LAZY_IMPORTS
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$")
+
+def parse_importtime(report:str) -> list:
+    """
+    Parse -X importtime output into a list of module records, times in seconds
+    """
+    records = []
+    for line in report.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match is None:
+            continue
+        selfTime, cumulative, indent, module = match.groups()
+        records.append({
+            "module" : module,
+            "self" : int(selfTime) / 1e6,
+            "cumulative" : int(cumulative) / 1e6,
+            # Nested imports are indented by two spaces per level
+            "depth" : (len(indent) - 1) // 2,
+        })
+    return records
+
+def profile_imports(module:str, repeats:int=3) -> list:
+    """
+    Import module in a fresh interpreter and return the records of the fastest run
+    """
+    bestRecords, bestTotal = None, None
+    for _ in range(repeats):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT_DIR, capture_output=True, text=True, check=False)
+        if process.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+        records = parse_importtime(process.stderr)
+        total = total_import_time(records, module)
+        if bestTotal is None or total < bestTotal:
+            bestRecords, bestTotal = records, total
+    return bestRecords
+
+def total_import_time(records:list, module:str) -> float:
+    """
+    Cumulative time taken to import module, including everything it imports
+    """
+    for record in records:
+        if record["module"] == module and record["depth"] == 0:
+            return record["cumulative"]
+    return sum(record["self"] for record in records)
+
+def lazy_imports_loaded(records:list, lazyModules:list=LAZY_IMPORTS) -> list:
+    """
+    Get the modules that should have been imported lazily but were not
+    """
+    loaded = {record["module"].split(".")[0] for record in records}
+    return [module for module in lazyModules if module in loaded]
+
+def top_packages(records:list, count:int=10) -> list:
+    """
+    Aggregate self time per top level package and return the most expensive
+    """
+    packages = dict()
+    for record in records:
+        package = record["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + record["self"]
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:count]
+
+def print_report(module:str, records:list, count:int=10) -> None:
+    """
+    Print the import cost of an entry point
+    """
+    total = total_import_time(records, module)
+    budget = IMPORT_TIME_BUDGETS.get(module)
+    budgetStr = f" (budget {budget:.2f}s)" if budget is not None else ""
+    print(f"{module}: {total:.3f}s{budgetStr}")
+    for package, packageTime in top_packages(records, count):
+        print(f"    {package:<30} {packageTime*1000:8.1f}ms")
+    lazyLoaded = lazy_imports_loaded(records)
+    if lazyLoaded:
+        print(f"    Eagerly imported: {', '.join(lazyLoaded)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the import time of each entry point")
+    parser.add_argument("modules", nargs="*", default=list(IMPORT_TIME_BUDGETS), help="Modules to import, defaults to every budgeted entry point")
+    parser.add_argument("--top", type=int, default=10, help="Number of packages to show")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per module, the fastest is reported")
+    args = parser.parse_args()
+    for entryPoint in args.modules:
+        print_report(entryPoint, profile_imports(entryPoint, args.repeats), args.top)
@@ -0,0 +1,290 @@
+"""
+Central metrics registry shared by every subsystem.
+Counters, gauges and latency histograms live in shared memory so that the
+processes forked from the main process (inference, sweeper, LEDs) record into
+the same values. Metrics must therefore be created in the main process before
+the child processes are started, which is why modules keep module level handles.
+"""
+import os
+import json
+import math
+import time
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from src.common.constants import METRICS_SNAPSHOT_INTERVAL, METRICS_LOG_PATH, METRICS_LOG_MAX_BYTES, METRICS_LOG_BACKUPS, \
+    HISTOGRAM_LOWEST, HISTOGRAM_HIGHEST, HISTOGRAM_SUB_BUCKETS
+
+def metric_key(name:str, labels:dict) -> str:
+    """
+    Build the unique key of a metric, e.g. parts_sorted{class="resistor"}
+    """
+    if not labels:
+        return name
+    labelStr = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{labelStr}}}"
+
+class Counter:
+    """
+    Monotonically increasing value, e.g. number of parts sorted
+    """
+    kind = "counter"
+    def __init__(self, name:str, description:str="", labels:dict=None) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.value = multiprocessing.Value("d", 0.0)
+
+    def inc(self, amount:float=1) -> None:
+        """
+        Increment the counter
+        """
+        with self.value.get_lock():
+            self.value.value += amount
+
+    def get(self) -> float:
+        """
+        Get the current value
+        """
+        return self.value.value
+
+    def snapshot(self) -> float:
+        """
+        Get a JSON friendly snapshot
+        """
+        return self.get()
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, e.g. camera FPS or queue depth
+    """
+    kind = "gauge"
+    def set(self, value:float) -> None:
+        """
+        Set the gauge
+        """
+        self.value.value = value
+
+    def dec(self, amount:float=1) -> None:
+        """
+        Decrement the gauge
+        """
+        self.inc(-amount)
+
+class LatencyHistogram:
+    """
+    HDR style histogram with log-linear buckets.
+    Every doubling of the value is split into HISTOGRAM_SUB_BUCKETS buckets, so
+    percentiles are accurate to a fixed relative error across the whole range.
+    Bucket 0 catches values below the lowest trackable value and the last
+    bucket catches values above the highest.
+    """
+    kind = "histogram"
+    def __init__(self, name:str, description:str="", labels:dict=None, lowest:float=HISTOGRAM_LOWEST, highest:float=HISTOGRAM_HIGHEST, subBuckets:int=HISTOGRAM_SUB_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.lowest = lowest
+        self.subBuckets = subBuckets
+        self.bucketWidth = math.log(2) / subBuckets
+        self.numBuckets = int(math.ceil(math.log(highest / lowest) / self.bucketWidth)) + 2
+        # Shared memory, guarded by a single lock
+        self.counts = multiprocessing.Array("L", self.numBuckets, lock=False)
+        self.totals = multiprocessing.Array("d", 3, lock=False) # count, sum, max
+        self.lock = multiprocessing.Lock()
+
+    def bucket_index(self, value:float) -> int:
+        """
+        Get the bucket a value falls into
+        """
+        if value <= self.lowest:
+            return 0
+        return min(self.numBuckets - 1, 1 + int(math.log(value / self.lowest) / self.bucketWidth))
+
+    def upper_bound(self, index:int) -> float:
+        """
+        Get the upper bound of a bucket
+        """
+        if index >= self.numBuckets - 1:
+            return math.inf
+        return self.lowest * math.exp(index * self.bucketWidth)
+
+    def record(self, value:float) -> None:
+        """
+        Record a single value, in seconds for latencies
+        """
+        index = self.bucket_index(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.totals[0] += 1
+            self.totals[1] += value
+            if value > self.totals[2]:
+                self.totals[2] = value
+
+    @contextmanager
+    def time(self):
+        """
+        Time the body of a with statement
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def get_counts(self) -> tuple:
+        """
+        Get a consistent copy of the buckets and totals
+        """
+        with self.lock:
+            return list(self.counts), list(self.totals)
+
+    def percentile(self, percent:float, counts:list=None, totals:list=None) -> float:
+        """
+        Get the value below which percent% of the recorded values fall
+        """
+        if counts is None:
+            counts, totals = self.get_counts()
+        if totals[0] == 0:
+            return 0.0
+        target = max(1, math.ceil(totals[0] * percent / 100))
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(self.upper_bound(index), totals[2])
+        return totals[2]
+
+    def snapshot(self) -> dict:
+        """
+        Get a JSON friendly summary
+        """
+        counts, totals = self.get_counts()
+        count, total, maximum = totals
+        return {
+            "count" : int(count),
+            "mean" : total / count if count else 0.0,
+            "p50" : self.percentile(50, counts, totals),
+            "p90" : self.percentile(90, counts, totals),
+            "p99" : self.percentile(99, counts, totals),
+            "max" : maximum,
+        }
+
+class MetricsRegistry:
+    """
+    Holds every metric, keyed by name and labels
+    """
+    def __init__(self) -> None:
+        self.metrics = dict()
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+
+    def get_or_create(self, metricType:type, name:str, description:str, labels:dict, **kwargs) -> object:
+        """
+        Get an existing metric or create it
+        """
+        key = metric_key(name, labels)
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = metricType(name, description, labels, **kwargs)
+                self.metrics[key] = metric
+            elif type(metric) is not metricType: # pylint: disable=unidiomatic-typecheck
+                raise TypeError(f"Metric {key} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name:str, description:str="", **labels) -> Counter:
+        """
+        Get or create a counter
+        """
+        return self.get_or_create(Counter, name, description, labels)
+
+    def gauge(self, name:str, description:str="", **labels) -> Gauge:
+        """
+        Get or create a gauge
+        """
+        return self.get_or_create(Gauge, name, description, labels)
+
+    def histogram(self, name:str, description:str="", **labels) -> LatencyHistogram:
+        """
+        Get or create a latency histogram
+        """
+        return self.get_or_create(LatencyHistogram, name, description, labels)
+
+    def collect(self) -> list:
+        """
+        Get every metric, sorted by key
+        """
+        with self.lock:
+            return [self.metrics[key] for key in sorted(self.metrics)]
+
+    def total(self, name:str) -> float:
+        """
+        Sum a counter or gauge over all of its labels
+        """
+        return sum(metric.get() for metric in self.collect() if metric.name == name and metric.kind != "histogram")
+
+    def snapshot(self) -> dict:
+        """
+        Get a JSON friendly snapshot of every metric
+        """
+        snapshot = {"time" : time.time(), "uptime" : time.time() - self.startTime, "metrics" : {}}
+        for metric in self.collect():
+            snapshot["metrics"][metric_key(metric.name, metric.labels)] = metric.snapshot()
+        return snapshot
+
+class MetricsSnapshotWriter:
+    """
+    Periodically appends registry snapshots as JSON lines to a rotating file
+    """
+    def __init__(self, registry:MetricsRegistry, path:str=METRICS_LOG_PATH, interval:float=METRICS_SNAPSHOT_INTERVAL) -> None:
+        self.registry = registry
+        self.interval = interval
+        self.stopEvent = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.logger = logging.getLogger(f"metrics.{path}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            self.logger.addHandler(RotatingFileHandler(path, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS, encoding="utf-8"))
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> "MetricsSnapshotWriter":
+        """
+        Start writing snapshots in the background
+        """
+        self.thread.start()
+        return self
+
+    def write(self) -> None:
+        """
+        Write a single snapshot
+        """
+        self.logger.info(json.dumps(self.registry.snapshot()))
+
+    def run(self) -> None:
+        """
+        Snapshot loop
+        """
+        while not self.stopEvent.wait(self.interval):
+            self.write()
+
+    def stop(self) -> None:
+        """
+        Stop the writer, flushing a final snapshot
+        """
+        self.stopEvent.set()
+        self.write()
+
+# Process wide registry
+METRICS = MetricsRegistry()
+
+if __name__ == "__main__":
+    import random
+    latency = METRICS.histogram("inference_latency", "Time from frame capture to result")
+    for _ in range(10000):
+        latency.record(random.lognormvariate(-1.5, 0.4))
+    METRICS.counter("parts_sorted", "Parts sorted", **{"class" : "resistor"}).inc(5)
+    print(json.dumps(METRICS.snapshot(), indent=4))
@@ -0,0 +1,120 @@
+"""
+Optional Prometheus exporter for the metrics registry.
+Serves the registry in the Prometheus text format from a daemon thread so that
+scrapes never block the pygame loop.
+"""
+import math
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from src.common.constants import METRICS_SERVER_HOST, METRICS_SERVER_PORT, METRICS_PREFIX
+from src.common.metrics import METRICS, MetricsRegistry, metric_key
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_value(value:float) -> str:
+    """
+    Format a sample value the way Prometheus expects
+    """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def to_prometheus(registry:MetricsRegistry, prefix:str=METRICS_PREFIX) -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+    Histograms are exported with one bucket per doubling of the value.
+    """
+    lines = []
+    described = set()
+    for metric in registry.collect():
+        name = prefix + metric.name
+        if metric.kind == "counter" and not name.endswith("_total"):
+            name += "_total"
+        # HELP and TYPE once per metric family
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {metric.description or metric.name}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+        if metric.kind != "histogram":
+            lines.append(f"{metric_key(name, metric.labels)} {format_value(metric.get())}")
+            continue
+        counts, totals = metric.get_counts()
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            lastBucket = index == len(counts) - 1
+            if index % metric.subBuckets == 0 or lastBucket:
+                bound = "+Inf" if lastBucket else f"{metric.upper_bound(index):.6g}"
+                lines.append(f"{metric_key(name + '_bucket', {**metric.labels, 'le' : bound})} {cumulative}")
+        lines.append(f"{metric_key(name + '_sum', metric.labels)} {format_value(totals[1])}")
+        lines.append(f"{metric_key(name + '_count', metric.labels)} {format_value(totals[0])}")
+    return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /metrics with the registry of the owning server
+    """
+    def do_GET(self) -> None: # pylint: disable=invalid-name
+        """
+        Handle a scrape
+        """
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = to_prometheus(self.server.registry).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_) -> None:
+        """
+        Keep scrapes out of the console
+        """
+
+class MetricsServer:
+    """
+    HTTP exporter running on a daemon thread
+    """
+    def __init__(self, registry:MetricsRegistry=METRICS, host:str=METRICS_SERVER_HOST, port:int=METRICS_SERVER_PORT) -> None:
+        self.httpServer = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.registry = registry
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> tuple:
+        """
+        Host and port the server is bound to, useful when binding to port 0
+        """
+        return self.httpServer.server_address
+
+    def start(self) -> "MetricsServer":
+        """
+        Start serving in the background
+        """
+        self.thread.start()
+        print(f"Serving metrics on http://{self.address[0]}:{self.address[1]}/metrics")
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the server
+        """
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+if __name__ == "__main__":
+    import random
+    import urllib.request
+    # Scrape a local server bound to a free port
+    METRICS.counter("parts_sorted", "Components sorted per class", **{"class" : "resistor"}).inc(3)
+    latency = METRICS.histogram("inference_latency_seconds", "Time from sending a frame to receiving its result")
+    for _ in range(1000):
+        latency.record(random.uniform(0.1, 0.6))
+    server = MetricsServer(port=0).start()
+    with urllib.request.urlopen(f"http://{server.address[0]}:{server.address[1]}/metrics", timeout=5) as response:
+        print(response.read().decode("utf-8"))
+    server.stop()
@@ -60,4 +60,4 @@ def Color(_, __, ___) -> int: return 0
 class YOLO:
     def __init__(self, _) -> None: pass
     def __call__(self, _) -> None: pass
-    def predict(self, *_) -> None: pass
\ No newline at end of file
+    def predict(self, *_, **__) -> None: pass
\ No newline at end of file
@@ -8,6 +8,8 @@ import pygame.camera as pycam
 from src.common.constants import CAMERA_RESOLUTION, CAMERA_FRAMERATE
 from src.common.helper_functions import start_ui
 from src.common.simulate import FakeCamera
+from src.common.metrics import METRICS
+CAMERA_ERRORS = METRICS.counter("camera_errors", "Frames replaced by the fake camera because the real camera failed")
 class CameraFeed:
     def __init__(self, cameraDisplay:pygame.display, trainingMode:bool=False) -> None:
         self.cameraDisplay = cameraDisplay
@@ -35,6 +37,18 @@ class CameraFeed:
                 self.realCamera = None
         return
 
+    def restart(self) -> None:
+        """
+        Reconnect to the camera after a failure
+        """
+        try:
+            if self.realCamera is not None:
+                self.realCamera.stop()
+        except:
+            pass
+        self.realCamera = None
+        self.set_camera()
+
     def get_frame(self) -> pygame.Surface:
         """
         Get the current frame from the camera
@@ -42,6 +56,7 @@ class CameraFeed:
         try:
             self.currentFrame = self.realCamera.get_image(self.currentFrame)
         except:
+            CAMERA_ERRORS.inc()
             self.currentFrame = self.fakeCamera.get_image(self.currentFrame)
             self.set_camera()
         return self.currentFrame
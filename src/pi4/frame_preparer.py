@@ -0,0 +1,42 @@
+"""
+Prepares camera frames for inference and display.
+The model input is made from a view of the surface's pixels in a single colour
+conversion pass, replacing the array3d copy, the swapaxes and the colour
+conversion in the inference process. Preview surfaces are scaled into buffers
+that are reused across frames.
+"""
+import numpy
+import pygame
+import cv2
+
+class Frame_Preparer:
+    """
+    Converts surfaces to model input and scaled previews
+    """
+    def __init__(self) -> None:
+        # Preview surfaces by size
+        self.previews = dict()
+
+    def model_input(self, surface:pygame.Surface) -> numpy.ndarray:
+        """
+        Get a (height, width, BGR) contiguous array of a surface.
+        A new array every time, as it is queued for the inference process and pickled later.
+        """
+        try:
+            pixels = pygame.surfarray.pixels3d(surface)
+        except ValueError:
+            # Surfaces without 24 or 32 bit pixels cannot be viewed directly
+            pixels = pygame.surfarray.array3d(surface)
+        frame = cv2.cvtColor(pixels.swapaxes(0, 1), cv2.COLOR_RGB2BGR)
+        # Release the view so the surface is unlocked
+        del pixels
+        return frame
+
+    def preview(self, surface:pygame.Surface, size:tuple) -> pygame.Surface:
+        """
+        Scale a surface into the reused preview surface of that size
+        """
+        size = tuple(size)
+        if size not in self.previews:
+            self.previews[size] = pygame.Surface(size, 0, surface)
+        return pygame.transform.scale(surface, size, self.previews[size])
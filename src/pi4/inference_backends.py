@@ -0,0 +1,397 @@
+"""
+Inference backends for the classifier.
+Every backend takes a (height, width, BGR) frame and returns Detections, so the
+inference process does not care which runtime produced them. The ONNX Runtime
+and OpenVINO backends skip the ultralytics predictor and do letterboxing, OBB
+decoding and NMS in NumPy, which is much cheaper per call on the Pi. The two
+stage backend finds the part with contours and only classifies its crop.
+Usage: python -m src.pi4.inference_backends ./datasets/full/current/images/test
+"""
+import os
+import json
+import time
+import numpy
+import cv2
+from src.common.constants import CLASSIFIER_PATH, ONNX_CLASSIFIER_PATH, INFERENCE_CONFIDENCE, INFERENCE_IOU, TWO_STAGE_CLASSIFIER, \
+    LOCATOR_IMGSZ, LOCATOR_SCALE, LOCATOR_THRESHOLD, LOCATOR_MIN_AREA, LOCATOR_MARGIN, INFERENCE_TUNING_PATH
+LETTERBOX_COLOUR = (114, 114, 114)
+# Offset added to box centres per class so NMS only suppresses boxes of the same class
+CLASS_OFFSET = 7680
+
+class Detections:
+    """
+    Oriented boxes found in a frame, sorted by descending confidence.
+    boxes is (N, 4, 2) corners in frame pixels, conf is (N,) and cls is (N,) class numbers.
+    """
+    def __init__(self, boxes:numpy.ndarray=None, conf:numpy.ndarray=None, cls:numpy.ndarray=None) -> None:
+        self.boxes = numpy.zeros((0, 4, 2), numpy.float32) if boxes is None else boxes
+        self.conf = numpy.zeros(0, numpy.float32) if conf is None else conf
+        self.cls = numpy.zeros(0, numpy.int64) if cls is None else cls
+
+    def __len__(self) -> int:
+        return len(self.conf)
+
+    def offset(self, x:int, y:int) -> "Detections":
+        """
+        Move the boxes from crop to frame coordinates
+        """
+        self.boxes = self.boxes + numpy.array([x, y], dtype=self.boxes.dtype)
+        return self
+
+def letterbox(frame:numpy.ndarray, size:tuple, buffers:dict=None) -> tuple:
+    """
+    Resize a frame to fit size (height, width) keeping its aspect ratio and pad the rest.
+    Returns the padded image, the scale and the (x, y) padding.
+    Pass a dict as buffers to reuse the padded image for every frame resized to the same size.
+    """
+    height, width = frame.shape[:2]
+    gain = min(size[0] / height, size[1] / width)
+    newWidth, newHeight = int(round(width * gain)), int(round(height * gain))
+    padX, padY = (size[1] - newWidth) / 2, (size[0] - newHeight) / 2
+    top, bottom = int(round(padY - 0.1)), int(round(padY + 0.1))
+    left, right = int(round(padX - 0.1)), int(round(padX + 0.1))
+    if buffers is None:
+        if (newWidth, newHeight) != (width, height):
+            frame = cv2.resize(frame, (newWidth, newHeight), interpolation=cv2.INTER_LINEAR)
+        return cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOUR), gain, (left, top)
+    # One canvas per output size, so crops of every size share it. The padding only has to be refilled when the frame size changes.
+    placement = (top, left, newHeight, newWidth)
+    if size not in buffers:
+        buffers[size] = [numpy.empty((size[0], size[1], 3), numpy.uint8), None, None]
+    canvas, lastPlacement, resized = buffers[size]
+    if placement != lastPlacement:
+        canvas[:] = LETTERBOX_COLOUR
+        resized = numpy.empty((newHeight, newWidth, 3), numpy.uint8)
+        buffers[size][1:] = [placement, resized]
+    if (newWidth, newHeight) != (width, height):
+        cv2.resize(frame, (newWidth, newHeight), dst=resized, interpolation=cv2.INTER_LINEAR)
+        frame = resized
+    canvas[top:top + newHeight, left:left + newWidth] = frame
+    return canvas, gain, (left, top)
+
+def to_tensor(image:numpy.ndarray, out:numpy.ndarray=None) -> numpy.ndarray:
+    """
+    Convert a BGR image to a (1, 3, height, width) RGB float tensor in [0, 1], written into out if given
+    """
+    if out is None:
+        out = numpy.empty((1, 3) + image.shape[:2], numpy.float32)
+    numpy.multiply(image[..., ::-1].transpose(2, 0, 1), numpy.float32(1 / 255), out=out[0], casting="unsafe")
+    return out
+
+def regularize_rboxes(rboxes:numpy.ndarray) -> numpy.ndarray:
+    """
+    Make width the long side of each (cx, cy, w, h, angle) box and keep the angle in [0, pi)
+    """
+    x, y, w, h, t = rboxes.T
+    swap = h > w
+    return numpy.stack([x, y, numpy.where(swap, h, w), numpy.where(swap, w, h), numpy.where(swap, t + numpy.pi / 2, t) % numpy.pi], axis=1)
+
+def xywhr_to_corners(rboxes:numpy.ndarray) -> numpy.ndarray:
+    """
+    Convert (N, 5) (cx, cy, w, h, angle) boxes to (N, 4, 2) corners
+    """
+    centre = rboxes[:, :2]
+    cos, sin = numpy.cos(rboxes[:, 4:5]), numpy.sin(rboxes[:, 4:5])
+    vec1 = numpy.concatenate([rboxes[:, 2:3] / 2 * cos, rboxes[:, 2:3] / 2 * sin], axis=1)
+    vec2 = numpy.concatenate([-rboxes[:, 3:4] / 2 * sin, rboxes[:, 3:4] / 2 * cos], axis=1)
+    return numpy.stack([centre + vec1 + vec2, centre + vec1 - vec2, centre - vec1 - vec2, centre - vec1 + vec2], axis=1)
+
+def covariance(rboxes:numpy.ndarray) -> tuple:
+    """
+    Covariance terms of the gaussian each (cx, cy, w, h, angle) box is treated as
+    """
+    a, b = rboxes[:, 2] ** 2 / 12, rboxes[:, 3] ** 2 / 12
+    cos, sin = numpy.cos(rboxes[:, 4]), numpy.sin(rboxes[:, 4])
+    return a * cos ** 2 + b * sin ** 2, a * sin ** 2 + b * cos ** 2, (a - b) * cos * sin
+
+def probiou(rboxes1:numpy.ndarray, rboxes2:numpy.ndarray, eps:float=1e-7) -> numpy.ndarray:
+    """
+    Pairwise probabilistic IoU of two sets of oriented boxes, (N, M)
+    """
+    x1, y1 = rboxes1[:, 0:1], rboxes1[:, 1:2]
+    x2, y2 = rboxes2[None, :, 0], rboxes2[None, :, 1]
+    a1, b1, c1 = (term[:, None] for term in covariance(rboxes1))
+    a2, b2, c2 = (term[None] for term in covariance(rboxes2))
+    denominator = (a1 + a2) * (b1 + b2) - (c1 + c2) ** 2 + eps
+    t1 = ((a1 + a2) * (y1 - y2) ** 2 + (b1 + b2) * (x1 - x2) ** 2) / denominator * 0.25
+    t2 = ((c1 + c2) * (x2 - x1) * (y1 - y2)) / denominator * 0.5
+    t3 = numpy.log(denominator / (4 * numpy.sqrt(numpy.clip(a1 * b1 - c1 ** 2, 0, None) * numpy.clip(a2 * b2 - c2 ** 2, 0, None)) + eps) + eps) * 0.5
+    bd = numpy.clip(t1 + t2 + t3, eps, 100.0)
+    return 1 - numpy.sqrt(1.0 - numpy.exp(-bd) + eps)
+
+def polygon_iou(corners1:numpy.ndarray, corners2:numpy.ndarray) -> float:
+    """
+    Exact IoU of two (4, 2) oriented boxes
+    """
+    corners1, corners2 = cv2.convexHull(corners1.astype(numpy.float32)), cv2.convexHull(corners2.astype(numpy.float32))
+    inter, _ = cv2.intersectConvexConvex(corners1, corners2)
+    union = cv2.contourArea(corners1) + cv2.contourArea(corners2) - inter
+    return inter / union if union > 0 else 0
+
+def nms_rotated(rboxes:numpy.ndarray, scores:numpy.ndarray, threshold:float) -> numpy.ndarray:
+    """
+    Indices of the boxes to keep, highest score first.
+    A box is dropped if it overlaps any higher scoring box, as ultralytics does.
+    """
+    order = numpy.argsort(-scores, kind="stable")
+    ious = numpy.triu(probiou(rboxes[order], rboxes[order]), k=1)
+    return order[ious.max(axis=0, initial=0) < threshold]
+
+def decode_obb(output:numpy.ndarray, gain:float, pad:tuple, conf:float=INFERENCE_CONFIDENCE, iou:float=INFERENCE_IOU) -> Detections:
+    """
+    Decode a raw (1, 4 + classes + 1, anchors) YOLOv8 OBB output into Detections in frame pixels
+    """
+    predictions = output[0].T
+    scores = predictions[:, 4:-1]
+    cls = scores.argmax(axis=1)
+    best = scores[numpy.arange(len(cls)), cls]
+    keep = best > conf
+    predictions, cls, best = predictions[keep], cls[keep], best[keep]
+    if len(best) == 0:
+        return Detections()
+    rboxes = regularize_rboxes(numpy.concatenate([predictions[:, :4], predictions[:, -1:]], axis=1))
+    offsetBoxes = rboxes.copy()
+    offsetBoxes[:, :2] += cls[:, None] * CLASS_OFFSET
+    keep = nms_rotated(offsetBoxes, best, iou)
+    rboxes, cls, best = rboxes[keep], cls[keep], best[keep]
+    # Undo the letterbox
+    rboxes[:, :2] -= pad
+    rboxes[:, :4] /= gain
+    return Detections(xywhr_to_corners(rboxes).astype(numpy.float32), best.astype(numpy.float32), cls)
+
+class Inference_Backend:
+    """
+    Interface every backend implements
+    """
+    name = "base"
+    def __init__(self, modelPath:str, imgsz:int=None) -> None:
+        self.modelPath = modelPath
+        self.imgsz = imgsz
+        # Region of interest as (x0, y0, x1, y1) fractions of the frame
+        self.roi = None
+
+    def load(self) -> "Inference_Backend":
+        """
+        Import the runtime and load the model
+        """
+        raise NotImplementedError
+
+    def predict(self, frame:numpy.ndarray) -> Detections:
+        """
+        Find the components in a (height, width, BGR) frame
+        """
+        raise NotImplementedError
+
+    def predict_roi(self, frame:numpy.ndarray) -> Detections:
+        """
+        Find the components in the region of interest of a frame, or the whole frame if there is none
+        """
+        if self.roi is None:
+            return self.predict(frame)
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = (int(round(fraction * size)) for fraction, size in zip(self.roi, (width, height, width, height)))
+        return self.predict(frame[y0:y1, x0:x1]).offset(x0, y0)
+
+    def warm_up(self, shape:tuple) -> float:
+        """
+        Run a dummy frame through the model so the first real frame is not slow, returns the time taken
+        """
+        start = time.time()
+        self.predict_roi(numpy.zeros(shape, dtype=numpy.uint8))
+        return time.time() - start
+
+class Ultralytics_Backend(Inference_Backend):
+    """
+    The ultralytics predictor, falling back to the simulated YOLO off the Pi
+    """
+    name = "ultralytics"
+    def load(self) -> "Inference_Backend":
+        try:
+            from ultralytics import YOLO # pylint: disable=import-outside-toplevel
+            print("Using ultralytics YOLO!")
+        except ImportError:
+            from src.common.simulate import YOLO # pylint: disable=import-outside-toplevel
+            print("Using simulated YOLO!")
+        self.model = YOLO(self.modelPath)
+        return self
+
+    def predict(self, frame:numpy.ndarray) -> Detections:
+        # Exported models have a fixed input size, only the predictor can change it
+        sizeArgs = {"imgsz" : self.imgsz} if self.imgsz is not None else {}
+        results = self.model.predict(frame, conf=INFERENCE_CONFIDENCE, iou=INFERENCE_IOU, verbose=False, **sizeArgs)
+        if not results or results[0].obb is None:
+            return Detections()
+        obb = results[0].obb
+        return Detections(obb.xyxyxyxy.cpu().numpy(), obb.conf.cpu().numpy(), obb.cls.cpu().numpy().astype(numpy.int64))
+
+class ONNX_Backend(Inference_Backend):
+    """
+    An exported ONNX model run with ONNX Runtime on the CPU
+    """
+    name = "onnx"
+    def load(self) -> "Inference_Backend":
+        import onnxruntime # pylint: disable=import-outside-toplevel
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.modelPath, options, providers=["CPUExecutionProvider"])
+        modelInput = self.session.get_inputs()[0]
+        self.inputName = modelInput.name
+        self.inputSize = tuple(modelInput.shape[2:4])
+        self.buffers = dict()
+        self.tensor = numpy.empty((1, 3) + self.inputSize, numpy.float32)
+        return self
+
+    def run(self, tensor:numpy.ndarray) -> numpy.ndarray:
+        """
+        Run the model on a prepared tensor
+        """
+        return self.session.run(None, {self.inputName : tensor})[0]
+
+    def predict(self, frame:numpy.ndarray) -> Detections:
+        image, gain, pad = letterbox(frame, self.inputSize, self.buffers)
+        return decode_obb(self.run(to_tensor(image, self.tensor)), gain, pad)
+
+class OpenVINO_Backend(ONNX_Backend):
+    """
+    The same ONNX model compiled with OpenVINO, faster on x86 CPUs
+    """
+    name = "openvino"
+    def load(self) -> "Inference_Backend":
+        import openvino # pylint: disable=import-outside-toplevel
+        self.model = openvino.Core().compile_model(self.modelPath, "CPU")
+        self.inputSize = tuple(self.model.inputs[0].shape[2:4])
+        self.buffers = dict()
+        self.tensor = numpy.empty((1, 3) + self.inputSize, numpy.float32)
+        return self
+
+    def run(self, tensor:numpy.ndarray) -> numpy.ndarray:
+        return self.model(tensor)[self.model.outputs[0]]
+
+class Contour_Locator:
+    """
+    Finds the part on the belt by how far each pixel is from the belt colour.
+    Works on a downscaled frame, the belt is taken to be the median colour.
+    """
+    def __init__(self, scale:float=LOCATOR_SCALE, threshold:int=LOCATOR_THRESHOLD, minArea:int=LOCATOR_MIN_AREA, margin:float=LOCATOR_MARGIN) -> None:
+        self.scale = scale
+        self.threshold = threshold
+        self.minArea = minArea * scale ** 2
+        self.margin = margin
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+    def locate(self, frame:numpy.ndarray) -> tuple:
+        """
+        Get the (x0, y0, x1, y1) region of a (height, width, BGR) frame containing the part, None if the belt is empty
+        """
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        lab = cv2.cvtColor(cv2.GaussianBlur(small, (5, 5), 0), cv2.COLOR_BGR2LAB).astype(numpy.int16)
+        background = numpy.median(lab.reshape(-1, 3), axis=0).astype(numpy.int16)
+        mask = numpy.where(numpy.abs(lab - background).sum(axis=2) > self.threshold, 255, 0).astype(numpy.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = [contour for contour in contours if cv2.contourArea(contour) >= self.minArea]
+        if not contours:
+            return None
+        # Leads and bodies can separate, so enclose every large blob
+        corners = cv2.boxPoints(cv2.minAreaRect(numpy.concatenate(contours))) / self.scale
+        (x0, y0), (x1, y1) = corners.min(axis=0), corners.max(axis=0)
+        padding = self.margin * max(x1 - x0, y1 - y0)
+        height, width = frame.shape[:2]
+        return (int(max(0, x0 - padding)), int(max(0, y0 - padding)), int(min(width, x1 + padding)), int(min(height, y1 + padding)))
+
+class Two_Stage_Backend(Inference_Backend):
+    """
+    Locates the part with contours then runs the classifier on its crop only at a low resolution.
+    Falls back to the whole frame when nothing is found.
+    """
+    name = "two_stage"
+    def __init__(self, modelPath:str, imgsz:int=LOCATOR_IMGSZ) -> None:
+        super().__init__(modelPath, imgsz)
+        self.locator = Contour_Locator()
+        self.classifier = create_backend(TWO_STAGE_CLASSIFIER, modelPath)
+        self.classifier.imgsz = imgsz
+
+    def load(self) -> "Inference_Backend":
+        self.classifier.load()
+        return self
+
+    def predict(self, frame:numpy.ndarray) -> Detections:
+        # The tuner may change the input size after creation
+        self.classifier.imgsz = self.imgsz
+        region = self.locator.locate(frame)
+        if region is None:
+            return self.classifier.predict(frame)
+        x0, y0, x1, y1 = region
+        return self.classifier.predict(frame[y0:y1, x0:x1]).offset(x0, y0)
+
+BACKENDS = {
+    "ultralytics" : (Ultralytics_Backend, CLASSIFIER_PATH),
+    "onnx" : (ONNX_Backend, ONNX_CLASSIFIER_PATH),
+    "openvino" : (OpenVINO_Backend, ONNX_CLASSIFIER_PATH),
+}
+BACKENDS["two_stage"] = (Two_Stage_Backend, BACKENDS[TWO_STAGE_CLASSIFIER][1])
+
+def create_backend(name:str, modelPath:str=None) -> Inference_Backend:
+    """
+    Create a backend by name, using its default model if no path is given
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name}, expected one of {', '.join(BACKENDS)}")
+    backendClass, defaultPath = BACKENDS[name]
+    return backendClass(modelPath or defaultPath)
+
+def apply_tuning(backend:Inference_Backend, path:str=INFERENCE_TUNING_PATH) -> Inference_Backend:
+    """
+    Use the input size and region of interest the tuner picked for this backend, if there are any
+    """
+    if not os.path.isfile(path):
+        return backend
+    with open(path, "r", encoding="utf-8") as f:
+        tuning = json.load(f)
+    if tuning.get("backend") != backend.name:
+        print(f"Ignoring tuning for the {tuning.get('backend')} backend")
+        return backend
+    backend.imgsz = tuning.get("imgsz") or backend.imgsz
+    backend.roi = tuning.get("roi")
+    print(f"Using tuned input size {backend.imgsz} and region {backend.roi}")
+    return backend
+
+def compare_backends(reference:Inference_Backend, candidate:Inference_Backend, frames:list) -> dict:
+    """
+    Run both backends over the same frames and report their latency and how often the top detection agrees
+    """
+    stats = {"frames" : len(frames), "classMatches" : 0, "ious" : [], reference.name : [], candidate.name : []}
+    for frame in frames:
+        detections = []
+        for backend in (reference, candidate):
+            start = time.time()
+            detections.append(backend.predict(frame))
+            stats[backend.name].append(time.time() - start)
+        expected, actual = detections
+        if len(expected) == 0 or len(actual) == 0:
+            stats["classMatches"] += len(expected) == len(actual)
+            continue
+        stats["classMatches"] += int(expected.cls[0]) == int(actual.cls[0])
+        stats["ious"].append(polygon_iou(expected.boxes[0], actual.boxes[0]))
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Check a backend matches ultralytics and compare their speed")
+    parser.add_argument("images", help="Folder of test images")
+    parser.add_argument("--backend", default="onnx", choices=list(BACKENDS), help="Backend to compare against ultralytics")
+    parser.add_argument("--model", default=None, help="Model for the backend, defaults to the one in the constants")
+    parser.add_argument("--limit", type=int, default=100, help="Maximum number of images")
+    args = parser.parse_args()
+    imagePaths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images) if f.lower().endswith((".jpg", ".png")))[:args.limit]
+    testFrames = [cv2.imread(path) for path in imagePaths]
+    referenceBackend = create_backend("ultralytics").load()
+    candidateBackend = create_backend(args.backend, args.model).load()
+    for backend in (referenceBackend, candidateBackend):
+        backend.warm_up(testFrames[0].shape)
+    results = compare_backends(referenceBackend, candidateBackend, testFrames)
+    print(f"{results['frames']} frames, top class agrees on {results['classMatches']}")
+    if results["ious"]:
+        print(f"Top box IoU mean {numpy.mean(results['ious']):.3f}, min {numpy.min(results['ious']):.3f}")
+    for backendName in (referenceBackend.name, candidateBackend.name):
+        print(f"{backendName:<12} {numpy.mean(results[backendName])*1000:8.1f}ms per frame")
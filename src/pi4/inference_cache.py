@@ -0,0 +1,61 @@
+"""
+Cache of inference results keyed by a perceptual hash of the frame.
+While the belt is stopped the same scene is sent for inference again and again,
+so a frame whose hash is within a few bits of a recent one reuses its result.
+"""
+import time
+from collections import OrderedDict
+import numpy
+from src.common.constants import INFERENCE_CACHE_SIZE, INFERENCE_CACHE_THRESHOLD, INFERENCE_CACHE_TTL, INFERENCE_CACHE_HASH_SIZE
+from src.common.image_hash import dhash, hamming
+
+class Inference_Cache:
+    """
+    Least recently used cache of results, entries expire after ttl seconds
+    """
+    def __init__(self, size:int=INFERENCE_CACHE_SIZE, threshold:int=INFERENCE_CACHE_THRESHOLD, ttl:float=INFERENCE_CACHE_TTL, \
+                 hashSize:int=INFERENCE_CACHE_HASH_SIZE) -> None:
+        self.size = size
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hashSize = hashSize
+        # Hash to (time stored, result)
+        self.entries = OrderedDict()
+
+    def key(self, frame:numpy.ndarray, roi:list=None) -> int:
+        """
+        Hash the region of interest of a frame
+        """
+        if roi is not None:
+            height, width = frame.shape[:2]
+            x0, y0, x1, y1 = (int(round(fraction * size)) for fraction, size in zip(roi, (width, height, width, height)))
+            frame = frame[y0:y1, x0:x1]
+        return dhash(frame, self.hashSize)
+
+    def get(self, key:int) -> object:
+        """
+        Get the result of the most recent similar frame, None if there is none
+        """
+        now = time.time()
+        for storedKey in [k for k, (stored, _) in self.entries.items() if now - stored > self.ttl]:
+            del self.entries[storedKey]
+        for storedKey in reversed(self.entries):
+            if hamming(key, storedKey) <= self.threshold:
+                self.entries.move_to_end(storedKey)
+                return self.entries[storedKey][1]
+        return None
+
+    def put(self, key:int, result:object) -> None:
+        """
+        Store a result, evicting the least recently used if full
+        """
+        self.entries[key] = (time.time(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Forget every result
+        """
+        self.entries.clear()
@@ -13,7 +13,12 @@ from pygame_gui.elements import UIHorizontalSlider, UILabel, UIButton
 from src.common.constants import LCD_RESOLUTION, CAMERA_DISPLAY_SIZE, WIDGET_PADDING, STAT_REFRESH_INTERVAL, BG_COLOUR, THEMEJSON, SHOW_CURSOR, TRAINING_MODE_CAMERA_SIZE, COLOURS, MOVE_INCREMENT, MAX_POSITION
 from src.common.helper_functions import start_ui, wifi_restart
 from src.common.custom_pygame_widgets import CustomToggleButton
+from src.common.metrics import METRICS
 from src.pi4.vision_handler import Vision_Handler
+from src.pi4.result_broker import INFERENCE_LATENCY
+# Metrics
+CPU_USAGE = METRICS.gauge("cpu_percent", "CPU usage of the Pi")
+RAM_USAGE = METRICS.gauge("ram_percent", "RAM usage of the Pi")
 
 class LCD_UI:
     def __init__(self, clock:pygame.time.Clock, visionHandler:Vision_Handler, callbacks:dict={}, trainingMode:bool=False, resizeable:bool=False, forceImage:bool=False) -> None:
@@ -52,6 +57,8 @@ class LCD_UI:
             "update_inference_time" : self.set_latency,
             "update_confidence" : self.set_confidence,
             "update_class" : self.set_class,
+            "update_value" : self.set_value,
+            "update_status" : self.set_status,
         })
 
     def set_latency(self, latency:int) -> None:
@@ -93,6 +100,25 @@ class LCD_UI:
         """
         self.UIElements["class_label"].set_text(cls)
 
+    def set_value(self, value:str) -> None:
+        """
+        Set the value, only known for resistors
+        """
+        if "value_label" not in self.UIElements:
+            return
+        self.UIElements["value_label"].set_text(value or "N/A")
+
+    def set_status(self, status:str, description:str) -> None:
+        """
+        Set the status, used to report model loading progress
+        """
+        if "status_label" not in self.UIElements:
+            return
+        self.UIElements["status_label"].set_text(status)
+        self.UIElements["status_label"].text_colour = pygame.Color(COLOURS["green"] if status == "Ready" else COLOURS["yellow"])
+        self.UIElements["status_label"].rebuild()
+        self.UIElements["status_description"].set_text(description)
+
     def is_running(self) -> bool:
         """
         Check if the UI is running
@@ -436,6 +462,9 @@ class LCD_UI:
         if event.type == self.statUpdateEvent:
             cpuUsage = psutil.cpu_percent()
             ramUsage = psutil.virtual_memory().percent
+            CPU_USAGE.set(cpuUsage)
+            RAM_USAGE.set(ramUsage)
+            self.update_metrics_summary()
             # Colour thresholds
             cpuColour = self.cpuColour
             if cpuUsage > 80:
@@ -496,6 +525,16 @@ class LCD_UI:
                     imageCounter += 1
                 pygame.image.save(image, f"./src/vision/photos/image-{imageCounter:03}.jpg")
 
+    def update_metrics_summary(self) -> None:
+        """
+        Show the shift totals and latency percentiles from the metrics registry
+        """
+        if "status_description" not in self.UIElements or not self.visionHandler.is_ready():
+            return
+        latency = INFERENCE_LATENCY.snapshot()
+        partsSorted = int(METRICS.total("parts_sorted"))
+        self.UIElements["status_description"].set_text(f"Sorted: {partsSorted} p50/p99: {latency['p50']*1000:.0f}/{latency['p99']*1000:.0f}ms")
+
     def draw(self) -> None:
         """
         Draw the UI
@@ -3,6 +3,7 @@ Mechanics controller
 """
 from multiprocessing import Queue
 import time
+import threading
 import multiprocessing
 import colorsys
 try:
@@ -14,9 +15,20 @@ except ImportError:
     from src.common.simulate import GPIO
     from src.common.simulate import PixelStrip, Color
     print("Simulating missing hardware!")
-from src.common.constants import GPIO_PINS, SPEED_MULTIPLIER, LIGHT_COLOUR, DEFAULT_SPEED, BIN_THRESHOLD, SWEEPER_MM_PER_STEP
+from src.common.constants import GPIO_PINS, SPEED_MULTIPLIER, LIGHT_COLOUR, DEFAULT_SPEED, BIN_THRESHOLD, SWEEPER_MM_PER_STEP, CAMERA_FRAMERATE
+from src.common.metrics import METRICS
+from src.vision.vsrc.constants import DATA
 from src.pi4.vision_handler import Vision_Handler
 from src.pi4.lcd_ui import LCD_UI
+from src.pi4.track_voter import Track_Voter
+# Metrics
+SWEEPER_MOVE_TIME = METRICS.histogram("sweeper_move_seconds", "Time taken by the sweeper to reach a bin")
+SWEEPER_QUEUE_DEPTH = METRICS.gauge("sweeper_queue_depth", "Components waiting for the sweeper")
+PARTS_REFUSED = METRICS.counter("parts_refused", "Components sent to refuse because the system was busy")
+CONVEYOR_SPEED = METRICS.gauge("conveyor_speed", "Current conveyor speed setting")
+CONVEYOR_DISTANCE = METRICS.gauge("conveyor_distance", "Distance travelled by the conveyor")
+LED_COLOUR_CHANGES = METRICS.counter("led_colour_changes", "Colour changes sent to the LED strip")
+LED_RESETS = METRICS.counter("led_resets", "LED strip resets")
 
 class Sweeper_Controller:
     """
@@ -38,6 +50,9 @@ class Sweeper_Controller:
         self.steps = 0
         self.queue = Queue()
         self.map = dict()
+        # Registered up front so the sorting process shares them
+        self.sortedCounters = {label : METRICS.counter("parts_sorted", "Components sorted per class", **{"class" : label}) \
+                               for label in [data["label"] for data in DATA.values()] + ["refuse"]}
         # Locks and events
         self.busyEvent = multiprocessing.Event()
         self.speedLock = multiprocessing.Lock()
@@ -67,6 +82,24 @@ class Sweeper_Controller:
         self.running = False
         self.sort.join()
 
+    def is_healthy(self) -> bool:
+        """
+        Check the sorting process is still running
+        """
+        return not self.running or self.sort.is_alive()
+
+    def restart(self) -> None:
+        """
+        Restart the sorting process, components already in the queue are kept
+        """
+        if self.sort.is_alive():
+            self.sort.terminate()
+            self.sort.join(1)
+        self.running = True
+        self.busyEvent.clear()
+        self.sort = multiprocessing.Process(target=self.sort_process, daemon=True)
+        self.sort.start()
+
     def set_map(self, newmap:dict) -> None:
         """
         Set the map of bin to classification
@@ -77,6 +110,7 @@ class Sweeper_Controller:
         """
         Add destination to queue in form of (time added, classification)
         """
+        SWEEPER_QUEUE_DEPTH.inc()
         self.queue.put(destination)
 
     def sort_process(self) -> None:
@@ -86,11 +120,17 @@ class Sweeper_Controller:
         while self.running:
             # Block until queue is received
             cls = self.queue.get(block=True)
+            SWEEPER_QUEUE_DEPTH.dec()
             self.busyEvent.set()
-            binNum = self.map[cls]
+            # Destinations are either the class or (class, conveyor distance at the beam)
+            label = cls[0] if isinstance(cls, tuple) else cls
+            binNum = self.map[label]
             # Move to bin
-            self.go_bin(binNum)
+            with SWEEPER_MOVE_TIME.time():
+                self.go_bin(binNum)
             # Finished
+            if label in self.sortedCounters:
+                self.sortedCounters[label].inc()
             self.busyEvent.clear()
 
     def go_bin(self, binnum:int) -> None:
@@ -150,10 +190,7 @@ class Conveyor_Controller:
     Mulitproccessing-safe distance tracking for use by system controller
     """
     def __init__(self) -> None:
-        # Set up the GPIO pins for the conveyor belt
-        GPIO.setup(GPIO_PINS['CONVEYOR_DIRECTION_PIN'], GPIO.OUT)
-        GPIO.setup(GPIO_PINS['CONVEYOR_STEP_PIN'], GPIO.OUT)
-        self.motor = GPIO.PWM(GPIO_PINS['CONVEYOR_STEP_PIN'], 1)
+        self.setup_gpio()
         self.speed = 0
         self.distance = 0
         self.startTime = time.time()
@@ -163,6 +200,21 @@ class Conveyor_Controller:
         self.speedLock = multiprocessing.Lock()
         self.stop()
 
+    def setup_gpio(self) -> None:
+        """
+        Set up the GPIO pins for the conveyor belt
+        """
+        GPIO.setup(GPIO_PINS['CONVEYOR_DIRECTION_PIN'], GPIO.OUT)
+        GPIO.setup(GPIO_PINS['CONVEYOR_STEP_PIN'], GPIO.OUT)
+        self.motor = GPIO.PWM(GPIO_PINS['CONVEYOR_STEP_PIN'], 1)
+
+    def restart(self) -> None:
+        """
+        Set the GPIO pins up again after a GPIO error, the distance travelled is kept
+        """
+        self.setup_gpio()
+        self.stop()
+
     def start(self, speed:int=0) -> None:
         """
         Change the speed and direction of the conveyor belt
@@ -203,6 +255,7 @@ class Conveyor_Controller:
         """
         with self.distanceLock:
             self.distance += (time.time() - self.get_start_time()) * self.get_speed()
+            CONVEYOR_DISTANCE.set(self.distance)
 
     def write_speed(self, speed:int) -> None:
         """
@@ -210,6 +263,7 @@ class Conveyor_Controller:
         """
         with self.speedLock:
             self.speed = speed
+        CONVEYOR_SPEED.set(speed)
 
     def get_distance(self) -> float:
         """
@@ -295,6 +349,7 @@ class WS2812B_Controller:
         trueColour = colorsys.hsv_to_rgb(*tuple(self.colour))
         rgbColour = (int(trueColour[0]*255), int(trueColour[1]*255), int(trueColour[2]*255))
         print(f"Setting colour to {rgbColour}")
+        LED_COLOUR_CHANGES.inc()
         self.colourProcess = multiprocessing.Process(target=self.change_colour_process, args=(rgbColour,), daemon=True)
         self.colourProcess.start()
         return trueColour
@@ -313,6 +368,7 @@ class WS2812B_Controller:
         Reset the LED strip
         """
         print("Resetting LED strip")
+        LED_RESETS.inc()
         self.initialize()
 
     def stop(self) -> None:
@@ -322,6 +378,12 @@ class WS2812B_Controller:
         self.queue.put('stop')
         self.rainbowProcess.join()
 
+    def is_healthy(self) -> bool:
+        """
+        Check the rainbow process has not crashed, it exits normally once the cycle is done
+        """
+        return self.rainbowProcess is None or self.rainbowProcess.exitcode in (None, 0)
+
     def set_status_light(self, status: str) -> None:
         """
         Set the status light - led 17
@@ -358,33 +420,41 @@ class System_Controller:
 
     def interrupt(self) -> None:
         """
-        Interrupt function for when the beam is broken
+        Interrupt function for when the beam is broken.
+        A thread rather than a process, so the inference future resolves in the main process.
         """
-        beamProcess = multiprocessing.Process(target=self.beam_broken, daemon=True)
-        beamProcess.start()
+        beamThread = threading.Thread(target=self.beam_broken, daemon=True)
+        beamThread.start()
 
     def beam_broken(self) -> None:
         """
         Interupt function for when the beam is broken:
-        Means there is a component to be sorted, the conveyor should stop
-        Inference should be run
+        Means there is a component to be sorted, the conveyor stops for one sharp frame
+        Inference is voted over frames while the belt carries the part on
         """
         print("Beam broken")
         # If the system is busy but another component is detected, add to queue but send to refuse
         if self.sweeper.busyEvent.is_set():
             print("System busy, refusing component")
+            PARTS_REFUSED.inc()
             self.sweeper.add_queue(('refuse', self.conveyor.get_distance()))
             return
         self.leds.set_status_light('busy')
         time.sleep(0.5)
         self.conveyor.stop()
-        # Inference and get classification - status red
-        cls = self.visionHandler.inference()
-        # Add to queue, need to class and distance
-        self.sweeper.add_queue(cls)
+        # Capture the stopped part for a sharp first frame, the rest of the votes are taken while it travels to the sweeper
+        time.sleep(1 / CAMERA_FRAMERATE)
+        distance = self.conveyor.get_distance()
+        stoppedFrame = [self.visionHandler.capture_array()]
+        def submit() -> object:
+            frame = stoppedFrame.pop() if stoppedFrame else self.visionHandler.capture_array()
+            return self.visionHandler.submit(frame, "sorter")
         # Start the conveyor
         self.conveyor.start(DEFAULT_SPEED)
         self.leds.set_status_light('working')
+        cls = Track_Voter().run(submit)
+        # Add to queue, with where the part was on the belt
+        self.sweeper.add_queue((cls, distance))
         # Wait until sweeper is done
         self.sweeper.busyEvent.wait()
         self.leds.set_status_light('ready')
@@ -1,40 +1,103 @@
+import os
 import multiprocessing
-from viztracer import log_sparse
 import numpy
 import time
 import cv2
-from src.common.constants import BOUNDING_BOX_COLOR
+from src.common.constants import BOUNDING_BOX_COLOR, CAMERA_RESOLUTION, RESISTOR_DECODING, BAND_DETECTOR_PATH, INFERENCE_CACHE_ENABLED, \
+    INFERENCE_CACHE_CONSUMERS, UNCERTAINTY_QUEUE_ENABLED
+from src.common.helper_functions import log_sparse
+from src.common.metrics import METRICS
+from src.pi4.inference_backends import Detections, create_backend, apply_tuning
+from src.pi4.resistor_decoder import Band_Decoder
+from src.pi4.inference_cache import Inference_Cache
+from src.pi4.uncertainty_queue import Uncertainty_Queue
 from src.vision.vsrc.constants import DATA
 MAP = {k["num_label"] : k["label"] for k in DATA.values()}
+# Created before the inference process is forked so that it records into shared memory
+INFERENCE_COMPUTE = METRICS.histogram("inference_compute_seconds", "Time spent in the model by the inference process")
+INFERENCE_CACHE_HITS = METRICS.counter("inference_cache_hits", "Frames answered from the inference cache")
+INFERENCE_CACHE_MISSES = METRICS.counter("inference_cache_misses", "Frames the inference cache had no result for")
+UNCERTAIN_FRAMES = METRICS.counter("uncertain_frames", "Frames saved to the uncertainty queue for labelling")
 TESTING = False
-try:
-    from ultralytics import YOLO
-    print("Using ultralytics YOLO!")
-except ImportError:
-    from src.common.simulate import YOLO
-    print("Using simulated YOLO!")
 # pylint:disable=all
 
+def load_model(backendName: str, modelPath: str, statusQueue: multiprocessing.Queue) -> object:
+    """
+    Import the backend's runtime, load the model and warm it up with a dummy frame.
+    Done inside the inference process so the UI never pays for it.
+    """
+    statusQueue.put(("Loading", f"Loading {backendName} model"))
+    model = apply_tuning(create_backend(backendName, modelPath).load())
+    print(f"Loaded {backendName} model!")
+    # The first prediction allocates buffers and fuses layers, so pay for it now
+    statusQueue.put(("Loading", "Warming up model"))
+    warmUpTime = model.warm_up((CAMERA_RESOLUTION[1], CAMERA_RESOLUTION[0], 3))
+    print(f"Warm up took {warmUpTime:.2f}s")
+    return model
+
+def load_band_decoder(statusQueue: multiprocessing.Queue) -> Band_Decoder:
+    """
+    Load the resistor band detector if value decoding is enabled, None if it is disabled or has no model.
+    Values are optional, so a missing band detector must not stop the classifier.
+    """
+    if not RESISTOR_DECODING:
+        return None
+    if not os.path.isfile(BAND_DETECTOR_PATH):
+        print(f"Band detector {BAND_DETECTOR_PATH} not found, resistor values will not be decoded")
+        return None
+    statusQueue.put(("Loading", "Loading band detector"))
+    bandDecoder = Band_Decoder().load()
+    bandDecoder.describe(numpy.zeros((bandDecoder.imgsz, bandDecoder.imgsz // 3, 3), dtype=numpy.uint8))
+    return bandDecoder
+
 @log_sparse
-def inference_process(frameQueue: multiprocessing.Queue, resultQueue: multiprocessing.Queue, busyInference: multiprocessing.Event, modelPath: str) -> None:
+def inference_process(frameQueue: multiprocessing.Queue, resultQueue: multiprocessing.Queue, backendName: str, modelPath: str, \
+                      statusQueue: multiprocessing.Queue, modelReady: multiprocessing.Event) -> None:
     """
     Process to handle inference
     """
-    model = YOLO(modelPath)
-    print("Loaded YOLO model!")
+    model = load_model(backendName, modelPath, statusQueue)
+    bandDecoder = load_band_decoder(statusQueue)
+    cache = Inference_Cache() if INFERENCE_CACHE_ENABLED else None
+    uncertain = Uncertainty_Queue() if UNCERTAINTY_QUEUE_ENABLED else None
+    modelReady.set()
+    statusQueue.put(("Ready", "Model loaded"))
     while True:
         print("Waiting for frame")
-        frame = cv2.cvtColor(frameQueue.get(), cv2.COLOR_BGR2RGB)
+        # Frames arrive as BGR, ready for the model
+        requestId, consumer, frame = frameQueue.get()
         start = time.time()
         print("Got frame")
+        # Skip the model if the scene has not changed
+        cacheKey = cache.key(frame, model.roi) if cache is not None else None
+        if cacheKey is not None and consumer in INFERENCE_CACHE_CONSUMERS:
+            result = cache.get(cacheKey)
+            if result is not None:
+                INFERENCE_CACHE_HITS.inc()
+                resultQueue.put((requestId, result))
+                print(f"Cache hit took {time.time()-start:.3f}s")
+                continue
+            INFERENCE_CACHE_MISSES.inc()
         # Inference
-        res = model.predict(frame)
+        res = model.predict_roi(frame)
+        # Keep frames the model is unsure about for labelling
+        if uncertain is not None and uncertain.offer(frame, res):
+            UNCERTAIN_FRAMES.inc()
         result = draw_results(frame, res)
-        resultQueue.put(result)
-        busyInference.clear()
+        # Read the value of resistors from their crop
+        value = ""
+        if bandDecoder is not None and result[3] == DATA["resistors"]["label"] and result[1] is not None:
+            value = bandDecoder.describe(numpy.ascontiguousarray(result[1].swapaxes(0, 1)))
+        # Keep the box so the sorter can track the part across frames
+        box = res.boxes[0] if len(res) > 0 else None
+        result += (value, box)
+        if cacheKey is not None:
+            cache.put(cacheKey, result)
+        resultQueue.put((requestId, result))
+        INFERENCE_COMPUTE.record(time.time()-start)
         print(f"Inference took {time.time()-start:.2f}s")
 
-def draw_results(frame: numpy.ndarray, results) -> numpy.ndarray:
+def draw_results(frame: numpy.ndarray, detections: Detections) -> numpy.ndarray:
     """
     Draw the results on the frame
     """
@@ -43,13 +106,9 @@ def draw_results(frame: numpy.ndarray, results) -> numpy.ndarray:
     cls = ""
     conf = 0
     croppedImage = None
-    # For every box
-    for result in results:
-        # Get the class
-        clsList = result.obb.cls.tolist()
-        if len(clsList) == 0:
-            continue
-        box = numpy.array(result.obb.xyxyxyxy[0].cpu(), dtype=numpy.int0)
+    # Only the most confident box
+    if len(detections) > 0:
+        box = detections.boxes[0].astype(numpy.intp)
         # Only for testing
         if TESTING:
             cv2.imshow("frame", cv2.polylines(frame.copy(), [box], isClosed=True, color=BOUNDING_BOX_COLOR, thickness=3))
@@ -62,8 +121,8 @@ def draw_results(frame: numpy.ndarray, results) -> numpy.ndarray:
         # Draw the class
         fontScale = 1.5
         fontThickness = 2
-        conf = result.obb.conf[0]
-        cls = MAP[clsList[0]]
+        conf = detections.conf[0]
+        cls = MAP[int(detections.cls[0])]
         label = f"{cls}:{conf:.2f}"
         labelSize, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, fontScale, fontThickness)
         x, y = box[0]
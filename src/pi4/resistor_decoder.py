@@ -0,0 +1,123 @@
+"""
+Decodes the value of a resistor from its colour bands.
+A band detector trained on the ResistorTrainer labels finds the stem and each
+colour band in the resistor crop. Bands are read in order of distance from the
+stem and turned into a resistance and tolerance using DATA["resistors"]["values"].
+"""
+import numpy
+import cv2
+from src.common.constants import BAND_DETECTOR_PATH, BAND_IMGSZ, BAND_CONFIDENCE
+from src.vision.vsrc.constants import DATA
+# Band classes follow the order of the colours in DATA, the stem has its own class
+BAND_COLOURS = list(DATA["resistors"]["values"].keys())
+BAND_VALUES = numpy.array([int(v[1]) for v in DATA["resistors"]["values"].values()])
+# Colours that are not tolerance bands, black and white, have a tolerance of 0 in DATA
+BAND_TOLERANCES = numpy.array([float(v[3]) for v in DATA["resistors"]["values"].values()])
+STEM_LABELS = (len(BAND_COLOURS), 42)
+# Tolerance of a resistor without a tolerance band
+DEFAULT_TOLERANCE = 20.0
+SUFFIXES = ((1e9, "G"), (1e6, "M"), (1e3, "k"), (1, ""))
+
+def order_bands(centres:numpy.ndarray, stem:numpy.ndarray=None) -> numpy.ndarray:
+    """
+    Indices of the bands, first band first.
+    The first band is the one closest to the stem. Without a stem the bands are
+    ordered along the resistor body instead.
+    """
+    if stem is not None:
+        return numpy.argsort(numpy.linalg.norm(centres - stem, axis=1))
+    # Project onto the main axis of the band centres
+    offsets = centres - centres.mean(axis=0)
+    _, _, axes = numpy.linalg.svd(offsets, full_matrices=False)
+    return numpy.argsort(offsets @ axes[0])
+
+def decode_bands(colours:numpy.ndarray) -> tuple:
+    """
+    Get (resistance in ohms, tolerance in percent) from ordered band colour classes, None if they are not a valid code
+    """
+    count = len(colours)
+    if count < 3 or count > 6:
+        return None
+    # 3 band resistors have no tolerance band, 6 band resistors end with a temperature coefficient
+    digitCount = {3 : 2, 4 : 2, 5 : 3, 6 : 3}[count]
+    digits = BAND_VALUES[colours[:digitCount]]
+    if digits.min() < 0 or digits[0] == 0:
+        return None
+    significand = int(digits @ 10 ** numpy.arange(digitCount - 1, -1, -1))
+    resistance = significand * 10.0 ** BAND_VALUES[colours[digitCount]]
+    tolerance = BAND_TOLERANCES[colours[digitCount + 1]] if count > 3 else DEFAULT_TOLERANCE
+    if tolerance <= 0:
+        return None
+    return resistance, float(tolerance)
+
+def format_resistance(resistance:float, tolerance:float) -> str:
+    """
+    Format a resistance for the LCD, such as 4.7k ±5%
+    """
+    for scale, suffix in SUFFIXES:
+        if resistance >= scale:
+            return f"{resistance / scale:.3g}{suffix} ±{tolerance:g}%"
+    return f"{resistance:.3g} ±{tolerance:g}%"
+
+class Band_Decoder:
+    """
+    Runs the band detector on resistor crops
+    """
+    def __init__(self, modelPath:str=BAND_DETECTOR_PATH, imgsz:int=BAND_IMGSZ, confidence:float=BAND_CONFIDENCE) -> None:
+        self.modelPath = modelPath
+        self.imgsz = imgsz
+        self.confidence = confidence
+
+    def load(self) -> "Band_Decoder":
+        """
+        Load the band detector, falling back to the simulated YOLO off the Pi
+        """
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ultralytics import YOLO
+        except ImportError:
+            from src.common.simulate import YOLO
+        self.model = YOLO(self.modelPath)
+        return self
+
+    def detect(self, crop:numpy.ndarray) -> tuple:
+        """
+        Get the (N, 2) centres and (N,) classes of the bands found in a (height, width, RGB) crop
+        """
+        results = self.model.predict(cv2.cvtColor(crop, cv2.COLOR_RGB2BGR), imgsz=self.imgsz, conf=self.confidence, verbose=False)
+        if not results or results[0].boxes is None:
+            return numpy.zeros((0, 2)), numpy.zeros(0, numpy.int64)
+        boxes = results[0].boxes
+        return boxes.xywh.cpu().numpy()[:, :2], boxes.cls.cpu().numpy().astype(numpy.int64)
+
+    def decode(self, crop:numpy.ndarray) -> tuple:
+        """
+        Get (resistance in ohms, tolerance in percent) of the resistor in a crop, None if it cannot be read
+        """
+        centres, classes = self.detect(crop)
+        isStem = numpy.isin(classes, STEM_LABELS)
+        # Detections are sorted by confidence, so the first stem is the best one
+        stem = centres[isStem][0] if isStem.any() else None
+        centres, classes = centres[~isStem], classes[~isStem]
+        if len(classes) < 3:
+            return None
+        colours = classes[order_bands(centres, stem)]
+        # Without a stem the direction is unknown, but gold and silver are never first
+        if stem is None and BAND_VALUES[colours[0]] < 0:
+            colours = colours[::-1]
+        return decode_bands(colours)
+
+    def describe(self, crop:numpy.ndarray) -> str:
+        """
+        Get the value of the resistor in a crop as text for the LCD, empty if it cannot be read
+        """
+        decoded = self.decode(crop)
+        return format_resistance(*decoded) if decoded is not None else ""
+
+if __name__ == "__main__":
+    # Yellow violet red gold, 4.7k ±5%
+    testColours = numpy.array([BAND_COLOURS.index(c) for c in ("yellow", "violet", "red", "gold")])
+    testCentres = numpy.array([[10, 40], [10, 30], [10, 20], [10, 5]], dtype=float)
+    shuffle = numpy.random.permutation(len(testColours))
+    order = order_bands(testCentres[shuffle], numpy.array([10, 50]))
+    print(format_resistance(*decode_bands(testColours[shuffle][order])))
@@ -0,0 +1,170 @@
+"""
+Inference result broker
+Tags every inference request with an id and the consumer that made it (UI
+overlay, sorter, recorder) and routes each result back to that request's
+future, so concurrent requests can no longer steal each other's results.
+The newest result of any consumer is also kept for display.
+"""
+import time
+import queue
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy
+from src.common.constants import INFERENCE_TIMEOUT, INFERENCE_QUEUE_SIZE
+from src.common.metrics import METRICS
+# Consumers of inference results
+CONSUMERS = ["ui", "sorter", "recorder"]
+# Metrics
+INFERENCE_REQUESTS = {consumer : METRICS.counter("inference_requests", "Frames sent for inference", consumer=consumer) for consumer in CONSUMERS}
+INFERENCE_QUEUE_DEPTH = METRICS.gauge("inference_queue_depth", "Frames sent for inference without a result yet")
+INFERENCE_LATENCY = METRICS.histogram("inference_latency_seconds", "Time from sending a frame to receiving its result")
+
+class Result_Broker:
+    """
+    Sends requests to the inference process and routes results back by request id
+    """
+    def __init__(self, modelReady:multiprocessing.Event) -> None:
+        self.modelReady = modelReady
+        self.requestIds = itertools.count()
+        self.requestQueue = queue.Queue()
+        self.pendingRequests = dict()
+        self.requestLock = threading.Lock()
+        self.subscribers = []
+        self.latest = None
+        self.create_queues()
+
+    def create_queues(self) -> None:
+        """
+        Create the queues shared with the inference process.
+        Results are unbounded so the worker never blocks on a slow consumer.
+        """
+        self.frameQueue = multiprocessing.Queue(maxsize=INFERENCE_QUEUE_SIZE)
+        self.resultQueue = multiprocessing.Queue()
+
+    def start(self) -> "Result_Broker":
+        """
+        Start the dispatch and collect threads
+        """
+        threading.Thread(target=self.dispatch_requests, daemon=True).start()
+        threading.Thread(target=self.collect_results, daemon=True).start()
+        return self
+
+    def reset(self, reason:str) -> None:
+        """
+        Fail every pending request and swap to fresh queues, used when the inference process restarts
+        """
+        self.create_queues()
+        self.fail_requests(reason)
+
+    def submit(self, frame:numpy.ndarray, consumer:str="ui", timeout:float=INFERENCE_TIMEOUT) -> Future:
+        """
+        Queue a frame (height, width, BGR) for inference and return a future for its
+        (overlay, cropped image, confidence, class, value, box) result.
+        The future fails with a TimeoutError if there is no result within timeout seconds
+        and can be cancelled until it is sent to the inference process.
+        """
+        future = Future()
+        future.requestId = next(self.requestIds)
+        future.consumer = consumer
+        future.submitTime = time.time()
+        future.deadline = future.submitTime + timeout if timeout is not None else None
+        if consumer in INFERENCE_REQUESTS:
+            INFERENCE_REQUESTS[consumer].inc()
+        with self.requestLock:
+            self.pendingRequests[future.requestId] = future
+            INFERENCE_QUEUE_DEPTH.set(len(self.pendingRequests))
+        self.requestQueue.put((future, frame))
+        return future
+
+    def subscribe(self, callback:callable) -> None:
+        """
+        Call callback(future) for every result, whoever requested it.
+        Called from the collector thread, so callbacks must not touch pygame.
+        """
+        self.subscribers.append(callback)
+
+    def get_latest(self) -> Future:
+        """
+        Get the future of the newest result of any consumer, for display
+        """
+        return self.latest
+
+    def finish_request(self, requestId:int) -> Future:
+        """
+        Remove a request from the pending requests
+        """
+        with self.requestLock:
+            future = self.pendingRequests.pop(requestId, None)
+            INFERENCE_QUEUE_DEPTH.set(len(self.pendingRequests))
+        return future
+
+    def expire_requests(self) -> None:
+        """
+        Fail every request that has passed its deadline
+        """
+        now = time.time()
+        with self.requestLock:
+            expired = [f for f in self.pendingRequests.values() if f.deadline is not None and now > f.deadline]
+            for future in expired:
+                del self.pendingRequests[future.requestId]
+            INFERENCE_QUEUE_DEPTH.set(len(self.pendingRequests))
+        # Only whoever removed a request from pendingRequests may complete it
+        for future in expired:
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(FutureTimeoutError(f"Inference request {future.requestId} timed out"))
+
+    def fail_requests(self, reason:str) -> None:
+        """
+        Fail every pending request
+        """
+        with self.requestLock:
+            pending = list(self.pendingRequests.values())
+            self.pendingRequests.clear()
+            INFERENCE_QUEUE_DEPTH.set(0)
+        for future in pending:
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(reason))
+
+    def dispatch_requests(self) -> None:
+        """
+        Thread sending queued requests to the inference process, skipping cancelled and expired ones
+        """
+        while True:
+            future, frame = self.requestQueue.get()
+            # Hold the request back until the model is ready
+            while not self.modelReady.wait(0.5) and not future.done():
+                self.expire_requests()
+            with self.requestLock:
+                claimed = future.requestId in self.pendingRequests and future.set_running_or_notify_cancel()
+            if not claimed:
+                self.finish_request(future.requestId)
+                continue
+            # The queue is swapped when the inference process restarts, so retry with the new one
+            while not future.done():
+                try:
+                    self.frameQueue.put((future.requestId, future.consumer, frame), timeout=0.5)
+                    break
+                except queue.Full:
+                    self.expire_requests()
+
+    def collect_results(self) -> None:
+        """
+        Thread routing results from the inference process to the future that requested them
+        """
+        while True:
+            try:
+                requestId, result = self.resultQueue.get(timeout=0.5)
+            except queue.Empty:
+                self.expire_requests()
+                continue
+            future = self.finish_request(requestId)
+            if future is None or future.done():
+                continue
+            future.latency = time.time() - future.submitTime
+            INFERENCE_LATENCY.record(future.latency)
+            future.set_result(result)
+            self.latest = future
+            for callback in self.subscribers:
+                callback(future)
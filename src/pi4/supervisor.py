@@ -0,0 +1,121 @@
+"""
+Subsystem supervisor
+Restarts only the subsystem that failed (camera, inference worker, LEDs,
+sweeper, conveyor) so the healthy ones, and the loaded model, are kept.
+"""
+import time
+import traceback
+from src.common.constants import SUPERVISOR_POLL_INTERVAL, SUPERVISOR_MAX_RECOVERIES, SUPERVISOR_RECOVERY_WINDOW
+from src.common.metrics import METRICS
+
+class Subsystem_Supervisor:
+    """
+    Keeps track of the subsystems, how to check them and how to restart them
+    """
+    def __init__(self) -> None:
+        self.subsystems = dict()
+        self.lastPoll = 0
+        self.recoveries = []
+
+    def register(self, name:str, owner:object=None, isHealthy:callable=None, restart:callable=None, process:callable=None) -> None:
+        """
+        Register a subsystem.
+        owner is the object whose methods belong to the subsystem, used to find it in a traceback.
+        isHealthy is polled, subsystems without it are only restarted when they raise.
+        process returns the subsystem's process, if it has one, so a dead one can be reaped before the restart.
+        """
+        self.subsystems[name] = {
+            "owner" : owner,
+            "is_healthy" : isHealthy or (lambda: True),
+            "restart" : restart or (lambda: None),
+            "process" : process or (lambda: None),
+            "restarts" : METRICS.counter("subsystem_restarts", "Subsystems restarted by the supervisor", subsystem=name),
+        }
+
+    def poll(self) -> None:
+        """
+        Restart any subsystem that is unhealthy, rate limited to SUPERVISOR_POLL_INTERVAL.
+        Restarts share the recovery budget, once it is spent this raises so the main loop shows the fail screen.
+        """
+        now = time.time()
+        if (now - self.lastPoll) * 1000 < SUPERVISOR_POLL_INTERVAL:
+            return
+        self.lastPoll = now
+        for name in self.unhealthy_subsystems():
+            if not self.use_recovery():
+                raise RuntimeError(f"{name} keeps failing, gave up after {SUPERVISOR_MAX_RECOVERIES} restarts in {SUPERVISOR_RECOVERY_WINDOW}s")
+            self.restart_subsystem(name)
+
+    def use_recovery(self) -> bool:
+        """
+        Take one restart from the budget of SUPERVISOR_MAX_RECOVERIES per SUPERVISOR_RECOVERY_WINDOW, False if it is spent
+        """
+        now = time.time()
+        self.recoveries = [t for t in self.recoveries if now - t < SUPERVISOR_RECOVERY_WINDOW]
+        if len(self.recoveries) >= SUPERVISOR_MAX_RECOVERIES:
+            return False
+        self.recoveries.append(now)
+        return True
+
+    def unhealthy_subsystems(self) -> list:
+        """
+        Get the names of the subsystems failing their health check
+        """
+        unhealthy = []
+        for name, subsystem in self.subsystems.items():
+            try:
+                healthy = subsystem["is_healthy"]()
+            except Exception: # pylint: disable=broad-except
+                healthy = False
+            if not healthy:
+                unhealthy.append(name)
+        return unhealthy
+
+    def failed_subsystem(self, exception:Exception) -> str:
+        """
+        Find the subsystem that raised the exception from the deepest
+        traceback frame that belongs to a registered owner
+        """
+        failed = None
+        for frame, _ in traceback.walk_tb(exception.__traceback__):
+            frameOwner = frame.f_locals.get("self")
+            for name, subsystem in self.subsystems.items():
+                if subsystem["owner"] is not None and subsystem["owner"] is frameOwner:
+                    failed = name
+        return failed
+
+    def restart_subsystem(self, name:str) -> bool:
+        """
+        Restart a single subsystem
+        """
+        print(f"Restarting {name}")
+        try:
+            # Reap a dead process so it does not stay behind as a zombie
+            process = self.subsystems[name]["process"]()
+            if process is not None and not process.is_alive():
+                process.join()
+            self.subsystems[name]["restart"]()
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
+            return False
+        self.subsystems[name]["restarts"].inc()
+        return True
+
+    def recover(self, exception:Exception) -> bool:
+        """
+        Recover from an exception raised in the main loop by restarting the
+        subsystem that raised it and any unhealthy ones.
+        Returns False if a full re-initialisation is needed instead.
+        """
+        if not self.use_recovery():
+            print("Too many recoveries, re-initialising")
+            return False
+        toRestart = self.unhealthy_subsystems()
+        failed = self.failed_subsystem(exception)
+        if failed is not None and failed not in toRestart:
+            toRestart.append(failed)
+        if not toRestart:
+            print(f"No failed subsystem found for {exception!r}, cannot recover")
+            return False
+        print(f"Recovering from {exception!r} by restarting {toRestart}")
+        return all(self.restart_subsystem(name) for name in toRestart)
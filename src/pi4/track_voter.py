@@ -0,0 +1,131 @@
+"""
+Multi frame voting for the class of a part.
+Detections from consecutive frames are associated into tracks by the IoU of
+their oriented boxes. Each track accumulates confidence per class and a decision
+is made as soon as the leading class has enough confident votes and a majority,
+or when the deadline passes, instead of trusting a single frame.
+"""
+import time
+from concurrent.futures import Future
+import numpy
+from src.common.constants import TRACK_IOU, VOTE_CONFIDENCE, VOTE_MIN_FRAMES, VOTE_MAJORITY, VOTE_FLOOR, VOTE_DEADLINE, VOTE_RETRY_DELAY
+from src.common.metrics import METRICS
+from src.pi4.inference_backends import polygon_iou
+# Metrics
+VOTE_FRAMES = METRICS.histogram("vote_frames", "Frames classified before the sorter decided on a class")
+VOTE_TIMEOUTS = METRICS.counter("vote_timeouts", "Votes decided by the deadline instead of confidence")
+
+class Track:
+    """
+    A part seen across several frames
+    """
+    def __init__(self, box:numpy.ndarray) -> None:
+        self.box = box
+        self.votes = dict()
+        self.counts = dict()
+
+    def add(self, box:numpy.ndarray, cls:str, conf:float) -> None:
+        """
+        Add a detection of this track
+        """
+        self.box = box
+        self.votes[cls] = self.votes.get(cls, 0) + conf
+        self.counts[cls] = self.counts.get(cls, 0) + 1
+
+    def leader(self) -> tuple:
+        """
+        Get the class with the most confidence, with its number of votes, mean confidence and share of all confidence
+        """
+        cls = max(self.votes, key=self.votes.get)
+        return cls, self.counts[cls], self.votes[cls] / self.counts[cls], self.votes[cls] / max(sum(self.votes.values()), 1e-9)
+
+class Track_Voter:
+    """
+    Associates detections into tracks and decides the class of the best track
+    """
+    def __init__(self, iouThreshold:float=TRACK_IOU, confidence:float=VOTE_CONFIDENCE, minFrames:int=VOTE_MIN_FRAMES, \
+                 majority:float=VOTE_MAJORITY, floor:float=VOTE_FLOOR, deadline:float=VOTE_DEADLINE, retryDelay:float=VOTE_RETRY_DELAY) -> None:
+        self.iouThreshold = iouThreshold
+        self.confidence = confidence
+        self.minFrames = minFrames
+        self.majority = majority
+        self.floor = floor
+        self.deadline = deadline
+        self.retryDelay = retryDelay
+        self.tracks = []
+        self.frames = 0
+
+    def update(self, box:numpy.ndarray, cls:str, conf:float) -> None:
+        """
+        Add one frame's detection, conf from 0 to 1. A frame without a detection has a box of None.
+        """
+        self.frames += 1
+        if box is None or not cls:
+            return
+        ious = [polygon_iou(track.box, box) for track in self.tracks]
+        if ious and max(ious) >= self.iouThreshold:
+            track = self.tracks[int(numpy.argmax(ious))]
+        else:
+            track = Track(box)
+            self.tracks.append(track)
+        track.add(box, cls, conf)
+
+    def best(self) -> tuple:
+        """
+        Get the leader of the track with the most total confidence, None if nothing has been seen
+        """
+        if not self.tracks:
+            return None
+        return max(self.tracks, key=lambda track: sum(track.votes.values())).leader()
+
+    def decision(self, expired:bool=False) -> str:
+        """
+        Get the class once it has enough confident votes and a majority, None to keep voting.
+        After the deadline the leading class is used if it reaches the floor, otherwise the part is refused.
+        """
+        best = self.best()
+        if best is None:
+            return "refuse" if expired else None
+        cls, count, meanConf, share = best
+        if count >= self.minFrames and meanConf >= self.confidence and share >= self.majority:
+            return cls
+        if not expired:
+            return None
+        VOTE_TIMEOUTS.inc()
+        return cls if meanConf >= self.floor and share >= self.majority else "refuse"
+
+    def run(self, submit:callable) -> str:
+        """
+        Classify frames from submit(), which returns an inference future, until a decision is made.
+        The part is refused straight away if a request fails as soon as it is submitted, e.g. when inference is disabled.
+        """
+        end = time.time() + self.deadline
+        cls = None
+        while cls is None:
+            try:
+                request:Future = submit()
+            except Exception as e: # pylint: disable=broad-except
+                print(f"Could not submit inference request: {e!r}")
+                return "refuse"
+            if request.done() and not request.cancelled() and request.exception() is not None:
+                print(f"Inference request {getattr(request, 'requestId', None)} failed on submit: {request.exception()!r}")
+                return "refuse"
+            try:
+                _, _, conf, frameCls, _, box = request.result(timeout=max(0, end - time.time()))
+                self.update(box, frameCls, conf / 100)
+            except Exception as e: # pylint: disable=broad-except
+                # Timed out or the inference process restarted, wait before trying another frame
+                request.cancel()
+                print(f"Inference request {getattr(request, 'requestId', None)} failed: {e!r}")
+                time.sleep(min(self.retryDelay, max(0, end - time.time())))
+            cls = self.decision(time.time() >= end)
+        VOTE_FRAMES.record(self.frames)
+        return cls
+
+if __name__ == "__main__":
+    # A confident resistor after a noisy first frame
+    voter = Track_Voter()
+    square = numpy.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=float)
+    for frameBox, frameClass, frameConf in [(square, "capacitor", 0.4), (square + 1, "resistor", 0.9), (square + 2, "resistor", 0.95), (None, "", 0)]:
+        voter.update(frameBox, frameClass, frameConf)
+        print(voter.frames, voter.best(), voter.decision())
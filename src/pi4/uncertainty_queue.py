@@ -0,0 +1,112 @@
+"""
+Bounded on-disk queue of frames the model was unsure about.
+Frames whose top confidence falls in UNCERTAINTY_BAND are saved with the
+predicted box as a proposal, in the layout the dataset builder reads, so they
+can be labelled most uncertain first. When the queue is full a new frame only
+replaces the least uncertain one if it is more uncertain.
+"""
+import os
+import json
+import time
+import queue
+import threading
+import numpy
+import cv2
+from src.common.constants import UNCERTAINTY_QUEUE_PATH, UNCERTAINTY_BAND, UNCERTAINTY_QUEUE_SIZE, UNCERTAINTY_INTERVAL
+from src.vision.vsrc.labels import write_labels, normalise
+from src.vision.vsrc.constants import PRECISION, PROPOSALS_FOLDER, PROPOSALS_MANIFEST
+
+class Uncertainty_Queue:
+    """
+    Samples uncertain frames into a folder of images, proposals and a manifest, written on a background thread
+    """
+    def __init__(self, path:str=UNCERTAINTY_QUEUE_PATH, band:tuple=UNCERTAINTY_BAND, capacity:int=UNCERTAINTY_QUEUE_SIZE, interval:float=UNCERTAINTY_INTERVAL) -> None:
+        self.band = band
+        self.capacity = capacity
+        self.interval = interval
+        self.imageFolder = os.path.join(path, "imgs")
+        self.proposalFolder = os.path.join(path, PROPOSALS_FOLDER)
+        self.manifestPath = os.path.join(self.proposalFolder, PROPOSALS_MANIFEST)
+        for folder in (self.imageFolder, self.proposalFolder, os.path.join(path, "labels")):
+            os.makedirs(folder, exist_ok=True)
+        self.entries = self.read_manifest()
+        self.lock = threading.Lock()
+        self.lastSample = 0
+        # Only a couple of frames wait to be written, the rest are dropped rather than slowing inference
+        self.pending = queue.Queue(maxsize=2)
+        threading.Thread(target=self.writer, daemon=True).start()
+
+    def read_manifest(self) -> dict:
+        """
+        Read the entries of frames already in the queue, keyed by image path.
+        Lines cut short, e.g. by a power cut while the manifest was written, are skipped.
+        """
+        if not os.path.isfile(self.manifestPath):
+            return {}
+        entries = {}
+        with open(self.manifestPath, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if os.path.isfile(entry["image"]):
+                        entries[entry["image"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return entries
+
+    def least_uncertain(self) -> dict:
+        """
+        The entry that would be replaced next
+        """
+        return min(self.entries.values(), key=lambda entry: entry["uncertainty"])
+
+    def offer(self, frame:numpy.ndarray, detections:object) -> bool:
+        """
+        Queue a (height, width, BGR) frame for saving if its top confidence is uncertain, returns whether it was taken
+        """
+        if len(detections) == 0 or not self.band[0] <= detections.conf[0] <= self.band[1]:
+            return False
+        # Consecutive frames are usually the same part
+        now = time.time()
+        if now - self.lastSample < self.interval:
+            return False
+        uncertainty = 1 - float(detections.conf[0])
+        with self.lock:
+            if len(self.entries) >= self.capacity and uncertainty <= self.least_uncertain()["uncertainty"]:
+                return False
+        try:
+            self.pending.put_nowait((frame, detections.boxes[:1], detections.cls[:1], detections.conf[:1], uncertainty))
+        except queue.Full:
+            return False
+        self.lastSample = now
+        return True
+
+    def writer(self) -> None:
+        """
+        Worker thread saving queued frames and evicting the least uncertain ones over capacity
+        """
+        while True:
+            frame, boxes, cls, conf, uncertainty = self.pending.get()
+            name = f"uncertain_{time.strftime('%Y%m%d_%H%M%S')}_{int(time.time() * 1000) % 1000:03d}"
+            entry = {"image" : os.path.join(self.imageFolder, f"{name}.png"), "label" : os.path.join(self.proposalFolder, f"{name}.txt"), \
+                     "classes" : cls.astype(int).tolist(), "confidences" : [round(float(c), 4) for c in conf], "uncertainty" : round(uncertainty, 4), "time" : time.time()}
+            try:
+                cv2.imwrite(entry["image"], frame)
+                write_labels(entry["label"], cls, normalise(boxes.reshape(-1, 8), (frame.shape[1], frame.shape[0])), PRECISION)
+                with self.lock:
+                    self.entries[entry["image"]] = entry
+                    evicted = [self.entries.pop(self.least_uncertain()["image"]) for _ in range(len(self.entries) - self.capacity)]
+                for path in (path for oldEntry in evicted for path in (oldEntry["image"], oldEntry["label"])):
+                    if os.path.isfile(path):
+                        os.remove(path)
+                self.write_manifest()
+            except OSError as e:
+                print(f"Could not save uncertain frame: {e}")
+
+    def write_manifest(self) -> None:
+        """
+        Replace the manifest in one step so the builder never reads half of it
+        """
+        with open(self.manifestPath + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in self.entries.values()))
+        os.replace(self.manifestPath + ".tmp", self.manifestPath)
@@ -3,35 +3,132 @@ Responsible for handling the vision system.
 Hooks onto the pygame camera and performs inference.
 """
 # pylint: disable=attribute-defined-outside-init
-import time
+import asyncio
+import threading
 import multiprocessing
+from concurrent.futures import Future
 import numpy
-import cv2
 import pygame
 import pygame.camera as pycam
-import pyautogui
-import pygetwindow
 import random
 from os import listdir
 from src.pi4.display_feed_pygame import CameraFeed
-from src.pi4.multiprocessinghandlers import *
+from src.pi4.result_broker import Result_Broker
+from src.pi4.frame_preparer import Frame_Preparer
 from src.common.helper_functions import start_ui
-from src.common.constants import CAMERA_RESOLUTION, CLASSIFIER_PATH, TRAINING_MODE_CAMERA_SIZE, CAMERA_DISPLAY_SIZE, FPS_FONT_SIZE, CAMERA_FRAMERATE
-from src.vision.vsrc.constants import DATA, REALVNC_WINDOW_NAME, BORDER_WIDTH, LOWER_THRESHOLD, UPPER_THRESHOLD
+from src.common.metrics import METRICS
+from src.common.constants import CAMERA_RESOLUTION, INFERENCE_BACKEND, TRAINING_MODE_CAMERA_SIZE, CAMERA_DISPLAY_SIZE, FPS_FONT_SIZE, CAMERA_FRAMERATE, \
+    INFERENCE_TIMEOUT
+from src.vision.vsrc.constants import DATA, REALVNC_WINDOW_NAME, BORDER_WIDTH, LOWER_THRESHOLD, UPPER_THRESHOLD, CAPTURE_SERVER_URL
+# Metrics
+CAMERA_FRAMES = METRICS.counter("camera_frames", "Frames drawn from the camera")
+CAMERA_FPS = METRICS.gauge("camera_fps", "Camera frames per second")
 class Vision_Handler:
     def __init__(self, enableInference:bool=True):
         self.enableInference = enableInference
         self.lcdCallbacks = {}
+        # Inference and locks
+        self.doInference = multiprocessing.Event()
+        self.constInference = multiprocessing.Event()
+        self.modelReady = multiprocessing.Event()
+        self.statusQueue = multiprocessing.Queue()
+        self.modelStatus = ("Loading", "Starting inference") if self.enableInference else ("Idle", "Inference disabled")
+        # Results are routed back to whoever requested them
+        self.broker = Result_Broker(self.modelReady)
+        self.uiRequest = None
+        self.shownRequestId = None
+        self.preparer = Frame_Preparer()
+        self.captureServer = None
+        # Start loading the model straight away so it overlaps with the UI and hardware setup
+        if self.enableInference:
+            self.start_inference_worker()
+            self.broker.start()
+
+    def submit(self, frame:numpy.ndarray, consumer:str="ui", timeout:float=INFERENCE_TIMEOUT) -> Future:
+        """
+        Queue a frame (height, width, BGR) for inference, see Result_Broker.submit
+        """
+        if not self.enableInference:
+            future = Future()
+            future.set_exception(RuntimeError("Inference is disabled"))
+            return future
+        return self.broker.submit(frame, consumer, timeout)
+
+    async def submit_async(self, frame:numpy.ndarray, consumer:str="ui", timeout:float=INFERENCE_TIMEOUT) -> tuple:
+        """
+        Awaitable version of submit
+        """
+        return await asyncio.wrap_future(self.submit(frame, consumer, timeout))
+
+    def inference(self, timeout:float=INFERENCE_TIMEOUT) -> str:
+        """
+        Classify the current camera frame for the sorter, blocking until the class is known
+        """
+        return self.submit(self.capture_array(), "sorter", timeout).result()[3]
+
+    def capture_array(self) -> numpy.ndarray:
+        """
+        Copy the latest camera frame as a (height, width, BGR) array, without the overlay.
+        Called from the sorter's thread, so the frame is copied while the main thread cannot replace it.
+        """
+        with self.frameLock:
+            return self.preparer.model_input(self.currentFrame)
+
+    def start_inference_worker(self) -> None:
+        """
+        Start the inference process, which loads and warms up the model in the background
+        """
+        from src.pi4.multiprocessinghandlers import inference_process # pylint: disable=import-outside-toplevel
+        self.inferenceProcess = multiprocessing.Process(target=inference_process, args=(self.broker.frameQueue, self.broker.resultQueue, INFERENCE_BACKEND, None, \
+                                                        self.statusQueue, self.modelReady), daemon=True)
+        self.inferenceProcess.start()
+
+    def inference_healthy(self) -> bool:
+        """
+        Check the inference process is still running
+        """
+        return not self.enableInference or self.inferenceProcess.is_alive()
+
+    def restart_inference(self) -> None:
+        """
+        Restart the inference process with fresh queues, as a dead process may have left them locked
+        """
+        if not self.enableInference:
+            return
+        if self.inferenceProcess.is_alive():
+            self.inferenceProcess.terminate()
+            self.inferenceProcess.join(1)
+        self.statusQueue = multiprocessing.Queue()
+        self.modelReady.clear()
+        self.broker.reset("Inference process restarted")
+        self.modelStatus = ("Loading", "Restarting inference")
+        self.lcdCallbacks.get("update_status", lambda *_: None)(*self.modelStatus)
+        self.start_inference_worker()
+
+    def is_ready(self) -> bool:
+        """
+        Check if the model has finished loading, always true without inference
+        """
+        return not self.enableInference or self.modelReady.is_set()
+
+    def poll_model_status(self) -> None:
+        """
+        Forward model loading progress from the inference process to the LCD
+        """
+        while not self.statusQueue.empty():
+            self.modelStatus = self.statusQueue.get()
+            print(f"Model status: {self.modelStatus[0]} - {self.modelStatus[1]}")
+            self.lcdCallbacks.get("update_status", lambda *_: None)(*self.modelStatus)
 
     def init(self, cameraDisplay:pygame.display, componentDisplay:pygame.display, trainingMode:bool=False, captureVNC:bool=False, enableKeyboard:bool=False) -> None:
         """
         Initialise the vision handler
         """
-        self.startTime = time.time()
         # Constants
         self.resolution = TRAINING_MODE_CAMERA_SIZE if trainingMode else CAMERA_DISPLAY_SIZE
         self.trainingMode = trainingMode
         self.captureVNC = captureVNC
+        self.captureClient = None
         self.enableKeyboard = enableKeyboard
         self.forceImage = False
         # Surface setup
@@ -41,7 +138,12 @@ class Vision_Handler:
         self.obbDisplay = pygame.Surface(CAMERA_RESOLUTION)
         self.obbDisplay.set_colorkey((0, 0, 0))
         self.currentFrame = pygame.Surface(CAMERA_RESOLUTION)
+        # The overlay is drawn on a copy so the raw frame can still be classified
+        self.displayFrame = pygame.Surface(CAMERA_RESOLUTION)
+        self.frameLock = threading.Lock()
         self.resizedFrame = pygame.Surface(self.resolution)
+        self.trainingBackground = pygame.Surface(self.resolution)
+        self.trainingBackground.fill((255, 0, 255))
         # Camera setup
         self.cameraFeed = CameraFeed(self.cameraDisplay, trainingMode)
         # Class label font
@@ -53,17 +155,6 @@ class Vision_Handler:
         self.drawFPSEvent = pygame.USEREVENT + 100
         pygame.time.set_timer(self.drawFPSEvent, 1000 // CAMERA_FRAMERATE)
         pycam.init()
-        # Inference and locks
-        self.doInference = multiprocessing.Event()
-        self.constInference = multiprocessing.Event()
-        self.busyInference = multiprocessing.Event()
-        self.frameQueue = multiprocessing.Queue(maxsize=1)
-        self.resultQueue = multiprocessing.Queue(maxsize=1)
-        modelPath = CLASSIFIER_PATH if self.enableInference else None
-        if self.enableInference:
-            modelPath = CLASSIFIER_PATH
-            self.inferenceProcess = multiprocessing.Process(target=inference_process, args=(self.frameQueue, self.resultQueue, self.busyInference, modelPath), daemon=True)
-            self.inferenceProcess.start()
         return self
 
     def force_image(self) -> None:
@@ -89,26 +180,37 @@ class Vision_Handler:
         Set the LCD callbacks
         """
         self.lcdCallbacks = callbacks
+        self.lcdCallbacks.get("update_status", lambda *_: None)(*self.modelStatus)
+
+    def set_capture_server(self, captureServer:object) -> None:
+        """
+        Serve raw camera frames to the dataset builder, see CaptureServer
+        """
+        self.captureServer = captureServer
 
     def update_frame(self) -> pygame.Surface:
         """
         Get the current frame from the camera
         """
         _ = self.cameraclock.tick(CAMERA_FRAMERATE) / 1000.0
-        # Get the frame
-        self.currentFrame = self.get_frame()
-        self.currentFrame.blit(self.obbDisplay, (0,0))
+        # Get the frame, the camera writes into the current frame so it is locked against capture_array
+        with self.frameLock:
+            self.currentFrame = self.get_frame()
+        CAMERA_FRAMES.inc()
+        if self.captureServer is not None:
+            self.captureServer.fulfil(self.capture_array)
+        if self.displayFrame.get_size() != self.currentFrame.get_size():
+            self.displayFrame = pygame.Surface(self.currentFrame.get_size())
+        self.displayFrame.blit(self.currentFrame, (0,0))
+        self.displayFrame.blit(self.obbDisplay, (0,0))
         # Resize the frame and draw FPS in the bottom right corner
         if not self.trainingMode:
-            self.resizedFrame = pygame.transform.scale(self.currentFrame, self.resolution)
+            self.resizedFrame = self.preparer.preview(self.displayFrame, self.resolution)
             self.resizedFrame.blit(self.fps, (self.resolution[0]-(self.fps.get_width()+5), self.resolution[1]-(self.fps.get_height())))
         else:
             padding = 10
-            self.resizedFrame = pygame.transform.scale(self.currentFrame, (self.resolution[0]-padding, self.resolution[1]-padding))
-            backgroundFrame = pygame.Surface(self.resolution)
-            backgroundFrame.fill((255, 0, 255))
-            backgroundFrame.blit(self.resizedFrame, (padding//2, padding//2))
-            self.resizedFrame = backgroundFrame
+            self.trainingBackground.blit(self.preparer.preview(self.displayFrame, (self.resolution[0]-padding, self.resolution[1]-padding)), (padding//2, padding//2))
+            self.resizedFrame = self.trainingBackground
         # Draw the frame
         self.cameraDisplay.blit(self.resizedFrame, (0,0))
 
@@ -117,7 +219,9 @@ class Vision_Handler:
         Handle pygame events
         """
         if event.type == self.drawFPSEvent:
+            self.poll_model_status()
             self.update_frame()
+            CAMERA_FPS.set(self.cameraclock.get_fps())
             self.fps = self.fpsFont.render(f"FPS: {self.cameraclock.get_fps():.0f}", True, (255,255,255))
         if event.type == pygame.KEYDOWN and self.enableKeyboard:
             if event.key == pygame.K_i:
@@ -165,40 +269,66 @@ class Vision_Handler:
         """
         # Capture the frame
         if self.captureVNC:
-            frame = self.capture_vnc()
+            frame = self.capture_remote()
         elif self.forceImage:
             frame = self.imgDisplay.copy()
         else:
             frame = self.cameraFeed.get_frame()
         # Perform inference
         if self.enableInference:
-            # Consume the result
-            if not self.resultQueue.empty():
-                dis, croppedImage, conf, cls = self.resultQueue.get()
-                endTime = time.time()
-                # Update the inference time
-                self.lcdCallbacks.get("update_inference_time", lambda _: None)(endTime-self.startTime)
-                self.lcdCallbacks.get("update_confidence", lambda _: None)(conf)
-                self.lcdCallbacks.get("update_class", lambda _: None)(cls)
-                self.obbDisplay = pygame.surfarray.make_surface(dis)
-                self.obbDisplay.set_colorkey((0, 0, 0))
-                if croppedImage is not None:
-                    croppedImage = pygame.surfarray.make_surface(croppedImage)
-                    croppedImage = pygame.transform.scale(croppedImage, (self.resolution[0]//3, self.resolution[1]))
-                    self.componentDisplay.blit(croppedImage, (0,0))
-            # Produce a frame
-            if (self.doInference.is_set() or self.constInference.is_set()) and not self.busyInference.is_set():
-                self.busyInference.set()
-                if self.frameQueue.empty():
-                    self.startTime = time.time()
-                    self.frameQueue.put(pygame.surfarray.array3d(frame).swapaxes(0,1))
-                    self.doInference.clear()
+            # Show the newest result, whether the UI or the sorter asked for it
+            latest = self.broker.get_latest()
+            if latest is not None and latest.requestId != self.shownRequestId:
+                self.shownRequestId = latest.requestId
+                self.show_result(latest.result(), latest.latency)
+            # Produce a frame once the previous UI request has finished
+            if self.uiRequest is not None and self.uiRequest.done():
+                self.uiRequest = None
+            if (self.doInference.is_set() or self.constInference.is_set()) and self.uiRequest is None and self.is_ready():
+                self.uiRequest = self.submit(self.preparer.model_input(frame), "ui")
+                self.doInference.clear()
         return frame
 
+    def show_result(self, result:tuple, latency:float) -> None:
+        """
+        Draw an inference result on the overlay and update the LCD
+        """
+        dis, croppedImage, conf, cls, value, _ = result
+        # Update the inference time
+        self.lcdCallbacks.get("update_inference_time", lambda _: None)(latency)
+        self.lcdCallbacks.get("update_confidence", lambda _: None)(conf)
+        self.lcdCallbacks.get("update_class", lambda _: None)(cls)
+        self.lcdCallbacks.get("update_value", lambda _: None)(value)
+        self.obbDisplay = pygame.surfarray.make_surface(dis)
+        self.obbDisplay.set_colorkey((0, 0, 0))
+        if croppedImage is not None:
+            croppedImage = pygame.surfarray.make_surface(croppedImage)
+            croppedImage = pygame.transform.scale(croppedImage, (self.resolution[0]//3, self.resolution[1]))
+            self.componentDisplay.blit(croppedImage, (0,0))
+
+    def capture_remote(self) -> pygame.Surface:
+        """
+        Get a frame from the sorter's capture server, falling back to VNC screenshots if it cannot be reached
+        """
+        from src.common.capture_server import CaptureClient # pylint: disable=import-outside-toplevel
+        if self.captureClient is None:
+            self.captureClient = CaptureClient(CAPTURE_SERVER_URL)
+        if self.captureClient is not False:
+            frame = self.captureClient.fetch()
+            if frame is not None:
+                return pygame.surfarray.make_surface(frame[..., ::-1].swapaxes(0, 1))
+            # Do not wait for the server on every frame once it has failed
+            self.captureClient = False
+        return self.capture_vnc()
+
     def capture_vnc(self) -> None:
         """
         Capture an image from the Raspberry Pi.
         """
+        # Only needed when developing over VNC, so import on first use
+        import cv2 # pylint: disable=import-outside-toplevel
+        import pyautogui # pylint: disable=import-outside-toplevel
+        import pygetwindow # pylint: disable=import-outside-toplevel
         # Focus on the RealVNC window
         try:
             realVNCWindow = pygetwindow.getWindowsWithTitle(REALVNC_WINDOW_NAME)[0]
@@ -228,8 +358,8 @@ class Vision_Handler:
         """
         Destroy the camera
         """
-        if self.realCamera is not None:
-            self.realCamera.stop()
+        if self.cameraFeed.realCamera is not None:
+            self.cameraFeed.realCamera.stop()
         return
 
 if __name__ == "__main__":
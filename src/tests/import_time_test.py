@@ -0,0 +1,33 @@
+"""
+Import time regression test.
+Fails if an entry point takes longer than its budget in IMPORT_TIME_BUDGETS to
+import, or if it eagerly imports one of LAZY_IMPORTS. Run on the Pi with
+python -m src.tests.import_time_test
+"""
+import sys
+from src.common.constants import IMPORT_TIME_BUDGETS
+from src.common.import_profiler import profile_imports, total_import_time, lazy_imports_loaded, print_report
+
+def check_entry_point(module:str, budget:float) -> list:
+    """
+    Profile an entry point and return a list of failures
+    """
+    records = profile_imports(module)
+    print_report(module, records)
+    failures = []
+    total = total_import_time(records, module)
+    if total > budget:
+        failures.append(f"{module} took {total:.3f}s to import, budget is {budget:.3f}s")
+    for lazyModule in lazy_imports_loaded(records):
+        failures.append(f"{module} eagerly imports {lazyModule}")
+    return failures
+
+if __name__ == "__main__":
+    allFailures = []
+    for entryPoint, entryBudget in IMPORT_TIME_BUDGETS.items():
+        allFailures += check_entry_point(entryPoint, entryBudget)
+    for failure in allFailures:
+        print(f"FAIL: {failure}")
+    if allFailures:
+        sys.exit(1)
+    print("All entry points within budget")
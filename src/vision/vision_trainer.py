@@ -2,8 +2,6 @@
 Handy frontend tool for training the vision model.
 """
 from customtkinter import CTk, CTkToplevel, CTkButton, filedialog
-from src.vision.vsrc.rpi_dataset_builder import RPIDatasetBuilder
-from src.vision.vsrc.rpi_resistor_sorter import ResistorTrainer
 from src.vision.vsrc.constants import TITLE, RESOLUTION, PADDING
 
 class VisionTrainer:
@@ -23,6 +21,7 @@ class VisionTrainer:
         Opens the RPi Dataset Builder.
         Uses RealVNC to capture the screen of the Raspberry Pi.
         """
+        from src.vision.vsrc.rpi_dataset_builder import RPIDatasetBuilder # pylint: disable=import-outside-toplevel
         RPIDatasetBuilder(CTkToplevel(self.root))
 
     def dataset_sorter(self) -> None:
@@ -41,6 +40,7 @@ class VisionTrainer:
         )
         if labelpath == "":
             return
+        from src.vision.vsrc.rpi_dataset_builder import RPIDatasetBuilder # pylint: disable=import-outside-toplevel
         RPIDatasetBuilder(CTkToplevel(self.root), datapath, labelpath)
 
     def resistor_trainer(self) -> None:
@@ -59,6 +59,7 @@ class VisionTrainer:
         )
         if labelpath == "":
             return
+        from src.vision.vsrc.rpi_resistor_sorter import ResistorTrainer # pylint: disable=import-outside-toplevel
         ResistorTrainer(CTkToplevel(self.root), datapath, labelpath)
 
 if __name__ == "__main__":
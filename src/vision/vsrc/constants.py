@@ -8,6 +8,10 @@ RESOLUTION = "640x360"
 PADDING = 5
 # RPi Dataset Builder
 REALVNC_WINDOW_NAME = "DietPi (DietPi)"
+# Frames are pulled from the sorter's capture server, with VNC screenshots as the fallback
+CAPTURE_SERVER_URL = "http://DietPi:8001"
+# Seconds before trying the capture server again after it could not be reached
+CAPTURE_RETRY_COOLDOWN = 30
 LOWER_THRESHOLD = numpy.array([148, 250, 250], numpy.uint8)
 UPPER_THRESHOLD = numpy.array([152, 255, 255], numpy.uint8)
 BORDER_WIDTH = 8
@@ -24,6 +28,43 @@ RESISTOR_BODY_COLOUR = "#00CCFF"
 PRECISION = 3
 # Dataset
 DATASET_PATH = "./datasets/full"
+CURRENT_DATASET_PATH = "./datasets/full/current"
+DATASET_INDEX_PATH = "./datasets/full/index.sqlite"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# Label coordinates this far outside [0, 1] are clamped rather than rejected
+COORD_TOLERANCE = 0.01
+# Annotation tool image prefetching, the budget is in bytes of decoded images
+PREFETCH_RADIUS = 3
+IMAGE_CACHE_BUDGET = 256 * 1024 * 1024
+# Model quantisation
+QUANTISED_MODEL_PATH = "./src/vision/models/quantised"
+CALIBRATION_IMAGES = 200
+# Inference tuning
+TUNING_IMGSZ = [640, 512, 416, 320, 256]
+# Regions of interest as (x0, y0, x1, y1) fractions of the frame
+TUNING_ROIS = [(0, 0, 1, 1), (0.1, 0.1, 0.9, 0.9), (0.2, 0.15, 0.8, 0.85)]
+TUNING_ACCURACY_FLOOR = 0.95
+# Offline augmentation
+AUGMENT_COPIES = 3
+# Components lie at any angle on the conveyor
+AUGMENT_ROTATION = 180
+AUGMENT_FLIP_PROBABILITY = 0.5
+AUGMENT_CROP_SCALE = (0.7, 1.0)
+# The LED ring is warm white at a fixed colour, so the hue only moves a little while saturation and brightness vary more
+AUGMENT_HUE = 4
+AUGMENT_SATURATION = (0.8, 1.2)
+AUGMENT_VALUE = (0.7, 1.25)
+# Pre-labelling, every worker loads its own copy of the model
+PRELABEL_CONFIDENCE = 0.25
+PRELABEL_WORKERS = 2
+PROPOSALS_FOLDER = "proposals"
+PROPOSALS_MANIFEST = "proposals.jsonl"
+# Near duplicate detection, hashes are DEDUP_HASH_SIZE squared bits
+DEDUP_HASH_SIZE = 8
+DEDUP_THRESHOLD = 6
+# Training jobs, every run is written to a new numbered folder of MODEL_ARTIFACT_PATH
+TRAINING_JOB_CONFIG = "./src/vision/models/recipes/classifier_job.yaml"
+MODEL_ARTIFACT_PATH = "./src/vision/models/artifacts"
 DATA = {
     "resistors": {
         "label": "resistor",
@@ -0,0 +1,180 @@
+"""
+Offline augmentation of a dataset split.
+Every image is rotated, flipped, cropped and colour jittered into several copies
+by a process pool, transforming the oriented box polygons with the image and
+writing the copies into a new split with their labels and a manifest. Images are
+read and written inside the workers, so the dataset is never held in memory.
+Usage: python -m src.vision.vsrc.dataset_augmenter --split train --output train_aug --copies 3
+"""
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import cv2
+from src.vision.vsrc.labels import BOX_WIDTH, read_labels, write_labels, normalise, denormalise, boxes_to_corners
+from src.vision.vsrc.constants import CURRENT_DATASET_PATH, IMAGE_EXTENSIONS, PRECISION, AUGMENT_COPIES, AUGMENT_ROTATION, \
+    AUGMENT_FLIP_PROBABILITY, AUGMENT_CROP_SCALE, AUGMENT_HUE, AUGMENT_SATURATION, AUGMENT_VALUE
+
+def rotate(image:numpy.ndarray, polygons:numpy.ndarray, angle:float) -> tuple:
+    """
+    Rotate an image and (N, 4, 2) pixel polygons about the centre, None if a polygon would leave the image
+    """
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
+    polygons = polygons @ matrix[:, :2].T + matrix[:, 2]
+    if polygons.size and (polygons.min() < 0 or (polygons[..., 0] > width).any() or (polygons[..., 1] > height).any()):
+        return None
+    # Replicating the border keeps the conveyor background instead of adding black corners
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE), polygons
+
+def flip(image:numpy.ndarray, polygons:numpy.ndarray) -> tuple:
+    """
+    Mirror an image and pixel polygons horizontally
+    """
+    polygons = polygons.copy()
+    polygons[..., 0] = image.shape[1] - polygons[..., 0]
+    return cv2.flip(image, 1), polygons
+
+def crop(image:numpy.ndarray, polygons:numpy.ndarray, scale:float, rng:numpy.random.Generator) -> tuple:
+    """
+    Crop a window of scale times the image size containing every polygon and resize it back to the image size
+    """
+    height, width = image.shape[:2]
+    cropWidth, cropHeight = width * scale, height * scale
+    if polygons.size:
+        # Polygons reaching past the image edges only need their visible part kept
+        points = numpy.clip(polygons.reshape(-1, 2), 0, (width, height))
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        cropWidth, cropHeight = max(cropWidth, x1 - x0), max(cropHeight, y1 - y0)
+    else:
+        x0, y0, x1, y1 = width, height, 0, 0
+    # The upper bounds are at least the lower ones, which rounding can otherwise break when a polygon fills the window
+    left, top = max(0, x1 - cropWidth), max(0, y1 - cropHeight)
+    left = rng.uniform(left, max(left, min(x0, width - cropWidth)))
+    top = rng.uniform(top, max(top, min(y0, height - cropHeight)))
+    window = image[int(top):int(top + cropHeight), int(left):int(left + cropWidth)]
+    gain = (width / window.shape[1], height / window.shape[0])
+    return cv2.resize(window, (width, height), interpolation=cv2.INTER_LINEAR), (polygons - (int(left), int(top))) * gain
+
+def jitter_colour(image:numpy.ndarray, rng:numpy.random.Generator) -> numpy.ndarray:
+    """
+    Shift the hue and scale the saturation and brightness of a BGR image within the lighting's range
+    """
+    hue, saturation, value = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))
+    indices = numpy.arange(256, dtype=numpy.float32)
+    hueTable = ((indices + rng.integers(-AUGMENT_HUE, AUGMENT_HUE + 1)) % 180).astype(numpy.uint8)
+    saturationTable = numpy.clip(indices * rng.uniform(*AUGMENT_SATURATION), 0, 255).astype(numpy.uint8)
+    valueTable = numpy.clip(indices * rng.uniform(*AUGMENT_VALUE), 0, 255).astype(numpy.uint8)
+    hsv = cv2.merge((cv2.LUT(hue, hueTable), cv2.LUT(saturation, saturationTable), cv2.LUT(value, valueTable)))
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+def augment(image:numpy.ndarray, polygons:numpy.ndarray, rng:numpy.random.Generator) -> tuple:
+    """
+    Apply a random rotation, flip, crop and colour jitter, returns the image, polygons and the transforms used
+    """
+    transforms = []
+    for _ in range(5):
+        angle = rng.uniform(-AUGMENT_ROTATION, AUGMENT_ROTATION)
+        rotated = rotate(image, polygons, angle)
+        if rotated is not None:
+            image, polygons = rotated
+            transforms.append(f"rotate {angle:.1f}")
+            break
+    if rng.random() < AUGMENT_FLIP_PROBABILITY:
+        image, polygons = flip(image, polygons)
+        transforms.append("flip")
+    scale = rng.uniform(*AUGMENT_CROP_SCALE)
+    if scale < 1:
+        image, polygons = crop(image, polygons, scale, rng)
+        transforms.append(f"crop {scale:.2f}")
+    transforms.append("colour")
+    return jitter_colour(image, rng), polygons, transforms
+
+def to_polygons(coords:numpy.ndarray, size:tuple) -> numpy.ndarray:
+    """
+    Convert normalised label coordinates to (N, 4, 2) pixel polygons, boxes become their corners
+    """
+    if coords.shape[1] == BOX_WIDTH:
+        x0, y0, x1, y1 = boxes_to_corners(coords).T
+        coords = numpy.stack([x0, y0, x1, y0, x1, y1, x0, y1], axis=1)
+    return denormalise(coords, size).reshape(-1, 4, 2)
+
+def from_polygons(polygons:numpy.ndarray, size:tuple, width:int) -> numpy.ndarray:
+    """
+    Convert (N, 4, 2) pixel polygons back to normalised label coordinates, boxes become the bounds of the polygon
+    """
+    coords = normalise(polygons.reshape(-1, 8), size)
+    if width == BOX_WIDTH:
+        points = coords.reshape(-1, 4, 2)
+        low, high = points.min(axis=1), points.max(axis=1)
+        coords = numpy.concatenate([(low + high) / 2, high - low], axis=1)
+    return numpy.clip(coords, 0, 1)
+
+def augment_file(task:tuple) -> tuple:
+    """
+    Write the augmented copies of one image and its label, run in a worker process.
+    Returns the manifest entries and why the image was skipped, None if it was not.
+    """
+    imagePath, labelPath, imageFolder, labelFolder, copies, seed = task
+    image = cv2.imread(imagePath)
+    if image is None:
+        return [], f"{imagePath}: image could not be read"
+    size = (image.shape[1], image.shape[0])
+    try:
+        classes, coords = read_labels(labelPath)
+        polygons = to_polygons(coords, size)
+    except (ValueError, IndexError) as e:
+        # Malformed labels are reported by the validator, the rest of the split is still augmented
+        return [], f"{labelPath}: malformed label, {e}"
+    rng = numpy.random.default_rng(seed)
+    stem = os.path.splitext(os.path.basename(imagePath))[0]
+    entries = []
+    for copy in range(copies):
+        augmented, augmentedPolygons, transforms = augment(image, polygons, rng)
+        name = f"{stem}_aug{copy}"
+        cv2.imwrite(os.path.join(imageFolder, f"{name}.png"), augmented)
+        write_labels(os.path.join(labelFolder, f"{name}.txt"), classes, from_polygons(augmentedPolygons, size, coords.shape[1]), PRECISION)
+        entries.append({"image" : os.path.join(imageFolder, f"{name}.png"), "label" : os.path.join(labelFolder, f"{name}.txt"), "size" : size, \
+                        "classes" : classes.tolist(), "source" : imagePath, "transforms" : transforms})
+    return entries, None
+
+def tasks(dataset:str, split:str, output:str, copies:int, seed:int):
+    """
+    Generate a task for every labelled image in a split
+    """
+    imageFolder, labelFolder = os.path.join(dataset, "images", split), os.path.join(dataset, "labels", split)
+    for index, file in enumerate(sorted(os.listdir(imageFolder))):
+        labelPath = os.path.join(labelFolder, os.path.splitext(file)[0] + ".txt")
+        if file.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(labelPath):
+            yield os.path.join(imageFolder, file), labelPath, os.path.join(dataset, "images", output), os.path.join(dataset, "labels", output), copies, (seed, index)
+
+def run(dataset:str, split:str, output:str, copies:int=AUGMENT_COPIES, workers:int=None, seed:int=0) -> int:
+    """
+    Augment every labelled image of a split into the output split, returns how many images were written.
+    Images that cannot be augmented are skipped and printed.
+    """
+    os.makedirs(os.path.join(dataset, "images", output), exist_ok=True)
+    os.makedirs(os.path.join(dataset, "labels", output), exist_ok=True)
+    count = 0
+    # Manifest lines are written as each image finishes
+    with open(os.path.join(dataset, f"{output}_manifest.jsonl"), "w", encoding="utf-8") as manifest, ProcessPoolExecutor(max_workers=workers) as executor:
+        for entries, skipped in executor.map(augment_file, tasks(dataset, split, output, copies, seed), chunksize=16):
+            if skipped is not None:
+                print(f"Skipped {skipped}")
+            for entry in entries:
+                manifest.write(json.dumps(entry) + "\n")
+            count += len(entries)
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write augmented copies of a dataset split into a new split")
+    parser.add_argument("--dataset", default=CURRENT_DATASET_PATH, help="Dataset with images/ and labels/ splits")
+    parser.add_argument("--split", default="train", help="Split to augment")
+    parser.add_argument("--output", default="train_aug", help="Split to write the augmented images to")
+    parser.add_argument("--copies", type=int, default=AUGMENT_COPIES, help="Augmented copies of each image")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the number of CPUs")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    written = run(args.dataset, args.split, args.output, args.copies, args.workers, args.seed)
+    print(f"Wrote {written} images to {os.path.join(args.dataset, 'images', args.output)}")
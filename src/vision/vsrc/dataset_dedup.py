@@ -0,0 +1,190 @@
+"""
+Finds near duplicate images in a dataset tree.
+Difference hashes are computed by a process pool and pairs within DEDUP_THRESHOLD
+bits are found with a multi-index: each hash is split into threshold + 1 chunks,
+and two hashes that close must share one chunk exactly, so only hashes in the
+same chunk bucket are compared. Pairs are joined into clusters with union-find.
+Clusters can be reported or moved into one split. Removal only deletes the images
+within the threshold of their cluster's keeper, as a chain of near duplicates can
+join images that are far apart.
+Usage: python -m src.vision.vsrc.dataset_dedup ./datasets/full/current --report duplicates.json
+"""
+import os
+import json
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from src.common.image_hash import dhash, hamming
+from src.vision.vsrc.constants import DATASET_PATH, DEDUP_HASH_SIZE, DEDUP_THRESHOLD
+from src.vision.vsrc.dataset_validator import find_pairs
+from src.vision.vsrc.dataset_index import SPLITS, split_from_path
+
+class UnionFind:
+    """
+    Disjoint sets of indices
+    """
+    def __init__(self, size:int) -> None:
+        self.parent = list(range(size))
+
+    def find(self, index:int) -> int:
+        """
+        Root of the set containing index, halving the path on the way
+        """
+        while self.parent[index] != index:
+            self.parent[index] = self.parent[self.parent[index]]
+            index = self.parent[index]
+        return index
+
+    def union(self, index1:int, index2:int) -> None:
+        """
+        Join the sets of two indices
+        """
+        root1, root2 = self.find(index1), self.find(index2)
+        if root1 != root2:
+            self.parent[max(root1, root2)] = min(root1, root2)
+
+    def groups(self) -> list:
+        """
+        Sets with more than one member
+        """
+        members = defaultdict(list)
+        for index in range(len(self.parent)):
+            members[self.find(index)].append(index)
+        return [group for group in members.values() if len(group) > 1]
+
+def hash_image(path:str) -> int:
+    """
+    Difference hash of an image file, None if it cannot be read, run in a worker process
+    """
+    # The hash only needs a few pixels, so decode at a quarter of the size
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    return dhash(image, DEDUP_HASH_SIZE) if image is not None else None
+
+def chunk_masks(bits:int, chunks:int) -> list:
+    """
+    (shift, mask) of each of the chunks a hash is split into
+    """
+    bounds = [round(bits * i / chunks) for i in range(chunks + 1)]
+    return [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+
+def near_duplicate_pairs(hashes:list, bits:int=DEDUP_HASH_SIZE ** 2, threshold:int=DEDUP_THRESHOLD) -> set:
+    """
+    Index pairs of hashes at most threshold bits apart, None hashes are skipped
+    """
+    pairs = set()
+    for shift, mask in chunk_masks(bits, threshold + 1):
+        buckets = defaultdict(list)
+        for index, imageHash in enumerate(hashes):
+            if imageHash is not None:
+                buckets[(imageHash >> shift) & mask].append(index)
+        for bucket in buckets.values():
+            for position, index1 in enumerate(bucket):
+                for index2 in bucket[position + 1:]:
+                    if (index1, index2) not in pairs and hamming(hashes[index1], hashes[index2]) <= threshold:
+                        pairs.add((index1, index2))
+    return pairs
+
+def find_duplicates(root:str, threshold:int=DEDUP_THRESHOLD, workers:int=None) -> tuple:
+    """
+    Hash every image under root and cluster the near duplicates, returns the (image, label) pairs, their hashes and clusters of their indices
+    """
+    pairs, _ = find_pairs(root)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes = list(executor.map(hash_image, [image for image, _ in pairs], chunksize=64))
+    sets = UnionFind(len(pairs))
+    for index1, index2 in near_duplicate_pairs(hashes, DEDUP_HASH_SIZE ** 2, threshold):
+        sets.union(index1, index2)
+    return pairs, hashes, sets.groups()
+
+def keeper(pairs:list, cluster:list) -> int:
+    """
+    The image of a cluster to keep, the first one with a label
+    """
+    return min(cluster, key=lambda index: (not os.path.isfile(pairs[index][1]), pairs[index][0]))
+
+def remove_duplicates(pairs:list, hashes:list, clusters:list, threshold:int=DEDUP_THRESHOLD) -> int:
+    """
+    Delete the image and label of every cluster member within threshold bits of the keeper, returns how many images were removed
+    """
+    removed = 0
+    for cluster in clusters:
+        keep = keeper(pairs, cluster)
+        for index in cluster:
+            if index == keep or hamming(hashes[index], hashes[keep]) > threshold:
+                continue
+            for path in pairs[index]:
+                if os.path.isfile(path):
+                    os.remove(path)
+            removed += 1
+    return removed
+
+def move_to_split(path:str, split:str) -> str:
+    """
+    Path of a file moved from its split folder to another split
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    index = max(i for i, part in enumerate(parts[:-1]) if part in SPLITS)
+    parts[index] = split
+    return os.sep.join(parts)
+
+def unify_splits(pairs:list, clusters:list) -> int:
+    """
+    Move every image and label of each cluster into the keeper's split, returns how many images were moved
+    """
+    moved = 0
+    for cluster in clusters:
+        split = split_from_path(pairs[keeper(pairs, cluster)][0])
+        if split is None:
+            continue
+        for index in cluster:
+            if split_from_path(pairs[index][0]) in (None, split):
+                continue
+            for path in pairs[index]:
+                if os.path.isfile(path):
+                    target = move_to_split(path, split)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(path, target)
+            moved += 1
+    return moved
+
+def build_report(pairs:list, clusters:list) -> dict:
+    """
+    Clusters with their keeper first, and how many of them cross splits
+    """
+    report = []
+    for cluster in clusters:
+        keep = keeper(pairs, cluster)
+        images = [pairs[keep][0]] + sorted(pairs[index][0] for index in cluster if index != keep)
+        report.append({"keep" : images[0], "duplicates" : images[1:], "splits" : sorted({str(split_from_path(image)) for image in images})})
+    return {
+        "images" : len(pairs),
+        "clusters" : len(clusters),
+        "duplicates" : sum(len(cluster) - 1 for cluster in clusters),
+        "crossSplit" : sum(1 for cluster in report if len(cluster["splits"]) > 1),
+        "groups" : sorted(report, key=lambda cluster: -len(cluster["duplicates"])),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near duplicate images and remove them or keep them in one split")
+    parser.add_argument("root", nargs="?", default=None, help=f"Dataset folder to scan, defaults to {DATASET_PATH} when only reporting")
+    parser.add_argument("--threshold", type=int, default=DEDUP_THRESHOLD, help="Most bits two hashes may differ by")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the number of CPUs")
+    parser.add_argument("--report", default="duplicates.json", help="Where to write the clusters")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--remove", action="store_true", help="Delete all but one image of each cluster")
+    action.add_argument("--unify-splits", action="store_true", help="Move each cluster into a single split")
+    args = parser.parse_args()
+    # The default tree holds both the component folders and the exported copy of them, so files are only changed in a folder given explicitly
+    if args.root is None and (args.remove or args.unify_splits):
+        parser.error("root is required with --remove or --unify-splits")
+    allPairs, allHashes, allClusters = find_duplicates(args.root or DATASET_PATH, args.threshold, args.workers)
+    duplicateReport = build_report(allPairs, allClusters)
+    with open(args.report, "w", encoding="utf-8") as reportFile:
+        json.dump(duplicateReport, reportFile, indent=4)
+    print(f"{duplicateReport['images']} images, {duplicateReport['clusters']} clusters holding {duplicateReport['duplicates']} duplicates, " \
+          f"{duplicateReport['crossSplit']} clusters across splits, report in {args.report}")
+    if args.remove:
+        print(f"Removed {remove_duplicates(allPairs, allHashes, allClusters, args.threshold)} images")
+    elif args.unify_splits:
+        print(f"Moved {unify_splits(allPairs, allClusters)} images")
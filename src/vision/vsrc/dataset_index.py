@@ -0,0 +1,223 @@
+"""
+SQLite index of the dataset.
+Stores every image with its label, split, class counts and content hashes, so
+tools can query the dataset without rescanning it. Updates are incremental:
+only files whose size or modification time changed are read again.
+Usage: python -m src.vision.vsrc.dataset_index update ./datasets/full
+"""
+import os
+import random
+import sqlite3
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from src.vision.vsrc.constants import DATASET_PATH, DATASET_INDEX_PATH
+from src.vision.vsrc.dataset_validator import find_pairs
+from src.vision.vsrc.labels import read_labels
+SPLITS = ("train", "val", "test")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    image TEXT PRIMARY KEY,
+    label TEXT,
+    split TEXT,
+    imageSize INTEGER,
+    imageMtime REAL,
+    imageHash TEXT,
+    labelSize INTEGER,
+    labelMtime REAL,
+    labelHash TEXT
+);
+CREATE TABLE IF NOT EXISTS classes (
+    image TEXT REFERENCES files(image) ON DELETE CASCADE,
+    cls INTEGER,
+    count INTEGER,
+    PRIMARY KEY (image, cls)
+);
+CREATE INDEX IF NOT EXISTS classesByClass ON classes(cls);
+CREATE INDEX IF NOT EXISTS filesByHash ON files(imageHash);
+CREATE INDEX IF NOT EXISTS filesBySplit ON files(split);
+"""
+
+def file_hash(path:str) -> str:
+    """
+    SHA1 of a file's contents
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def split_from_path(path:str) -> str:
+    """
+    Get the split an image is in from its folders, None if it is not in one
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    return next((part for part in reversed(parts[:-1]) if part in SPLITS), None)
+
+def in_yolo_split(path:str) -> bool:
+    """
+    Check an image is in an images/<split> folder, where YOLO finds its label by swapping images for labels.
+    Augmented splits such as images/train_aug are not splits, so their copies never reach val or test.
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    return len(parts) >= 3 and parts[-3] == "images" and parts[-2] in SPLITS
+
+def read_classes(labelPath:str) -> dict:
+    """
+    Count the boxes of each class in a label file
+    """
+    try:
+        classes, _ = read_labels(labelPath)
+    except ValueError:
+        # Malformed files are reported by the validator
+        return {}
+    values, counts = numpy.unique(classes, return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+def stat_or_none(path:str) -> tuple:
+    """
+    Get the (size, modification time) of a file, None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+class DatasetIndex:
+    """
+    Index of images, labels and classes backed by SQLite
+    """
+    def __init__(self, path:str=DATASET_INDEX_PATH) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """
+        Close the database
+        """
+        self.connection.close()
+
+    def update(self, root:str=DATASET_PATH, workers:int=8) -> dict:
+        """
+        Bring the index up to date with the files under root, returns how many rows were added, changed and removed
+        """
+        pairs, _ = find_pairs(root)
+        # Match whole folders, LIKE would also match sibling trees and treat _ as a wildcard
+        prefix = "" if os.path.normpath(root) == "." else os.path.join(os.path.normpath(root), "")
+        known = {row[0] : row[1:] for row in self.connection.execute( \
+            "SELECT image, imageSize, imageMtime, labelSize, labelMtime, split FROM files WHERE substr(image, 1, length(?)) = ?", (prefix, prefix))}
+        changed = []
+        for image, label in pairs:
+            image = os.path.normpath(image)
+            imageStat, labelStat = stat_or_none(image), stat_or_none(label)
+            if imageStat is None:
+                continue
+            current = imageStat + (labelStat if labelStat is not None else (None, None))
+            previous = known.pop(image, None)
+            if previous is None or previous[:4] != current:
+                # Changed files keep the split they were given by resplit
+                split = previous[4] if previous is not None else split_from_path(image)
+                changed.append((image, label if labelStat is not None else None, split, current))
+        # Hashing is IO bound, so threads are enough
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(self.read_entry, changed))
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE image = ?", [(image,) for image in known])
+            for entry, classCounts in rows:
+                self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", entry)
+                self.connection.execute("DELETE FROM classes WHERE image = ?", (entry[0],))
+                self.connection.executemany("INSERT INTO classes VALUES (?, ?, ?)", [(entry[0], cls, count) for cls, count in classCounts.items()])
+        return {"files" : len(pairs), "updated" : len(rows), "removed" : len(known)}
+
+    @staticmethod
+    def read_entry(change:tuple) -> tuple:
+        """
+        Read the hashes and classes of a changed image
+        """
+        image, label, split, (imageSize, imageMtime, labelSize, labelMtime) = change
+        labelHash = file_hash(label) if label is not None else None
+        classCounts = read_classes(label) if label is not None else {}
+        return (image, label, split, imageSize, imageMtime, file_hash(image), labelSize, labelMtime, labelHash), classCounts
+
+    def class_counts(self, split:str=None) -> dict:
+        """
+        Number of boxes of each class, in one split or all of them
+        """
+        query = "SELECT cls, SUM(count) FROM classes JOIN files USING (image)"
+        rows = self.connection.execute(query + " WHERE split = ? GROUP BY cls" if split else query + " GROUP BY cls", (split,) if split else ())
+        return dict(rows.fetchall())
+
+    def images(self, split:str=None, cls:int=None) -> list:
+        """
+        Images in a split and/or containing a class
+        """
+        query, args = "SELECT DISTINCT image FROM files LEFT JOIN classes USING (image) WHERE 1", []
+        if split is not None:
+            query, args = query + " AND split = ?", args + [split]
+        if cls is not None:
+            query, args = query + " AND cls = ?", args + [cls]
+        return [row[0] for row in self.connection.execute(query + " ORDER BY image", args)]
+
+    def duplicates(self) -> list:
+        """
+        Groups of images with identical contents
+        """
+        rows = self.connection.execute("SELECT GROUP_CONCAT(image, '\n') FROM files GROUP BY imageHash HAVING COUNT(*) > 1")
+        return [row[0].split("\n") for row in rows]
+
+    def resplit(self, ratios:tuple=(0.8, 0.1, 0.1), seed:int=0) -> dict:
+        """
+        Assign every labelled image in an images/<split> folder to a split, keeping identical images in the same split
+        """
+        rows = self.connection.execute("SELECT image, imageHash FROM files WHERE label IS NOT NULL").fetchall()
+        hashes = sorted({imageHash for image, imageHash in rows if in_yolo_split(image)})
+        random.Random(seed).shuffle(hashes)
+        bounds = [round(sum(ratios[:i + 1]) * len(hashes)) for i in range(len(SPLITS))]
+        assignment = [(SPLITS[next(s for s, bound in enumerate(bounds) if index < bound)], imageHash) for index, imageHash in enumerate(hashes)]
+        splits = dict((imageHash, split) for split, imageHash in assignment)
+        with self.connection:
+            self.connection.executemany("UPDATE files SET split = ? WHERE image = ?", \
+                                        [(splits[imageHash], image) for image, imageHash in rows if in_yolo_split(image)])
+        return {split : sum(1 for s, _ in assignment if s == split) for split in SPLITS}
+
+    def export_lists(self, folder:str) -> dict:
+        """
+        Write train.txt, val.txt and test.txt image lists, which YOLO dataset files can point to instead of folders.
+        Only labelled images YOLO can find the labels of are listed. Returns the images written to each list.
+        """
+        os.makedirs(folder, exist_ok=True)
+        lists = {}
+        for split in SPLITS:
+            rows = self.connection.execute("SELECT image FROM files WHERE split = ? AND label IS NOT NULL ORDER BY image", (split,))
+            lists[split] = [os.path.abspath(row[0]) for row in rows if in_yolo_split(row[0])]
+            with open(os.path.join(folder, f"{split}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(lists[split]))
+        return lists
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain and query the dataset index")
+    parser.add_argument("command", choices=["update", "classes", "duplicates", "resplit", "export"], help="What to do")
+    parser.add_argument("root", nargs="?", default=DATASET_PATH, help="Dataset folder for update, output folder for export")
+    parser.add_argument("--index", default=DATASET_INDEX_PATH, help="Index database")
+    parser.add_argument("--split", default=None, choices=SPLITS, help="Split to count classes in")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for resplit")
+    args = parser.parse_args()
+    index = DatasetIndex(args.index)
+    if args.command == "update":
+        print(index.update(args.root))
+    elif args.command == "classes":
+        for classNum, classCount in sorted(index.class_counts(args.split).items()):
+            print(f"{classNum:>4} {classCount}")
+    elif args.command == "duplicates":
+        for group in index.duplicates():
+            print(", ".join(group))
+    elif args.command == "resplit":
+        print(index.resplit(seed=args.seed))
+    elif args.command == "export":
+        index.export_lists(args.root)
+    index.close()
@@ -0,0 +1,210 @@
+"""
+Headless dataset validator.
+Scans a dataset tree with a process pool and checks every label against its
+image: class ids from DATA, normalised coordinates, 4 point polygons and
+missing or orphaned files. Writes a JSON report and a manifest of the usable
+image and label pairs, with coordinates slightly out of range clamped.
+Usage: python -m src.vision.vsrc.dataset_validator ./datasets/full --report report.json --manifest manifest.jsonl
+"""
+import os
+import json
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from PIL import Image
+from src.vision.vsrc.constants import DATA, DATASET_PATH, IMAGE_EXTENSIONS, COORD_TOLERANCE
+from src.vision.vsrc.labels import OBB_WIDTH, parse_labels, format_labels
+# Oriented boxes use component classes, axis aligned boxes are resistor bands and the stem
+OBB_CLASSES = {data["num_label"] for data in DATA.values()}
+BAND_CLASSES = set(range(len(DATA["resistors"]["values"]))) | {len(DATA["resistors"]["values"]), 42}
+IMAGE_FOLDERS = ("images", "imgs")
+# Issues that make a pair unusable, the rest are warnings
+ERRORS = {"unreadable_image", "not_a_number", "bad_token_count", "bad_class", "out_of_range", "degenerate_polygon", "orphan_label"}
+
+def label_path_for(imagePath:str) -> str:
+    """
+    Get the label file of an image, images/ or imgs/ folders map to labels/
+    """
+    parts = os.path.normpath(imagePath).split(os.sep)
+    for index in range(len(parts) - 2, -1, -1):
+        if parts[index] in IMAGE_FOLDERS:
+            parts[index] = "labels"
+            break
+    return os.path.splitext(os.sep.join(parts))[0] + ".txt"
+
+def find_pairs(root:str) -> tuple:
+    """
+    Walk a dataset tree and get the (image, label) pairs and the labels without an image
+    """
+    images, labels = [], set()
+    for folder, _, files in os.walk(root):
+        for file in files:
+            path = os.path.join(folder, file)
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(path)
+            elif file.endswith(".txt") and "labels" in os.path.normpath(folder).split(os.sep):
+                labels.add(os.path.normpath(path))
+    pairs = [(image, label_path_for(image)) for image in sorted(images)]
+    orphans = sorted(labels - {os.path.normpath(label) for _, label in pairs})
+    return pairs, orphans
+
+def check_labels(classes:numpy.ndarray, coords:numpy.ndarray) -> tuple:
+    """
+    Check every line of a parsed label file at once, returns the issues and the coordinates with small errors clamped
+    """
+    issues = []
+    def issue(rows:numpy.ndarray, code:str, message:callable) -> None:
+        issues.extend({"line" : int(row) + 1, "code" : code, "message" : message(row)} for row in numpy.flatnonzero(rows))
+    polygon = coords.shape[1] == OBB_WIDTH
+    issue(~numpy.isin(classes, list(OBB_CLASSES if polygon else BAND_CLASSES)), "bad_class", \
+          lambda row: f"class {classes[row]} is not a {'component' if polygon else 'band'} class")
+    low, high = coords.min(axis=1), coords.max(axis=1)
+    outOfRange = ~numpy.isfinite(coords).all(axis=1) | (low < -COORD_TOLERANCE) | (high > 1 + COORD_TOLERANCE)
+    clamped = ~outOfRange & ((low < 0) | (high > 1))
+    issue(outOfRange, "out_of_range", lambda row: f"coordinates outside [0, 1]: {low[row]:.3f} to {high[row]:.3f}")
+    issue(clamped, "clamped", lambda _: "coordinates slightly outside [0, 1] were clamped")
+    coords = numpy.where(clamped[:, None], numpy.clip(coords, 0, 1), coords)
+    if polygon:
+        x, y = coords[:, 0::2], coords[:, 1::2]
+        # Shoelace formula
+        area = numpy.abs((x * numpy.roll(y, 1, axis=1)).sum(axis=1) - (y * numpy.roll(x, 1, axis=1)).sum(axis=1)) / 2
+        issue(area < 1e-6, "degenerate_polygon", lambda _: "polygon has no area")
+    else:
+        issue((coords[:, 2] <= 0) | (coords[:, 3] <= 0), "degenerate_polygon", lambda _: "box has no area")
+    return sorted(issues, key=lambda item: item["line"]), coords
+
+def check_line(tokens:list, lineNumber:int) -> tuple:
+    """
+    Check one label line, returns the issues and the line with clamped coordinates
+    """
+    if len(tokens) not in (5, 9):
+        return [{"line" : lineNumber, "code" : "bad_token_count", "message" : f"{len(tokens)} values, expected 5 for a box or 9 for a 4 point polygon"}], None
+    try:
+        classes, coords = parse_labels(" ".join(tokens))
+    except ValueError:
+        return [{"line" : lineNumber, "code" : "not_a_number", "message" : " ".join(tokens)}], None
+    issues, coords = check_labels(classes, coords)
+    for item in issues:
+        item["line"] = lineNumber
+    return issues, format_labels(classes, coords)
+
+def validate_pair(pair:tuple) -> dict:
+    """
+    Validate an image and its label, run in a worker process
+    """
+    imagePath, labelPath = pair
+    result = {"image" : imagePath, "label" : labelPath, "size" : None, "classes" : [], "issues" : [], "fixed" : None}
+    try:
+        with Image.open(imagePath) as image:
+            result["size"] = image.size
+            image.verify()
+    except Exception as e: # pylint: disable=broad-except
+        result["issues"].append({"line" : None, "code" : "unreadable_image", "message" : repr(e)})
+    if not os.path.isfile(labelPath):
+        result["label"] = None
+        result["issues"].append({"line" : None, "code" : "missing_label", "message" : "no label file"})
+        return result
+    with open(labelPath, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        classes, coords = parse_labels(text)
+        issues, coords = check_labels(classes, coords)
+        result["issues"] += issues
+        result["classes"] = classes.tolist()
+        fixedText = format_labels(classes, coords)
+    except ValueError:
+        # Files with malformed or mixed lines are checked line by line
+        fixedLines = []
+        for lineNumber, tokens in enumerate((line.split() for line in text.splitlines() if line.strip()), 1):
+            issues, fixedLine = check_line(tokens, lineNumber)
+            result["issues"] += issues
+            if fixedLine is not None:
+                fixedLines.append(fixedLine)
+                result["classes"].append(int(float(tokens[0])))
+        fixedText = "\n".join(fixedLines)
+    if not text.strip():
+        result["issues"].append({"line" : None, "code" : "empty_label", "message" : "label file is empty"})
+    if any(issue["code"] == "clamped" for issue in result["issues"]):
+        result["fixed"] = fixedText
+    return result
+
+def status(result:dict) -> str:
+    """
+    Summarise a result as ok, fixed, warning or invalid
+    """
+    codes = {issue["code"] for issue in result["issues"]}
+    if codes & ERRORS:
+        return "invalid"
+    if "clamped" in codes:
+        return "fixed"
+    return "warning" if codes else "ok"
+
+def validate(root:str, workers:int=None) -> tuple:
+    """
+    Validate every pair under root in parallel, returns the results and orphaned labels
+    """
+    pairs, orphans = find_pairs(root)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(validate_pair, pairs, chunksize=64))
+    return results, orphans
+
+def build_report(results:list, orphans:list) -> dict:
+    """
+    Count issues, statuses and classes
+    """
+    issueCounts = Counter(issue["code"] for result in results for issue in result["issues"])
+    issueCounts["orphan_label"] += len(orphans)
+    return {
+        "images" : len(results),
+        "status" : dict(Counter(status(result) for result in results)),
+        "issues" : dict(issueCounts),
+        "classes" : dict(Counter(cls for result in results for cls in result["classes"])),
+        "orphanLabels" : orphans,
+        "problems" : [{"image" : result["image"], "label" : result["label"], "issues" : result["issues"]} for result in results \
+                      if status(result) in ("invalid", "warning")],
+    }
+
+def write_manifest(results:list, path:str) -> int:
+    """
+    Write the usable pairs as JSON lines, returns how many were written
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            if status(result) == "invalid" or result["label"] is None:
+                continue
+            f.write(json.dumps({"image" : result["image"], "label" : result["label"], "size" : result["size"], \
+                                "classes" : result["classes"], "status" : status(result)}) + "\n")
+            count += 1
+    return count
+
+def apply_fixes(results:list) -> int:
+    """
+    Write clamped coordinates back to the label files, returns how many were fixed
+    """
+    fixed = [result for result in results if status(result) == "fixed"]
+    for result in fixed:
+        with open(result["label"], "w", encoding="utf-8") as f:
+            f.write(result["fixed"])
+    return len(fixed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate every label in a dataset tree")
+    parser.add_argument("root", nargs="?", default=DATASET_PATH, help="Dataset folder to scan")
+    parser.add_argument("--report", default="dataset_report.json", help="Where to write the JSON report")
+    parser.add_argument("--manifest", default="dataset_manifest.jsonl", help="Where to write the manifest of usable pairs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the number of CPUs")
+    parser.add_argument("--fix", action="store_true", help="Write clamped coordinates back to the label files")
+    args = parser.parse_args()
+    allResults, orphanLabels = validate(args.root, args.workers)
+    report = build_report(allResults, orphanLabels)
+    with open(args.report, "w", encoding="utf-8") as reportFile:
+        json.dump(report, reportFile, indent=4)
+    written = write_manifest(allResults, args.manifest)
+    print(f"{report['images']} images: {report['status']}")
+    for code, codeCount in sorted(report["issues"].items(), key=lambda item: -item[1]):
+        print(f"    {code:<20} {codeCount}")
+    print(f"{written} pairs written to {args.manifest}, report in {args.report}")
+    if args.fix:
+        print(f"Fixed {apply_fixes(allResults)} label files")
@@ -0,0 +1,109 @@
+"""
+Prefetching image loader for the annotation tools.
+Images around the current one are decoded and resized on a worker thread into
+an LRU cache limited by a memory budget, so moving to the next image only has
+to create the Tk image.
+"""
+import threading
+from collections import OrderedDict
+from PIL import Image
+from src.vision.vsrc.constants import PREFETCH_RADIUS, IMAGE_CACHE_BUDGET
+
+def images_bytes(images:tuple) -> int:
+    """
+    Approximate memory used by decoded images, counting an image used twice once
+    """
+    unique = {id(image) : image for image in images}.values()
+    return sum(image.width * image.height * len(image.getbands()) for image in unique)
+
+class ImageLoader:
+    """
+    Loads (full image, display image) pairs by index, prefetching the neighbours
+    """
+    def __init__(self, paths:list, displaySize:tuple=None, resample:int=Image.NEAREST, radius:int=PREFETCH_RADIUS, budget:int=IMAGE_CACHE_BUDGET) -> None:
+        self.paths = paths
+        self.resample = resample
+        # Either a (width, height) or a height to scale to, set from the Tk thread only
+        self.displaySize = displaySize
+        self.radius = radius
+        self.budget = budget
+        self.cache = OrderedDict()
+        self.used = 0
+        self.current = None
+        self.lock = threading.Lock()
+        self.wanted = []
+        self.wake = threading.Event()
+        threading.Thread(target=self.prefetch, daemon=True).start()
+
+    def key(self, index:int) -> tuple:
+        """
+        Cache key of an image at the current display size
+        """
+        return (self.paths[index], self.displaySize)
+
+    def load(self, index:int, displaySize:tuple) -> tuple:
+        """
+        Decode and resize an image
+        """
+        image = Image.open(self.paths[index])
+        image.load()
+        if displaySize is None:
+            return image, image
+        if isinstance(displaySize, int):
+            displaySize = (max(1, int(image.width * displaySize / image.height)), displaySize)
+        return image, image.resize(displaySize, self.resample)
+
+    def store(self, key:tuple, images:tuple) -> None:
+        """
+        Add images to the cache, evicting the least recently used ones over the budget
+        """
+        with self.lock:
+            if key in self.cache:
+                return
+            self.cache[key] = images
+            self.used += images_bytes(images)
+            while self.used > self.budget and len(self.cache) > 1:
+                oldKey = next(iter(self.cache))
+                if oldKey == self.current:
+                    self.cache.move_to_end(oldKey)
+                    oldKey = next(iter(self.cache))
+                self.used -= images_bytes(self.cache.pop(oldKey))
+
+    def get(self, index:int) -> tuple:
+        """
+        Get the (full image, display image) at index, loading it now if it was not prefetched
+        """
+        key = self.key(index)
+        self.current = key
+        with self.lock:
+            images = self.cache.get(key)
+            if images is not None:
+                self.cache.move_to_end(key)
+        if images is None:
+            images = self.load(index, self.displaySize)
+            self.store(key, images)
+        # Closest neighbours first
+        neighbours = [index + offset * sign for offset in range(1, self.radius + 1) for sign in (1, -1)]
+        with self.lock:
+            self.wanted = [(i, self.displaySize) for i in neighbours if 0 <= i < len(self.paths)]
+        self.wake.set()
+        return images
+
+    def prefetch(self) -> None:
+        """
+        Worker thread loading the images near the current one
+        """
+        while True:
+            self.wake.wait()
+            with self.lock:
+                if not self.wanted:
+                    self.wake.clear()
+                    continue
+                index, displaySize = self.wanted.pop(0)
+                cached = (self.paths[index], displaySize) in self.cache
+            if cached:
+                continue
+            try:
+                self.store((self.paths[index], displaySize), self.load(index, displaySize))
+            except OSError as e:
+                print(f"Could not prefetch {self.paths[index]}: {e}")
@@ -0,0 +1,56 @@
+"""
+Picks the input size and region of interest for inference.
+Every combination of TUNING_IMGSZ and TUNING_ROIS is scored on the labelled
+validation split and the fastest one that reaches the accuracy floor is saved
+to INFERENCE_TUNING_PATH, where the inference process picks it up.
+Usage: python -m src.vision.vsrc.inference_tuner --backend ultralytics
+"""
+import os
+import json
+import argparse
+from src.common.constants import INFERENCE_BACKEND, INFERENCE_TUNING_PATH
+from src.pi4.inference_backends import BACKENDS, ONNX_Backend, create_backend
+from src.vision.vsrc.constants import CURRENT_DATASET_PATH, TUNING_IMGSZ, TUNING_ROIS, TUNING_ACCURACY_FLOOR
+from src.vision.vsrc.model_quantiser import list_images, evaluate
+
+def tune(backendName:str, modelPath:str, imagePaths:list, labelFolder:str, imgszs:list=TUNING_IMGSZ, rois:list=TUNING_ROIS) -> list:
+    """
+    Score every input size and region of interest, fastest first
+    """
+    backend = create_backend(backendName, modelPath).load()
+    # Exported models have a fixed input size, so only the region can be tuned
+    if isinstance(backend, ONNX_Backend):
+        imgszs = [None]
+    candidates = []
+    for imgsz in imgszs:
+        for roi in rois:
+            backend.imgsz, backend.roi = imgsz, list(roi)
+            stats = evaluate(backend, imagePaths, labelFolder)
+            candidates.append({"imgsz" : imgsz, "roi" : list(roi), **stats})
+            print(f"imgsz {imgsz} roi {roi}: accuracy {stats['accuracy']:.3f}, {stats['meanMs']:.1f}ms")
+    return sorted(candidates, key=lambda candidate: candidate["meanMs"])
+
+def pick(candidates:list, accuracyFloor:float=TUNING_ACCURACY_FLOOR) -> dict:
+    """
+    Fastest candidate that reaches the accuracy floor, the most accurate one if none do
+    """
+    for candidate in candidates:
+        if candidate["accuracy"] >= accuracyFloor:
+            return candidate
+    print(f"No configuration reaches an accuracy of {accuracyFloor}, using the most accurate")
+    return max(candidates, key=lambda candidate: candidate["accuracy"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the fastest input size and region that is accurate enough")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=list(BACKENDS), help="Backend to tune")
+    parser.add_argument("--model", default=None, help="Model for the backend, defaults to the one in the constants")
+    parser.add_argument("--dataset", default=CURRENT_DATASET_PATH, help="Dataset with images/ and labels/ splits")
+    parser.add_argument("--floor", type=float, default=TUNING_ACCURACY_FLOOR, help="Minimum top class accuracy")
+    parser.add_argument("--output", default=INFERENCE_TUNING_PATH, help="Where to save the chosen configuration")
+    args = parser.parse_args()
+    results = tune(args.backend, args.model, list_images(os.path.join(args.dataset, "images", "val")), os.path.join(args.dataset, "labels", "val"))
+    best = pick(results, args.floor)
+    print(f"Picked imgsz {best['imgsz']} roi {best['roi']}: accuracy {best['accuracy']:.3f}, {best['meanMs']:.1f}ms")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"backend" : args.backend, "imgsz" : best["imgsz"], "roi" : best["roi"], "accuracyFloor" : args.floor, \
+                   "chosen" : best, "candidates" : results}, f, indent=4)
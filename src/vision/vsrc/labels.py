@@ -0,0 +1,89 @@
+"""
+Label file I/O shared by the dataset tools.
+A label file holds one object per line: a class followed by normalised
+coordinates, either 8 for a 4 point polygon (OBB) or 4 for a centre and size
+box (resistor bands). Whole files are read and written as NumPy arrays.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+OBB_WIDTH = 8
+BOX_WIDTH = 4
+
+def parse_labels(text:str) -> tuple:
+    """
+    Parse label text into (N,) classes and (N, 8) or (N, 4) coordinates.
+    Raises ValueError if the lines have different lengths or are not numbers.
+    """
+    rows = [line.split() for line in text.splitlines() if line.strip()]
+    if not rows:
+        return numpy.zeros(0, numpy.int64), numpy.zeros((0, OBB_WIDTH))
+    values = numpy.array(rows, dtype=float)
+    if values.ndim != 2 or values.shape[1] - 1 not in (OBB_WIDTH, BOX_WIDTH):
+        raise ValueError(f"Expected {OBB_WIDTH + 1} or {BOX_WIDTH + 1} values per line")
+    return values[:, 0].astype(numpy.int64), values[:, 1:]
+
+def read_labels(path:str) -> tuple:
+    """
+    Read a label file into (N,) classes and (N, 8) or (N, 4) normalised coordinates
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_labels(f.read())
+
+def format_labels(classes:numpy.ndarray, coords:numpy.ndarray, precision:int=None) -> str:
+    """
+    Format (N,) classes and (N, 8) or (N, 4) coordinates as label text
+    """
+    coords = numpy.asarray(coords, dtype=float)
+    if precision is not None:
+        coords = numpy.round(coords, precision)
+    return "\n".join(f"{int(cls)} " + " ".join(str(value) for value in row.tolist()) for cls, row in zip(classes, coords))
+
+def write_labels(path:str, classes:numpy.ndarray, coords:numpy.ndarray, precision:int=None) -> None:
+    """
+    Write classes and normalised coordinates to a label file
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(format_labels(classes, coords, precision))
+
+def scale(coords:numpy.ndarray, size:tuple) -> numpy.ndarray:
+    """
+    Multiply alternating x and y values by a (width, height), works for polygons and boxes
+    """
+    coords = numpy.asarray(coords, dtype=float)
+    return coords * numpy.tile(numpy.asarray(size, dtype=float), coords.shape[-1] // 2)
+
+def denormalise(coords:numpy.ndarray, size:tuple) -> numpy.ndarray:
+    """
+    Convert normalised coordinates to pixels of an image (width, height)
+    """
+    return scale(coords, size)
+
+def normalise(coords:numpy.ndarray, size:tuple) -> numpy.ndarray:
+    """
+    Convert pixel coordinates of an image (width, height) to normalised coordinates
+    """
+    return scale(coords, (1 / size[0], 1 / size[1]))
+
+def boxes_to_corners(boxes:numpy.ndarray) -> numpy.ndarray:
+    """
+    Convert (N, 4) centre and size boxes to (N, 4) x1, y1, x2, y2 corners
+    """
+    boxes = numpy.asarray(boxes, dtype=float).reshape(-1, 4)
+    return numpy.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+
+def corners_to_boxes(corners:numpy.ndarray) -> numpy.ndarray:
+    """
+    Convert (N, 4) x1, y1, x2, y2 corners to (N, 4) centre and size boxes
+    """
+    corners = numpy.asarray(corners, dtype=float).reshape(-1, 4)
+    return numpy.concatenate([(corners[:, :2] + corners[:, 2:]) / 2, numpy.abs(corners[:, 2:] - corners[:, :2])], axis=1)
+
+def load_split(labelFolder:str, workers:int=8) -> dict:
+    """
+    Read every label file in a folder, keyed by file name without extension
+    """
+    names = sorted(f for f in os.listdir(labelFolder) if f.endswith(".txt"))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        labels = executor.map(read_labels, (os.path.join(labelFolder, name) for name in names))
+        return {os.path.splitext(name)[0] : label for name, label in zip(names, labels)}
@@ -0,0 +1,151 @@
+"""
+Exports the classifier to ONNX, quantises it to INT8 and compares accuracy against latency.
+Static quantisation is calibrated on training images from the current dataset and
+every model is scored on the test split, so the precision to ship can be picked
+from one report.
+Usage: python -m src.vision.vsrc.model_quantiser --model ./src/vision/models/final/classifier.pt
+"""
+import os
+import json
+import time
+import random
+import argparse
+import numpy
+import cv2
+from src.common.constants import CLASSIFIER_PATH
+from src.pi4.inference_backends import ONNX_Backend, create_backend, letterbox, to_tensor, polygon_iou
+from src.vision.vsrc.labels import OBB_WIDTH, read_labels, denormalise
+from src.vision.vsrc.dataset_validator import label_path_for
+from src.vision.vsrc.constants import CURRENT_DATASET_PATH, QUANTISED_MODEL_PATH, CALIBRATION_IMAGES, IMG_SIZE
+
+def list_images(folder:str) -> list:
+    """
+    Get the paths of every image in a folder
+    """
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith((".png", ".jpg")))
+
+def export_onnx(modelPath:str, imgsz:int=IMG_SIZE[0]) -> str:
+    """
+    Export an ultralytics model to ONNX and return the path of the export
+    """
+    from ultralytics import YOLO # pylint: disable=import-outside-toplevel
+    return YOLO(modelPath).export(format="onnx", imgsz=imgsz, simplify=True)
+
+class CalibrationReader:
+    """
+    Feeds letterboxed training images to the static quantiser
+    """
+    def __init__(self, onnxPath:str, imagePaths:list) -> None:
+        backend = ONNX_Backend(onnxPath).load()
+        self.inputName = backend.inputName
+        self.inputSize = backend.inputSize
+        self.imagePaths = iter(imagePaths)
+
+    def get_next(self) -> dict:
+        """
+        Next calibration input, None when there are no more
+        """
+        path = next(self.imagePaths, None)
+        if path is None:
+            return None
+        image, _, _ = letterbox(cv2.imread(path), self.inputSize)
+        return {self.inputName : to_tensor(image)}
+
+def quantise_dynamic(onnxPath:str, outputPath:str) -> str:
+    """
+    Quantise the weights to INT8, activations are quantised on the fly
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType # pylint: disable=import-outside-toplevel
+    quantize_dynamic(onnxPath, outputPath, weight_type=QuantType.QUInt8)
+    return outputPath
+
+def quantise_static(onnxPath:str, outputPath:str, calibrationPaths:list) -> str:
+    """
+    Quantise weights and activations to INT8 using ranges measured on the calibration images
+    """
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType # pylint: disable=import-outside-toplevel
+    quantize_static(onnxPath, outputPath, CalibrationReader(onnxPath, calibrationPaths), quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, \
+                    weight_type=QuantType.QInt8, per_channel=True)
+    return outputPath
+
+def read_label(labelPath:str, width:int, height:int) -> tuple:
+    """
+    Read the first box of a label file as (class, (4, 2) corners in pixels), None if unlabelled
+    """
+    if not os.path.isfile(labelPath):
+        return None
+    classes, coords = read_labels(labelPath)
+    if len(classes) == 0 or coords.shape[1] != OBB_WIDTH:
+        return None
+    return int(classes[0]), denormalise(coords[0], (width, height)).astype(numpy.float32).reshape(4, 2)
+
+def evaluate(backend:object, imagePaths:list, labelFolder:str=None) -> dict:
+    """
+    Score a loaded backend on labelled images: top class accuracy, top box IoU and latency.
+    Labels are read from labelFolder, or from the labels folder matching each image if it is None.
+    """
+    latencies, ious, correct, labelled = [], [], 0, 0
+    backend.warm_up((IMG_SIZE[1], IMG_SIZE[0], 3))
+    for path in imagePaths:
+        frame = cv2.imread(path)
+        start = time.time()
+        detections = backend.predict_roi(frame)
+        latencies.append(time.time() - start)
+        labelPath = label_path_for(path) if labelFolder is None else os.path.join(labelFolder, os.path.splitext(os.path.basename(path))[0] + ".txt")
+        label = read_label(labelPath, frame.shape[1], frame.shape[0])
+        if label is None:
+            continue
+        labelled += 1
+        if len(detections) == 0:
+            ious.append(0)
+            continue
+        correct += int(detections.cls[0]) == label[0]
+        ious.append(polygon_iou(detections.boxes[0], label[1]))
+    latencies = numpy.array(latencies) * 1000
+    return {
+        "images" : len(imagePaths),
+        "accuracy" : correct / labelled if labelled else 0,
+        "meanIoU" : float(numpy.mean(ious)) if ious else 0,
+        "meanMs" : float(latencies.mean()),
+        "p50Ms" : float(numpy.percentile(latencies, 50)),
+        "p90Ms" : float(numpy.percentile(latencies, 90)),
+        "sizeMB" : os.path.getsize(backend.modelPath) / 1e6,
+    }
+
+def print_report(report:dict) -> None:
+    """
+    Print the comparison as a table
+    """
+    print(f"{'model':<10} {'accuracy':>9} {'IoU':>6} {'mean ms':>8} {'p50 ms':>8} {'p90 ms':>8} {'MB':>7}")
+    for name, stats in report.items():
+        print(f"{name:<10} {stats['accuracy']:>9.3f} {stats['meanIoU']:>6.3f} {stats['meanMs']:>8.1f} {stats['p50Ms']:>8.1f} {stats['p90Ms']:>8.1f} {stats['sizeMB']:>7.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantise the classifier and compare accuracy against latency")
+    parser.add_argument("--model", default=CLASSIFIER_PATH, help="Float .pt model to export")
+    parser.add_argument("--dataset", default=CURRENT_DATASET_PATH, help="Dataset with images/ and labels/ splits")
+    parser.add_argument("--output", default=QUANTISED_MODEL_PATH, help="Folder for the exported models")
+    parser.add_argument("--calibration", type=int, default=CALIBRATION_IMAGES, help="Number of training images to calibrate with")
+    parser.add_argument("--skip-pt", action="store_true", help="Do not benchmark the ultralytics model")
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    # Export and quantise
+    floatPath = export_onnx(args.model)
+    trainImages = list_images(os.path.join(args.dataset, "images", "train"))
+    calibrationImages = random.Random(0).sample(trainImages, min(args.calibration, len(trainImages)))
+    models = {
+        "fp32" : floatPath,
+        "int8-dyn" : quantise_dynamic(floatPath, os.path.join(args.output, "classifier_int8_dynamic.onnx")),
+        "int8-static" : quantise_static(floatPath, os.path.join(args.output, "classifier_int8_static.onnx"), calibrationImages),
+    }
+    # Compare on the test split
+    testImages = list_images(os.path.join(args.dataset, "images", "test"))
+    testLabels = os.path.join(args.dataset, "labels", "test")
+    comparison = {}
+    if not args.skip_pt:
+        comparison["pt"] = evaluate(create_backend("ultralytics", args.model).load(), testImages, testLabels)
+    for modelName, modelPath in models.items():
+        comparison[modelName] = evaluate(ONNX_Backend(modelPath).load(), testImages, testLabels)
+    print_report(comparison)
+    with open(os.path.join(args.output, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(comparison, f, indent=4)
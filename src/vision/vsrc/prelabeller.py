@@ -0,0 +1,107 @@
+"""
+Proposes oriented box labels for unlabelled images with the deployed model.
+A process pool runs the classifier over every image without a label, each worker
+loading the model once, and writes the detections as proposal label files next
+to a manifest of their confidences. The dataset builder shows the proposals so
+the annotator only has to accept or redraw them.
+Usage: python -m src.vision.vsrc.prelabeller ./datasets/full/resistor/imgs --labels ./datasets/full/resistor/labels
+"""
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import cv2
+from src.common.constants import INFERENCE_BACKEND
+from src.pi4.inference_backends import create_backend
+from src.vision.vsrc.labels import write_labels, normalise
+from src.vision.vsrc.model_quantiser import list_images
+from src.vision.vsrc.constants import PRECISION, PRELABEL_CONFIDENCE, PRELABEL_WORKERS, PROPOSALS_FOLDER, PROPOSALS_MANIFEST
+# Backend of each worker process, set by load_worker
+BACKEND = None
+
+def proposal_folder_for(labelFolder:str) -> str:
+    """
+    Get the proposals folder that sits next to a labels folder
+    """
+    return os.path.join(os.path.dirname(os.path.normpath(labelFolder)), PROPOSALS_FOLDER)
+
+def load_worker(backendName:str, modelPath:str) -> None:
+    """
+    Load the model once in each worker process
+    """
+    global BACKEND # pylint: disable=global-statement
+    BACKEND = create_backend(backendName, modelPath).load()
+
+def propose(task:tuple) -> dict:
+    """
+    Detect the components in one image and write them as a proposal, run in a worker process
+    """
+    imagePath, proposalFolder, confidence = task
+    entry = {"image" : imagePath, "label" : None, "classes" : [], "confidences" : []}
+    frame = cv2.imread(imagePath)
+    if frame is None:
+        return entry
+    detections = BACKEND.predict(frame)
+    # Most confident first, as the builder shows the first box
+    keep = numpy.argsort(-detections.conf)
+    keep = keep[detections.conf[keep] >= confidence]
+    if len(keep):
+        entry["label"] = os.path.join(proposalFolder, os.path.splitext(os.path.basename(imagePath))[0] + ".txt")
+        polygons = normalise(detections.boxes[keep].reshape(-1, 8), (frame.shape[1], frame.shape[0]))
+        write_labels(entry["label"], detections.cls[keep], polygons, PRECISION)
+        entry["classes"] = detections.cls[keep].astype(int).tolist()
+        entry["confidences"] = [round(float(conf), 4) for conf in detections.conf[keep]]
+    return entry
+
+def read_proposals(proposalFolder:str) -> dict:
+    """
+    Read the proposal manifest, keyed by image file name, label is None for images with nothing detected.
+    Lines that are incomplete, e.g. still being written by the pre-labeller, are skipped.
+    """
+    path = os.path.join(proposalFolder, PROPOSALS_MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    proposals = {}
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                proposals[os.path.basename(entry["image"])] = entry
+            except (ValueError, KeyError, TypeError):
+                continue
+    return proposals
+
+def prelabel(imageFolder:str, labelFolder:str, proposalFolder:str=None, backendName:str=INFERENCE_BACKEND, modelPath:str=None, \
+             confidence:float=PRELABEL_CONFIDENCE, workers:int=PRELABEL_WORKERS, overwrite:bool=False) -> int:
+    """
+    Write proposals for the images without a label, returns how many images got a proposal
+    """
+    proposalFolder = proposalFolder or proposal_folder_for(labelFolder)
+    os.makedirs(proposalFolder, exist_ok=True)
+    done = set() if overwrite else set(read_proposals(proposalFolder))
+    tasks = [(path, proposalFolder, confidence) for path in list_images(imageFolder) if os.path.basename(path) not in done and \
+             not os.path.isfile(os.path.join(labelFolder, os.path.splitext(os.path.basename(path))[0] + ".txt"))]
+    count = 0
+    # Entries are appended as they finish, so the builder can show proposals while the rest are running
+    with open(os.path.join(proposalFolder, PROPOSALS_MANIFEST), "w" if overwrite else "a", encoding="utf-8") as manifest, \
+        ProcessPoolExecutor(max_workers=workers, initializer=load_worker, initargs=(backendName, modelPath)) as executor:
+        for entry in executor.map(propose, tasks, chunksize=4):
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            count += entry["label"] is not None
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose labels for unlabelled images with the deployed model")
+    parser.add_argument("images", help="Folder of images to label")
+    parser.add_argument("--labels", required=True, help="Folder of existing labels, images with one are skipped")
+    parser.add_argument("--proposals", default=None, help="Where to write the proposals, defaults to a proposals folder next to the labels")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, help="Inference backend")
+    parser.add_argument("--model", default=None, help="Model path, defaults to the backend's deployed model")
+    parser.add_argument("--confidence", type=float, default=PRELABEL_CONFIDENCE, help="Lowest confidence to propose")
+    parser.add_argument("--workers", type=int, default=PRELABEL_WORKERS, help="Worker processes, each loads its own model")
+    parser.add_argument("--overwrite", action="store_true", help="Propose again for images that already have a proposal")
+    args = parser.parse_args()
+    proposed = prelabel(args.images, args.labels, args.proposals, args.backend, args.model, args.confidence, args.workers, args.overwrite)
+    print(f"Proposed labels for {proposed} images in {args.proposals or proposal_folder_for(args.labels)}")
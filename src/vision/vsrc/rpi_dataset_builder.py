@@ -3,27 +3,44 @@ This module grabs a screenshot from the Raspberry Pi and allows easy labelling o
 """
 # pylint: disable=consider-using-enumerate
 import os
+import time
+import threading
 from tkinter import Canvas, ALL
 import numpy
-import cv2
-import pyautogui
-import pygetwindow
 from PIL import Image, ImageTk
 from customtkinter import CTk, CTkButton, CTkLabel, CTkFrame, CTkEntry, StringVar, IntVar
+from src.common.capture_server import CaptureClient
+from src.common.constants import UNCERTAINTY_QUEUE_PATH
+from src.vision.vsrc.image_loader import ImageLoader
+from src.vision.vsrc.labels import read_labels, write_labels, normalise, denormalise
+from src.vision.vsrc.prelabeller import prelabel, read_proposals, proposal_folder_for
 from src.vision.vsrc.constants import LOWER_THRESHOLD, UPPER_THRESHOLD, BORDER_WIDTH, CAMERA_BORDER, BORDER_COLOUR, \
-    BORDER_COLOUR_FAILED, DISPLAY_IMG_SIZE, MAX_ROWS, REALVNC_WINDOW_NAME, PADDING, DATA, RESISTOR_BODY_COLOUR, DATASET_PATH, RECT_WIDTH, RECT_COLOUR, PRECISION, IMG_SIZE, DIRECTION_COLOUR
+    BORDER_COLOUR_FAILED, DISPLAY_IMG_SIZE, MAX_ROWS, REALVNC_WINDOW_NAME, CAPTURE_SERVER_URL, CAPTURE_RETRY_COOLDOWN, PADDING, DATA, RESISTOR_BODY_COLOUR, DATASET_PATH, RECT_WIDTH, RECT_COLOUR, PRECISION, IMG_SIZE, DIRECTION_COLOUR, \
+    PROPOSALS_MANIFEST
 
 class RPIDatasetBuilder:
-    def __init__(self, root:CTk, dataPath:str=False, labelPath:str=None) -> None:
+    def __init__(self, root:CTk, dataPath:str=False, labelPath:str=None, proposalPath:str=None) -> None:
         self.root = root
         # If datapath specified get a list of all the images in the folder
         self.dataSet = None
         self.dataPath = None
         self.labelPath = labelPath
         self.dataIndex = 0
+        self.captureClient = CaptureClient(CAPTURE_SERVER_URL)
+        # Time the capture server may be tried again after failing, so VNC captures do not wait for it every time
+        self.captureRetryTime = 0
+        # Labels proposed by the pre-labeller, shown for images without a label
+        self.proposalPath = proposalPath or (proposal_folder_for(labelPath) if labelPath else None)
+        self.proposals = dict()
+        self.proposalsMtime = None
+        self.prelabelThread = None
         if dataPath:
             self.dataPath = dataPath
             self.dataSet = os.listdir(dataPath)
+            # Frames from the uncertainty queue are shown most uncertain first
+            uncertainty = {name : entry.get("uncertainty", 0) for name, entry in self.load_proposals().items()}
+            self.dataSet.sort(key=lambda name: -uncertainty.get(name, 0))
+            self.imageLoader = ImageLoader([os.path.join(dataPath, f) for f in self.dataSet], DISPLAY_IMG_SIZE)
         self.root.title("RPi Dataset Builder")
         self.root.attributes("-topmost", True)
         # Variables
@@ -114,6 +131,7 @@ class RPIDatasetBuilder:
             self.root.bind_all("<Return>", lambda _: self.save_label())
             self.root.bind_all("<Left>", self.advance_image)
             self.root.bind_all("<Right>", self.advance_image)
+            self.root.bind_all("<Control-p>", self.start_prelabelling)
         else:
             self.root.bind_all("<Return>", lambda _: self.save_image())
             self.root.bind_all("<space>", self.capture_image)
@@ -199,6 +217,31 @@ class RPIDatasetBuilder:
         """
         Capture an image from the Raspberry Pi.
         """
+        frame = None
+        if time.time() >= self.captureRetryTime:
+            frame = self.captureClient.fetch()
+            if frame is None:
+                self.captureRetryTime = time.time() + CAPTURE_RETRY_COOLDOWN
+        if frame is not None:
+            # Full resolution camera frame straight from the sorter
+            self.screenshot = Image.fromarray(numpy.ascontiguousarray(frame[..., ::-1]))
+        else:
+            # Fall back to a screenshot of the VNC window
+            self.screenshot = self.capture_vnc()
+        if self.screenshot is None:
+            self.imgBorder.configure(bg_color=BORDER_COLOUR_FAILED)
+            return
+        self.imgDisplay.image = ImageTk.PhotoImage(self.screenshot.resize(DISPLAY_IMG_SIZE, Image.NEAREST))
+        self.update_image()
+
+    def capture_vnc(self) -> Image.Image:
+        """
+        Screenshot the RealVNC window and crop out the camera region inside the pink border, None if it cannot be found.
+        """
+        # Screen capture libraries are only needed here, so import on first use
+        import cv2 # pylint: disable=import-outside-toplevel
+        import pyautogui # pylint: disable=import-outside-toplevel
+        import pygetwindow # pylint: disable=import-outside-toplevel
         # Focus on the RealVNC window
         try:
             realVNCWindow = pygetwindow.getWindowsWithTitle(REALVNC_WINDOW_NAME)[0]
@@ -210,9 +253,8 @@ class RPIDatasetBuilder:
                 realVNCWindow.activate()
                 pygetwindow.getWindowsWithTitle("RPi Dataset Builder")[0].activate()
             except:
-                self.imgBorder.configure(bg_color=BORDER_COLOUR_FAILED)
                 print("No Window Found")
-                return
+                return None
         # Capture the image
         screenshotPil = pyautogui.screenshot(region=(realVNCWindow.left, realVNCWindow.top, realVNCWindow.width, realVNCWindow.height))
         # Convert to OpenCV format
@@ -220,18 +262,13 @@ class RPIDatasetBuilder:
         # Find the contours defined by the pink square
         mask = cv2.inRange(cv2.cvtColor(screenshotCv, cv2.COLOR_BGR2HSV), LOWER_THRESHOLD, UPPER_THRESHOLD)
         contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
+        if not contours:
+            return None
         # Find the largest contour in the mask
-            largestContour = max(contours, key=cv2.contourArea)
-            x, y, w, h = cv2.boundingRect(largestContour)
-            x, y, w, h = x+BORDER_WIDTH, y+BORDER_WIDTH, w-(BORDER_WIDTH*2), h-(BORDER_WIDTH*2)
-            cameraRegion = screenshotCv[y:y+h, x:x+w]
-            self.screenshot = Image.fromarray(cameraRegion)
-            self.imgDisplay.image = ImageTk.PhotoImage(self.screenshot.resize(DISPLAY_IMG_SIZE, Image.NEAREST))
-            self.update_image()
-        else:
-            self.imgBorder.configure(bg_color=BORDER_COLOUR_FAILED)
-        return
+        largestContour = max(contours, key=cv2.contourArea)
+        x, y, w, h = cv2.boundingRect(largestContour)
+        x, y, w, h = x+BORDER_WIDTH, y+BORDER_WIDTH, w-(BORDER_WIDTH*2), h-(BORDER_WIDTH*2)
+        return Image.fromarray(screenshotCv[y:y+h, x:x+w])
 
     def update_image(self) -> None:
         """
@@ -279,9 +316,8 @@ class RPIDatasetBuilder:
             return
         # Save label.txt
         classNum = DATA[self.currentComponent]["num_label"]
-        points = [(round(x / DISPLAY_IMG_SIZE[0], PRECISION), round(y / DISPLAY_IMG_SIZE[1], PRECISION)) for x, y in self.points]
-        with open(os.path.join(DATASET_PATH, foldername, 'labels', f"{self.componentName.get()}_{str(num)}.txt"), "w", encoding='utf-8') as f:
-            f.write(f"{classNum} {' '.join(f'{x} {y}' for x, y in points)}")
+        polygon = normalise(numpy.reshape(self.points, (1, -1)), DISPLAY_IMG_SIZE)
+        write_labels(os.path.join(DATASET_PATH, foldername, 'labels', f"{self.componentName.get()}_{str(num)}.txt"), [classNum], polygon, PRECISION)
         # Update the save counter
         self.save_indicator()
         if self.dataSet is not None and self.dataIndex != len(self.dataSet)-1:
@@ -298,9 +334,7 @@ class RPIDatasetBuilder:
         filename = os.path.basename(self.dataSet[self.dataIndex]).split(".")[0]
         labelpath = os.path.join(self.labelPath, f"{filename}.txt")
         classNum = DATA[self.currentComponent]["num_label"]
-        points = [(round(x / DISPLAY_IMG_SIZE[0], PRECISION), round(y / DISPLAY_IMG_SIZE[1], PRECISION)) for x, y in self.points]
-        with open(labelpath, "w", encoding='utf-8') as f:
-            f.write(f"{classNum} {' '.join(f'{x} {y}' for x, y in points)}")
+        write_labels(labelpath, [classNum], normalise(numpy.reshape(self.points, (1, -1)), DISPLAY_IMG_SIZE), PRECISION)
         self.save_indicator()
         if self.dataIndex != len(self.dataSet)-1:
             self.dataIndex += 1
@@ -336,8 +370,8 @@ class RPIDatasetBuilder:
             elif event.keysym == "Right" and self.dataIndex != len(self.dataSet)-1:
                 self.dataIndex += 1
         # Load the image
-        self.screenshot = Image.open(os.path.join(self.dataPath, self.dataSet[self.dataIndex]))
-        self.imgDisplay.image = ImageTk.PhotoImage(self.screenshot.resize(DISPLAY_IMG_SIZE, Image.NEAREST))
+        self.screenshot, displayImage = self.imageLoader.get(self.dataIndex)
+        self.imgDisplay.image = ImageTk.PhotoImage(displayImage)
         self.filename.set(self.dataSet[self.dataIndex])
         self.update_image()
         # If label in the label file, draw the rectangle
@@ -345,26 +379,61 @@ class RPIDatasetBuilder:
         filename = os.path.splitext(filename)[0]
         labelpath = os.path.join(self.labelPath, f"{filename}.txt")
         if os.path.isfile(labelpath):
-            with open(labelpath, "r", encoding='utf-8') as f:
-                label = f.readline().split(" ")
-                points = [(float(label[i]), float(label[i+1])) for i in range(1, len(label), 2)]
-                # Convert normalized coordinates back to image coordinates
-                points = [(x * DISPLAY_IMG_SIZE[0], y * DISPLAY_IMG_SIZE[1]) for x, y in points]
-                # Draw lines between points
-                self.points = points  # Save points for further use if necessary
-                self.lines = []  # Initialize lines list
-                for i in range(len(points)):
-                    x1, y1 = points[i]
-                    x2, y2 = points[(i + 1) % len(points)]
-                    if i == 0:
-                        self.lines.append(self.imgDisplay.create_line(x1, y1, x2, y2, fill=DIRECTION_COLOUR, width=RECT_WIDTH, arrow="last"))
-                    elif i == 1:
-                        self.lines.append(self.imgDisplay.create_line(x1, y1, x2, y2, fill=DIRECTION_COLOUR, width=RECT_WIDTH))
-                    else:
-                        self.lines.append(self.imgDisplay.create_line(x1, y1, x2, y2, fill=RECT_COLOUR, width=RECT_WIDTH))
-            self.imgDisplay.config(scrollregion=self.imgDisplay.bbox(ALL))
+            _, polygons = read_labels(labelpath)
+            self.draw_polygon(polygons)
+        else:
+            proposal = self.load_proposals().get(os.path.basename(self.dataSet[self.dataIndex]))
+            if proposal is not None and proposal["label"] is not None and os.path.isfile(proposal["label"]):
+                # Enter accepts the proposal as it is, clicking redraws it
+                classes, polygons = read_labels(proposal["label"])
+                component = {data["num_label"] : component for component, data in DATA.items()}.get(int(classes[0]))
+                self.currentComponent = component or self.currentComponent
+                self.filename.set(f"{self.dataSet[self.dataIndex]} - proposed {component} {proposal['confidences'][0]:.0%}")
+                self.draw_polygon(polygons)
+        self.imgDisplay.config(scrollregion=self.imgDisplay.bbox(ALL))
         return
 
+    def draw_polygon(self, polygons:numpy.ndarray) -> None:
+        """
+        Draw the first of the normalised polygons of a label.
+        """
+        # Convert normalized coordinates back to image coordinates
+        points = [tuple(point) for point in denormalise(polygons[:1], DISPLAY_IMG_SIZE).reshape(-1, 2).tolist()]
+        # Draw lines between points
+        self.points = points  # Save points for further use if necessary
+        self.lines = []  # Initialize lines list
+        for i in range(len(points)):
+            x1, y1 = points[i]
+            x2, y2 = points[(i + 1) % len(points)]
+            if i == 0:
+                self.lines.append(self.imgDisplay.create_line(x1, y1, x2, y2, fill=DIRECTION_COLOUR, width=RECT_WIDTH, arrow="last"))
+            elif i == 1:
+                self.lines.append(self.imgDisplay.create_line(x1, y1, x2, y2, fill=DIRECTION_COLOUR, width=RECT_WIDTH))
+            else:
+                self.lines.append(self.imgDisplay.create_line(x1, y1, x2, y2, fill=RECT_COLOUR, width=RECT_WIDTH))
+
+    def load_proposals(self) -> dict:
+        """
+        Get the proposals, reading the manifest again if the pre-labeller has added to it.
+        """
+        if self.proposalPath is None:
+            return {}
+        path = os.path.join(self.proposalPath, PROPOSALS_MANIFEST)
+        mtime = os.path.getmtime(path) if os.path.isfile(path) else None
+        if mtime != self.proposalsMtime:
+            self.proposals, self.proposalsMtime = read_proposals(self.proposalPath), mtime
+        return self.proposals
+
+    def start_prelabelling(self, _:object) -> None:
+        """
+        Propose labels for the unlabelled images in a background process pool, they appear as the images are reached.
+        """
+        if self.prelabelThread is not None and self.prelabelThread.is_alive():
+            return
+        self.saveStr.set("Pre-labelling in the background")
+        self.prelabelThread = threading.Thread(target=prelabel, args=(self.dataPath, self.labelPath, self.proposalPath), daemon=True)
+        self.prelabelThread.start()
+
     def component_selection_panel(self) -> None:
         """
         Display the component selection buttons.
@@ -538,6 +607,11 @@ class RPIDatasetBuilder:
         return
 
 if __name__ == "__main__":
+    REVIEW_UNCERTAIN = False
     main = CTk()
-    obj = RPIDatasetBuilder(main)
+    if REVIEW_UNCERTAIN:
+        # Label the frames the sorter was least sure about
+        obj = RPIDatasetBuilder(main, os.path.join(UNCERTAINTY_QUEUE_PATH, "imgs"), os.path.join(UNCERTAINTY_QUEUE_PATH, "labels"))
+    else:
+        obj = RPIDatasetBuilder(main)
     main.mainloop()
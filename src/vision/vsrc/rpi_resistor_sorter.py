@@ -5,15 +5,19 @@ import os
 import re
 from random import randint
 from tkinter import Canvas
+import numpy
 from PIL import Image, ImageTk
 from customtkinter import CTk, CTkToplevel, StringVar, CTkLabel, CTkFrame
 from src.vision.vsrc.constants import DISPLAY_IMG_SIZE, PADDING, DATA
+from src.vision.vsrc.image_loader import ImageLoader
+from src.vision.vsrc.labels import read_labels, write_labels, normalise, denormalise, boxes_to_corners, corners_to_boxes
 
 class ResistorTrainer:
     def __init__(self, root:CTk, dataPath:str, labelPath:str) -> None:
         self.root = root
         self.dataPath = dataPath
         self.dataSet = os.listdir(dataPath)
+        self.imageLoader = ImageLoader([os.path.join(dataPath, f) for f in self.dataSet], resample=Image.BICUBIC)
         self.labelPath = labelPath
         self.dataIndex = -1
         self.colourMap = {k: i for i, (k, _) in enumerate(DATA["resistors"]["values"].items())}
@@ -89,9 +93,10 @@ class ResistorTrainer:
             self.dataIndex = len(self.dataSet) - 1
             return
         # Load the image
-        self.screenshot = Image.open(os.path.join(self.dataPath, self.dataSet[self.dataIndex]))
-        scaleFactor = self.imgDisplay.winfo_height() / self.screenshot.height
-        self.imgDisplay.image = ImageTk.PhotoImage(self.screenshot.resize((int(self.screenshot.width * scaleFactor), int(self.screenshot.height * scaleFactor))))
+        # Images are scaled to the height of the canvas, which may have been resized
+        self.imageLoader.displaySize = self.imgDisplay.winfo_height()
+        self.screenshot, displayImage = self.imageLoader.get(self.dataIndex)
+        self.imgDisplay.image = ImageTk.PhotoImage(displayImage)
         self.bandDisplay.set("Stem")
         self.update_image()
         # Load label if it exists
@@ -105,28 +110,15 @@ class ResistorTrainer:
             for box in self.bandBoxes:
                 self.imgDisplay.delete(box)
             self.bandBoxes = []
-            with open(os.path.join(self.labelPath, self.dataSet[self.dataIndex].replace(".png", ".txt")), "r", encoding="utf-8") as f:
-                lines = f.readlines()
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith("42") or line.startswith("12"):
-                        # Stem
-                        parts = line.split(" ")
-                        xCenter, yCenter, width, height = map(float, parts[1:])
-                        x1 = xCenter * self.imgDisplay.image.width() - width * self.imgDisplay.image.width() / 2
-                        y1 = yCenter * self.imgDisplay.image.height() - height * self.imgDisplay.image.height() / 2
-                        x2 = xCenter * self.imgDisplay.image.width() + width * self.imgDisplay.image.width() / 2
-                        y2 = yCenter * self.imgDisplay.image.height() + height * self.imgDisplay.image.height() / 2
-                        self.stemBox = self.imgDisplay.create_rectangle(x1, y1, x2, y2, outline="yellow", width=3)
-                    else:
-                        # Bands
-                        parts = line.split(" ")
-                        xCenter, yCenter, width, height = map(float, parts[1:])
-                        x1 = xCenter * self.imgDisplay.image.width() - width * self.imgDisplay.image.width() / 2
-                        y1 = yCenter * self.imgDisplay.image.height() - height * self.imgDisplay.image.height() / 2
-                        x2 = xCenter * self.imgDisplay.image.width() + width * self.imgDisplay.image.width() / 2
-                        y2 = yCenter * self.imgDisplay.image.height() + height * self.imgDisplay.image.height() / 2
-                        self.bandBoxes.append(self.imgDisplay.create_rectangle(x1, y1, x2, y2, outline="red", width=3))
+            classes, boxes = read_labels(os.path.join(self.labelPath, self.dataSet[self.dataIndex].replace(".png", ".txt")))
+            corners = denormalise(boxes_to_corners(boxes), (self.imgDisplay.image.width(), self.imgDisplay.image.height()))
+            for cls, (x1, y1, x2, y2) in zip(classes.tolist(), corners.tolist()):
+                if cls in (12, 42):
+                    # Stem
+                    self.stemBox = self.imgDisplay.create_rectangle(x1, y1, x2, y2, outline="yellow", width=3)
+                else:
+                    # Bands
+                    self.bandBoxes.append(self.imgDisplay.create_rectangle(x1, y1, x2, y2, outline="red", width=3))
             self.update_box_colours()
         else:
             self.labelUpdate.configure(fg_color="transparent")
@@ -263,31 +255,17 @@ class ResistorTrainer:
             # If the stem is below the average y value, then it is at the bottom
             reverse = stemBox[1] > avgY
             # Determine coords of resistor bands according to yolov8 format
-            coords = []
-            for box in self.bandBoxes:
-                boxCoords = self.imgDisplay.coords(box)
-                xCenter = (boxCoords[0] + boxCoords[2]) / (2 * self.imgDisplay.image.width())
-                yCenter = (boxCoords[1] + boxCoords[3]) / (2 * self.imgDisplay.image.height())
-                width = (boxCoords[2] - boxCoords[0]) / self.imgDisplay.image.width()
-                height = (boxCoords[3] - boxCoords[1]) / self.imgDisplay.image.height()
-                coords.append((xCenter, yCenter, width, height))
+            size = (self.imgDisplay.image.width(), self.imgDisplay.image.height())
+            coords = corners_to_boxes(normalise([self.imgDisplay.coords(box) for box in self.bandBoxes], size))
             # Assign label to resistor bands with the one closest to the stem being the first band
-            coords.sort(key=lambda x: x[1]) # sort by yCenter
-            finalLabel = []
-            # Add stem label
-            stemCoords = self.imgDisplay.coords(self.stemBox)
-            xCenter = (stemCoords[0] + stemCoords[2]) / (2 * self.imgDisplay.image.width())
-            yCenter = (stemCoords[1] + stemCoords[3]) / (2 * self.imgDisplay.image.height())
-            width = (stemCoords[2] - stemCoords[0]) / self.imgDisplay.image.width()
-            height = (stemCoords[3] - stemCoords[1]) / self.imgDisplay.image.height()
-            finalLabel.append(f"42 {xCenter} {yCenter} {width} {height}")
+            coords = coords[numpy.argsort(coords[:, 1], kind="stable")] # sort by yCenter
             if reverse:
-                finalLabel += [f"{label[i]} {x[0]} {x[1]} {x[2]} {x[3]}" for i, x in enumerate(coords[::-1])]
-            else:
-                finalLabel += [f"{label[i]} {x[0]} {x[1]} {x[2]} {x[3]}" for i, x in enumerate(coords)]
+                coords = coords[::-1]
+            # Add stem label
+            stemCoords = corners_to_boxes(normalise(self.imgDisplay.coords(self.stemBox), size))
+            classes = [42] + [label[i] for i in range(len(coords))]
             # Save the label
-            with open(os.path.join(self.labelPath, self.dataSet[self.dataIndex].replace(".png", ".txt")), "w", encoding="utf-8") as f:
-                f.write("\n".join(finalLabel))
+            write_labels(os.path.join(self.labelPath, self.dataSet[self.dataIndex].replace(".png", ".txt")), classes, numpy.concatenate([stemCoords, coords]))
             self.saveLabel.configure(text="Saved")
             self.flash_box()
         else:
@@ -0,0 +1,187 @@
+"""
+Reproducible training and export jobs for the classifier.
+A job config names the base model, the dataset and the train, export and
+benchmark settings. The runner updates the dataset index, writes the split lists
+and the class names from DATA, trains, exports and quantises the model, scores
+every export on the test split and keeps it all in a new numbered artifact
+folder with a metrics file, so every model can be traced back to how it was made.
+Usage: python -m src.vision.vsrc.training_runner ./src/vision/models/recipes/classifier_job.yaml --epochs 1 --device cpu
+"""
+import os
+import json
+import time
+import shutil
+import random
+import hashlib
+import argparse
+import subprocess
+import yaml
+from src.common.constants import CLASSIFIER_PATH, ONNX_CLASSIFIER_PATH
+from src.pi4.inference_backends import create_backend
+from src.vision.vsrc.constants import DATA, TRAINING_JOB_CONFIG, MODEL_ARTIFACT_PATH
+from src.vision.vsrc.dataset_index import SPLITS, DatasetIndex
+from src.vision.vsrc.model_quantiser import evaluate, print_report, quantise_dynamic, quantise_static
+
+def load_config(path:str) -> dict:
+    """
+    Read a job config
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+def next_version(output:str, name:str) -> str:
+    """
+    Folder for the next version of a model: name_v1, name_v2 and so on
+    """
+    os.makedirs(output, exist_ok=True)
+    versions = [int(folder.rsplit("_v", 1)[1]) for folder in os.listdir(output) if folder.startswith(f"{name}_v") and folder.rsplit("_v", 1)[1].isdigit()]
+    return os.path.join(output, f"{name}_v{max(versions, default=0) + 1}")
+
+def git_commit() -> str:
+    """
+    Commit the code was at, None outside a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def build_split(datasetConfig:dict, folder:str) -> tuple:
+    """
+    Update the index and write the split lists and the dataset file, returns the dataset file's path and the dataset stats
+    """
+    index = DatasetIndex(datasetConfig["index"])
+    try:
+        update = index.update(datasetConfig["root"])
+        if datasetConfig.get("resplit"):
+            index.resplit(tuple(datasetConfig.get("ratios", (0.8, 0.1, 0.1))), datasetConfig.get("seed", 0))
+        listFolder = os.path.join(folder, "splits")
+        lists = index.export_lists(listFolder)
+        listed = {image : split for split in SPLITS for image in lists[split]}
+        classCounts = {split : {} for split in SPLITS}
+        for image, cls, count in index.connection.execute("SELECT image, cls, count FROM classes ORDER BY image, cls"):
+            split = listed.get(os.path.abspath(image))
+            if split is not None:
+                classCounts[split][cls] = classCounts[split].get(cls, 0) + count
+        # Hash the contents of every listed image and label, which identifies the exact data trained on whatever the index holds later
+        contents = {split : hashlib.sha1() for split in SPLITS}
+        for image, imageHash, labelHash in index.connection.execute("SELECT image, imageHash, labelHash FROM files ORDER BY image"):
+            split = listed.get(os.path.abspath(image))
+            if split is not None:
+                contents[split].update(f"{imageHash} {labelHash}\n".encode("utf-8"))
+        stats = {
+            "index" : update,
+            "images" : {split : len(lists[split]) for split in SPLITS},
+            "classes" : classCounts,
+            "hashes" : {split : contents[split].hexdigest() for split in SPLITS},
+        }
+    finally:
+        index.close()
+    # Class names come from DATA, so new component types are picked up without editing a dataset file
+    dataset = {"path" : os.path.abspath(listFolder), **{split : f"{split}.txt" for split in SPLITS}, \
+               "names" : {data["num_label"] : data["label"] for data in sorted(DATA.values(), key=lambda data: data["num_label"])}}
+    datasetPath = os.path.join(folder, "dataset.yaml")
+    with open(datasetPath, "w", encoding="utf-8") as f:
+        yaml.safe_dump(dataset, f, sort_keys=False)
+    return datasetPath, stats
+
+def train_model(config:dict, datasetPath:str, folder:str) -> tuple:
+    """
+    Train from the base model and validate on the test split, returns the trained model's path and the validation metrics
+    """
+    from ultralytics import YOLO # pylint: disable=import-outside-toplevel
+    YOLO(config["model"]).train(data=datasetPath, project=os.path.abspath(folder), name="train", exist_ok=True, **config.get("train", {}))
+    modelPath = os.path.join(folder, f"{config['name']}.pt")
+    shutil.copy(os.path.join(folder, "train", "weights", "best.pt"), modelPath)
+    trainConfig = config.get("train", {})
+    metrics = YOLO(modelPath).val(data=datasetPath, split="test", imgsz=trainConfig.get("imgsz", 640), device=trainConfig.get("device"), \
+                                  project=os.path.abspath(folder), name="test", exist_ok=True, plots=False)
+    return modelPath, {key : float(value) for key, value in metrics.results_dict.items()}
+
+def export_model(modelPath:str, exportConfig:dict, imgsz:int, calibrationImages:list) -> dict:
+    """
+    Export the trained model to each format and quantise the ONNX export, returns the path of every model by name
+    """
+    from ultralytics import YOLO # pylint: disable=import-outside-toplevel
+    models = {"pt" : modelPath}
+    for exportFormat in exportConfig.get("formats", []):
+        options = {"opset" : exportConfig["opset"], "simplify" : True} if exportFormat == "onnx" and "opset" in exportConfig else {}
+        models[exportFormat] = YOLO(modelPath).export(format=exportFormat, imgsz=imgsz, **options)
+    if "onnx" in models:
+        stem = os.path.splitext(modelPath)[0]
+        for method in exportConfig.get("quantise", []):
+            if method == "dynamic":
+                models["int8-dynamic"] = quantise_dynamic(models["onnx"], f"{stem}_int8_dynamic.onnx")
+            elif method == "static":
+                calibration = random.Random(0).sample(calibrationImages, min(exportConfig.get("calibration", 200), len(calibrationImages)))
+                models["int8-static"] = quantise_static(models["onnx"], f"{stem}_int8_static.onnx", calibration)
+            else:
+                raise ValueError(f"Unknown quantisation {method}, expected dynamic or static")
+    return models
+
+def benchmark(models:dict, testImages:list) -> dict:
+    """
+    Score every model that has an inference backend on the test images for accuracy and latency
+    """
+    results = {}
+    for name, path in models.items():
+        backendName = {".pt" : "ultralytics", ".onnx" : "onnx"}.get(os.path.splitext(str(path))[1])
+        if backendName is not None:
+            results[name] = evaluate(create_backend(backendName, str(path)).load(), testImages)
+    return results
+
+def deploy(models:dict) -> None:
+    """
+    Copy the trained model and its ONNX export to where the sorter loads them from
+    """
+    shutil.copy(models["pt"], CLASSIFIER_PATH)
+    if "onnx" in models:
+        shutil.copy(models["onnx"], ONNX_CLASSIFIER_PATH)
+
+def run_job(config:dict) -> str:
+    """
+    Run a job into a new artifact folder, returns the folder
+    """
+    folder = next_version(config.get("output", MODEL_ARTIFACT_PATH), config["name"])
+    os.makedirs(folder)
+    with open(os.path.join(folder, "config.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    metrics = {"name" : os.path.basename(folder), "commit" : git_commit(), "started" : time.strftime("%Y-%m-%d %H:%M:%S"), "seconds" : {}}
+    def step(name:str, function:callable, *args) -> object:
+        start = time.time()
+        print(f"{name}...")
+        result = function(*args)
+        metrics["seconds"][name] = round(time.time() - start, 1)
+        return result
+    datasetPath, metrics["dataset"] = step("split", build_split, config["dataset"], folder)
+    modelPath, metrics["validation"] = step("train", train_model, config, datasetPath, folder)
+    with open(os.path.join(folder, "splits", "train.txt"), "r", encoding="utf-8") as f:
+        trainImages = f.read().split()
+    with open(os.path.join(folder, "splits", "test.txt"), "r", encoding="utf-8") as f:
+        testImages = f.read().split()
+    models = step("export", export_model, modelPath, config.get("export", {}), config.get("train", {}).get("imgsz", 640), trainImages)
+    benchmarkImages = random.Random(0).sample(testImages, min(config.get("benchmark", {}).get("images", 100), len(testImages)))
+    metrics["benchmark"] = step("benchmark", benchmark, models, benchmarkImages)
+    metrics["models"] = {name : os.path.relpath(str(path), folder) for name, path in models.items()}
+    with open(os.path.join(folder, "metrics.json"), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=4)
+    print_report(metrics["benchmark"])
+    if config.get("deploy"):
+        deploy(models)
+        print(f"Deployed to {CLASSIFIER_PATH}")
+    return folder
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train, export and benchmark the classifier from a job config")
+    parser.add_argument("config", nargs="?", default=TRAINING_JOB_CONFIG, help="Job config")
+    parser.add_argument("--epochs", type=int, default=None, help="Override the number of epochs, for quick tests")
+    parser.add_argument("--device", default=None, help="Override the training device, cpu or a GPU number")
+    parser.add_argument("--deploy", action="store_true", help="Deploy the model even if the config does not")
+    args = parser.parse_args()
+    jobConfig = load_config(args.config)
+    if args.epochs is not None:
+        jobConfig.setdefault("train", {})["epochs"] = args.epochs
+    if args.device is not None:
+        jobConfig.setdefault("train", {})["device"] = args.device
+    jobConfig["deploy"] = jobConfig.get("deploy", False) or args.deploy
+    print(f"Artifacts written to {run_job(jobConfig)}")